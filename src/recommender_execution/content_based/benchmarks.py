@@ -0,0 +1,437 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Content-Based Benchmarks
+Usage (from src/recommender_execution): python -m content_based.benchmarks <benchmark> [options]
+"""
+import os
+import time
+import random
+import tempfile
+import multiprocessing
+import unicodecsv
+from argparse import ArgumentParser
+from csv import QUOTE_NONNUMERIC
+
+import numpy as np
+from gensim import similarities
+
+from model import EventContentModel, _HTMLStripper, _PreProcessPipeline, _strip_html_and_convert_entities, \
+                  _read_event_rows
+from similarity import DenseSimilarityIndex, IvfSimilarityIndex
+from event_recommender import read_partition_data, cb_recommend, UserProfileConf
+from user_profiles import UserProfileSum
+
+CONTENT_COLUMNS = ["name", "description"]
+PRE_PROCESSMENT = {"text": [], "word": ['strip_punctuations', 'remove_stop_words', 'get_stemmed_words']}
+
+##############################################################################
+# AUXILIAR FUNCTIONS
+##############################################################################
+_WORDS = (u"hiking trail mountain coffee python meetup java startup yoga dance salsa music jazz rock "
+          u"photography camera wine tasting beer brewing book club reading writers poetry chess board "
+          u"games running marathon cycling bike soccer tennis volunteer community garden cooking vegan "
+          u"food networking business entrepreneurs marketing design data science machine learning cloud "
+          u"spanish french language exchange meditation parents kids family dogs caf\xe9 r\xe9sum\xe9 "
+          u"S\xe3o pi\xf1ata the and of to in for with our 2015 7pm $10").split()
+
+def _generate_event_texts(num_events, seed=0, vocabulary_size=20000):
+    """
+    Generate a realistic mix of event texts: short plain names and descriptions of which
+    some are plain text and some have HTML markup and entities (like the Meetup descriptions)
+    The words follow a skewed (Zipf-like) distribution over a vocabulary of common and made-up words
+    """
+    rand = random.Random(seed)
+    syllables = [u"ka", u"lo", u"mi", u"ten", u"ra", u"vu", u"sol", u"pe", u"dri", u"an", u"cor", u"zu"]
+    vocabulary = _WORDS + [u"".join(rand.choice(syllables) for _ in range(rand.randint(2, 4)))
+                           for _ in range(vocabulary_size)]
+
+    def words(num_words):
+        """ Random sentence """
+        return u" ".join(vocabulary[int(len(vocabulary) * rand.random() ** 3)] for _ in range(num_words))
+
+    texts = []
+    for _ in range(num_events):
+        texts.append(words(rand.randint(2, 8)))
+        if rand.random() < 0.5:
+            texts.append(words(rand.randint(10, 150)))
+        else:
+            texts.append(u"<p>%s <b>%s</b></p><br/><ul><li>%s &amp; %s</li></ul><p>AT&T &quot;%s&quot; &#39;</p>" %
+                         (words(rand.randint(5, 60)), words(3), words(10), words(10), words(4)))
+    return texts
+
+def _read_event_texts(corpus_filename):
+    """ Read the name and description of every event in the corpus """
+    texts = []
+    for _, event_content in _read_event_rows(corpus_filename):
+        texts.extend([event_content['name'], event_content['description']])
+    return texts
+
+def _get_corpus_filename(args):
+    """ The corpus given in the args or a generated one (written in a temporary TSV file) """
+    if args.corpus:
+        return args.corpus
+
+    texts = _generate_event_texts(args.num_events)
+    corpus_file, corpus_filename = tempfile.mkstemp(suffix=".tsv", prefix="event-name-desc_")
+    with os.fdopen(corpus_file, "w") as csv_file:
+        csv_writer = unicodecsv.writer(csv_file, encoding="utf-8", delimiter='\t', escapechar='\\',
+                                       quoting=QUOTE_NONNUMERIC)
+        for event_index in range(args.num_events):
+            csv_writer.writerow([event_index + 1, texts[2 * event_index], texts[2 * event_index + 1]])
+    return corpus_filename
+
+def _train_event_model(corpus_filename, algorithm, hyper_parameters, no_below_freq=2):
+    """ Read, post-process and train an EventContentModel """
+    event_cb_model = EventContentModel(PRE_PROCESSMENT, algorithm, hyper_parameters, "benchmark")
+    event_cb_model.read_and_pre_process_corpus(corpus_filename, CONTENT_COLUMNS, single_pass=True)
+    event_cb_model.post_process_corpus(["filter_extreme_words"], {'no_below_freq': no_below_freq}, {},
+                                       CONTENT_COLUMNS)
+    event_cb_model.train_model()
+    return event_cb_model
+
+def _legacy_strip_html_and_convert_entities(html):
+    """ Previous implementation: a new parser for every text (even without markup) """
+    parser = _HTMLStripper()
+    parser.feed(html)
+    parser.feed(' ')
+    parser.close()
+    return parser.unescape(parser.get_data())
+
+def _top_k(query_similarities, k):
+    """ The set of the k most similar (and scored, i.e. finite) documents """
+    scored = np.flatnonzero(np.isfinite(query_similarities))
+    return set(scored[np.argsort(-query_similarities[scored], kind='mergesort')[:k]])
+
+def _best_time(function, repeats):
+    """ Best wall time (in seconds) of function() over the repeats """
+    best = None
+    for _ in range(repeats):
+        start_time = time.time()
+        function()
+        elapsed = time.time() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+##############################################################################
+# BENCHMARKS
+##############################################################################
+def benchmark_html(args):
+    """ HTML stripping: legacy parser per text VS markup-free fast path + reusable parser """
+    if args.corpus:
+        texts = _read_event_texts(args.corpus)
+    else:
+        texts = _generate_event_texts(args.num_events)
+    num_markup = sum(1 for text in texts if u'<' in text or u'&' in text)
+    print "Texts: %d (%d with '<' or '&')" % (len(texts), num_markup)
+
+    # The output must be the same (and thus the same tokens)
+    parser = _HTMLStripper()
+    num_diffs = sum(1 for text in texts
+                    if _legacy_strip_html_and_convert_entities(text) != _strip_html_and_convert_entities(text, parser))
+    print "Texts with a different output: %d" % num_diffs
+
+    pre_process_pipeline = _PreProcessPipeline({"text": [],
+                                                "word": ['strip_punctuations', 'remove_stop_words', 'get_stemmed_words']})
+
+    legacy_time = _best_time(lambda: [_legacy_strip_html_and_convert_entities(text) for text in texts], args.repeats)
+    fast_time = _best_time(lambda: [_strip_html_and_convert_entities(text, parser) for text in texts], args.repeats)
+    pipeline_time = _best_time(lambda: [pre_process_pipeline.extract_words([text]) for text in texts], args.repeats)
+
+    print "Legacy HTML stripping:    %.3fs (%.0f texts/sec)" % (legacy_time, len(texts) / legacy_time)
+    print "Fast path HTML stripping: %.3fs (%.0f texts/sec) - speedup %.2fx" % (fast_time, len(texts) / fast_time,
+                                                                             legacy_time / fast_time)
+    print "Full pre-processment (fast path): %.3fs (%.0f texts/sec)" % (pipeline_time, len(texts) / pipeline_time)
+
+def benchmark_index(args):
+    """ Query latency and memory: SparseMatrixSimilarity VS DenseSimilarityIndex (latent models) """
+    corpus_filename = _get_corpus_filename(args)
+    event_cb_model = _train_event_model(corpus_filename, args.algorithm,
+                                        {'num_topics': args.num_topics, 'num_corpus_passes': 1,
+                                         'num_iterations': 50})
+    if event_cb_model.tfidf_model:
+        transformed_corpus = list(event_cb_model.model[event_cb_model.tfidf_model[event_cb_model.corpus_of_bows]])
+    else:
+        transformed_corpus = list(event_cb_model.model[event_cb_model.corpus_of_bows])
+
+    sparse_index = similarities.SparseMatrixSimilarity(transformed_corpus,
+                                                       num_features=len(event_cb_model.dictionary))
+    dense_index = DenseSimilarityIndex(transformed_corpus, num_features=args.num_topics)
+    queries = random.Random(0).sample(transformed_corpus, min(args.num_queries, len(transformed_corpus)))
+
+    max_diff = max(abs(sparse_index[query] - dense_index[query]).max() for query in queries)
+    sparse_time = _best_time(lambda: [sparse_index[query] for query in queries], args.repeats)
+    dense_time = _best_time(lambda: [dense_index[query] for query in queries], args.repeats)
+    sparse_bytes = sum(array.nbytes for array in (sparse_index.index.data, sparse_index.index.indices,
+                                                  sparse_index.index.indptr))
+
+    print "%s (%d topics): %d indexed events, %d queries" % (args.algorithm, args.num_topics,
+                                                           len(transformed_corpus), len(queries))
+    print "Max similarity difference: %.2g" % max_diff
+    print "Sparse index: %8.1f us/query, %8.1f KB" % (1e6 * sparse_time / len(queries), sparse_bytes / 1024.0)
+    print "Dense index:  %8.1f us/query, %8.1f KB" % (1e6 * dense_time / len(queries), dense_index.nbytes() / 1024.0)
+
+    if not args.corpus:
+        os.remove(corpus_filename)
+
+def benchmark_ann(args):
+    """ Recall@k and query latency of the approximate (IVF) index against the exact dense index """
+    if args.partition_dir:
+        # Real partition: the test events are indexed and the queries are the test users profiles (SUM)
+        corpus_filename = os.path.join(args.partition_dir, "event-name-desc_all.tsv")
+        event_cb_model = _train_event_model(corpus_filename, args.algorithm,
+                                            {'num_topics': args.num_topics, 'num_corpus_passes': 1,
+                                             'num_iterations': 50}, no_below_freq=args.no_below_freq)
+        partition_data = read_partition_data(args.partition_dir, args.partition_number)
+        indexed_event_ids = partition_data['test_events']
+        dict_user_events_train = partition_data['dict_user_events_train']
+        queries = [UserProfileSum({}, dict_user_events_train[user], event_cb_model, {}).get()
+                   for user in sorted(partition_data['test_users']) if user in dict_user_events_train]
+        queries = random.Random(0).sample(queries, min(args.num_queries, len(queries)))
+    else:
+        # Generated corpus: all events are indexed and the queries are some of them
+        corpus_filename = _get_corpus_filename(args)
+        event_cb_model = _train_event_model(corpus_filename, args.algorithm,
+                                            {'num_topics': args.num_topics, 'num_corpus_passes': 1,
+                                             'num_iterations': 50}, no_below_freq=args.no_below_freq)
+        indexed_event_ids = None
+        queries = random.Random(0).sample(list(event_cb_model.transform_events()),
+                                          min(args.num_queries, len(event_cb_model.corpus_of_bows)))
+        if not args.corpus:
+            os.remove(corpus_filename)
+
+    transformed_corpus = list(event_cb_model.transform_events(indexed_event_ids))
+    exact_index = DenseSimilarityIndex(transformed_corpus, num_features=args.num_topics)
+    exact_top_k = [_top_k(exact_index[query], args.k) for query in queries]
+    exact_time = _best_time(lambda: [exact_index[query] for query in queries], args.repeats)
+
+    start_time = time.time()
+    ivf_index = IvfSimilarityIndex(transformed_corpus, num_features=args.num_topics,
+                                   num_clusters=args.num_clusters)
+    print "%s (%d topics): %d indexed events, %d queries, %d clusters (built in %.1fs)" % (
+        args.algorithm, args.num_topics, len(exact_index), len(queries), ivf_index.num_clusters,
+        time.time() - start_time)
+    print "Exact index: %8.1f us/query" % (1e6 * exact_time / len(queries))
+
+    for nprobe in args.nprobe:
+        ivf_index.nprobe = nprobe
+        recalls = [len(_top_k(ivf_index[query], args.k) & exact) / float(max(len(exact), 1))
+                   for query, exact in zip(queries, exact_top_k)]
+        ivf_time = _best_time(lambda: [ivf_index[query] for query in queries], args.repeats)
+        print "IVF nprobe=%4d: recall@%d = %.4f, %8.1f us/query (speedup %.2fx)" % (
+            nprobe, args.k, np.mean(recalls), 1e6 * ivf_time / len(queries), exact_time / ivf_time)
+
+def benchmark_lda(args):
+    """ Training wall time and held-out perplexity: single process LDA VS multicore LDA """
+    corpus_filename = _get_corpus_filename(args)
+    event_cb_model = EventContentModel(PRE_PROCESSMENT, "LDA", {}, "benchmark")
+    event_cb_model.read_and_pre_process_corpus(corpus_filename, CONTENT_COLUMNS, single_pass=True)
+    event_cb_model.post_process_corpus(["filter_extreme_words"], {'no_below_freq': args.no_below_freq}, {},
+                                       CONTENT_COLUMNS)
+    if not args.corpus:
+        os.remove(corpus_filename)
+
+    # The last documents are held-out to evaluate the perplexity
+    corpus_of_bows = list(event_cb_model.corpus_of_bows)
+    num_held_out = int(len(corpus_of_bows) * args.held_out)
+    train_bows, held_out_bows = corpus_of_bows[:-num_held_out], corpus_of_bows[-num_held_out:]
+    print "LDA (%d topics, %d passes, %d iterations): %d train and %d held-out events" % (
+        args.num_topics, args.num_corpus_passes, args.num_iterations, len(train_bows), len(held_out_bows))
+
+    single_process_time = None
+    for workers in [1] + args.workers:
+        event_cb_model.hyper_parameters = {'num_topics': args.num_topics,
+                                           'num_corpus_passes': args.num_corpus_passes,
+                                           'num_iterations': args.num_iterations,
+                                           'workers': workers}
+        event_cb_model.corpus_of_bows = train_bows
+        start_time = time.time()
+        event_cb_model.train_model()
+        elapsed = time.time() - start_time
+        single_process_time = single_process_time or elapsed
+
+        perplexity = 2 ** -event_cb_model.model.log_perplexity(held_out_bows, total_docs=len(corpus_of_bows))
+        print "%-22s %8.1fs (speedup %.2fx), held-out perplexity %.1f" % (
+            "Single process:" if workers == 1 else "Multicore (%d workers):" % workers,
+            elapsed, single_process_time / elapsed, perplexity)
+
+def benchmark_hashing(args):
+    """ Training time and recommendation agreement: dictionary VS hashing vocabulary """
+    if args.partition_dir:
+        corpus_filename = os.path.join(args.partition_dir, "event-name-desc_all.tsv")
+    else:
+        corpus_filename = _get_corpus_filename(args)
+    hyper_parameters = {'num_topics': args.num_topics, 'num_corpus_passes': 1, 'num_iterations': 50}
+
+    def train(hash_features):
+        """ Train a model (with the dictionary or the hashing vocabulary) and measure its time """
+        model_hyper_parameters = dict(hyper_parameters)
+        if hash_features:
+            model_hyper_parameters['hash_features'] = hash_features
+        start_time = time.time()
+        event_cb_model = _train_event_model(corpus_filename, args.algorithm, model_hyper_parameters,
+                                            no_below_freq=args.no_below_freq)
+        return event_cb_model, time.time() - start_time
+
+    def agreement(event_cb_model, reference_model):
+        """
+        Real partition: mean overlap of the top-100 recommendations (SUM profile) of the test users
+        Generated corpus: mean overlap of the 10 nearest neighbours of a sample of events
+        """
+        if args.partition_dir:
+            user_profile_conf = UserProfileConf(name="SUM", params={}, params_name="")
+            partition_data = read_partition_data(args.partition_dir, args.partition_number)
+            recs = cb_recommend(event_cb_model, user_profile_conf, {}, args.partition_dir, args.partition_number,
+                                partition_data=partition_data)
+            reference_recs = cb_recommend(reference_model, user_profile_conf, {}, args.partition_dir,
+                                          args.partition_number, partition_data=partition_data)
+            overlaps = [len(set(rec['event_id'] for rec in recs[user]) &
+                            set(rec['event_id'] for rec in reference_recs[user])) / float(len(reference_recs[user]))
+                        for user in reference_recs if reference_recs[user]]
+            return np.mean(overlaps)
+        event_ids = random.Random(0).sample(sorted(reference_model.dict_event_id_index),
+                                            min(args.num_queries, len(reference_model.dict_event_id_index)))
+        return event_cb_model.measure_drift(reference_model, event_ids)['neighbour_overlap']
+
+    reference_model, reference_time = train(None)
+    print "%s: %d events, %d dictionary terms" % (args.algorithm, len(reference_model.corpus_of_bows),
+                                                  len(reference_model.dictionary))
+    print "Dictionary:          %6.1fs" % reference_time
+    # Agreement of two trainings with the dictionary (the models with random initialization differ)
+    retrained_model, retrained_time = train(None)
+    print "Dictionary (again):  %6.1fs, agreement %.4f" % (retrained_time, agreement(retrained_model, reference_model))
+
+    for hash_features in args.hash_features:
+        hashed_model, hashed_time = train(hash_features)
+        print "Hashing (%7d):   %6.1fs (speedup %.2fx), %d used hashes, agreement %.4f" % (
+            hash_features, hashed_time, reference_time / hashed_time, len(hashed_model.dictionary.dfs),
+            agreement(hashed_model, reference_model))
+
+    if not args.corpus and not args.partition_dir:
+        os.remove(corpus_filename)
+
+
+##############################################################################
+# MAIN
+##############################################################################
+
+if __name__ == "__main__":
+
+    PARSER = ArgumentParser(description="Benchmarks of the Content-Based model")
+    SUBPARSERS = PARSER.add_subparsers()
+
+    HTML_PARSER = SUBPARSERS.add_parser("html", help="HTML stripping fast path")
+    HTML_PARSER.add_argument("--corpus", type=str, default=None,
+                             help="An event-name-desc_all.tsv file (default: a generated mix of event texts)")
+    HTML_PARSER.add_argument("--num-events", dest="num_events", type=int, default=20000,
+                             help="Number of generated events (when no corpus is given)")
+    HTML_PARSER.add_argument("--repeats", type=int, default=3,
+                             help="Number of timed repetitions (the best one is reported)")
+    HTML_PARSER.set_defaults(benchmark=benchmark_html)
+
+    INDEX_PARSER = SUBPARSERS.add_parser("index", help="Dense VS sparse similarity index (LSI/LDA)")
+    INDEX_PARSER.add_argument("--corpus", type=str, default=None,
+                              help="An event-name-desc_all.tsv file (default: a generated mix of event texts)")
+    INDEX_PARSER.add_argument("--num-events", dest="num_events", type=int, default=20000,
+                              help="Number of generated events (when no corpus is given)")
+    INDEX_PARSER.add_argument("--algorithm", type=str, default="LSI", choices=["LSI", "LDA"],
+                              help="The latent model")
+    INDEX_PARSER.add_argument("--num-topics", dest="num_topics", type=int, default=250,
+                              help="Number of topics of the model")
+    INDEX_PARSER.add_argument("--num-queries", dest="num_queries", type=int, default=1000,
+                              help="Number of queries (sampled from the indexed events)")
+    INDEX_PARSER.add_argument("--repeats", type=int, default=3,
+                              help="Number of timed repetitions (the best one is reported)")
+    INDEX_PARSER.set_defaults(benchmark=benchmark_index)
+
+    ANN_PARSER = SUBPARSERS.add_parser("ann", help="Recall@k and latency of the approximate (IVF) index")
+    ANN_PARSER.add_argument("--partition-dir", dest="partition_dir", type=str, default=None,
+                            help="A partition content_based_models dir: its test events are indexed and its test "
+                                 "users profiles are the queries (default: a generated corpus)")
+    ANN_PARSER.add_argument("--partition-number", dest="partition_number", type=int, default=1,
+                            help="The partition number (used with --partition-dir)")
+    ANN_PARSER.add_argument("--corpus", type=str, default=None,
+                            help="An event-name-desc_all.tsv file (default: a generated mix of event texts)")
+    ANN_PARSER.add_argument("--num-events", dest="num_events", type=int, default=20000,
+                            help="Number of generated events (when no corpus is given)")
+    ANN_PARSER.add_argument("--algorithm", type=str, default="LSI", choices=["LSI", "LDA"],
+                            help="The latent model")
+    ANN_PARSER.add_argument("--num-topics", dest="num_topics", type=int, default=250,
+                            help="Number of topics of the model")
+    ANN_PARSER.add_argument("--no-below-freq", dest="no_below_freq", type=int, default=2,
+                            help="Minimum word frequency (filter_extreme_words)")
+    ANN_PARSER.add_argument("--num-clusters", dest="num_clusters", type=int, default=None,
+                            help="Number of clusters of the IVF index (default: sqrt of the indexed events)")
+    ANN_PARSER.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                            help="Numbers of probed clusters to evaluate")
+    ANN_PARSER.add_argument("-k", type=int, default=100,
+                            help="Recall@k")
+    ANN_PARSER.add_argument("--num-queries", dest="num_queries", type=int, default=1000,
+                            help="Number of queries")
+    ANN_PARSER.add_argument("--repeats", type=int, default=3,
+                            help="Number of timed repetitions (the best one is reported)")
+    ANN_PARSER.set_defaults(benchmark=benchmark_ann)
+
+    LDA_PARSER = SUBPARSERS.add_parser("lda", help="Single process VS multicore LDA training")
+    LDA_PARSER.add_argument("--corpus", type=str, default=None,
+                            help="An event-name-desc_all.tsv file (default: a generated mix of event texts)")
+    LDA_PARSER.add_argument("--num-events", dest="num_events", type=int, default=20000,
+                            help="Number of generated events (when no corpus is given)")
+    LDA_PARSER.add_argument("--num-topics", dest="num_topics", type=int, default=250,
+                            help="Number of topics of the model")
+    LDA_PARSER.add_argument("--num-corpus-passes", dest="num_corpus_passes", type=int, default=10,
+                            help="Number of passes over the corpus")
+    LDA_PARSER.add_argument("--num-iterations", dest="num_iterations", type=int, default=250,
+                            help="Number of inference iterations per chunk of documents")
+    LDA_PARSER.add_argument("--no-below-freq", dest="no_below_freq", type=int, default=2,
+                            help="Minimum word frequency (filter_extreme_words)")
+    LDA_PARSER.add_argument("--held-out", dest="held_out", type=float, default=0.1,
+                            help="Fraction of the events held-out to evaluate the perplexity")
+    LDA_PARSER.add_argument("--workers", type=int, nargs="+", default=[multiprocessing.cpu_count() - 1],
+                            help="Numbers of workers of the multicore LDA to evaluate")
+    LDA_PARSER.set_defaults(benchmark=benchmark_lda)
+
+    HASHING_PARSER = SUBPARSERS.add_parser("hashing", help="Dictionary VS hashing vocabulary")
+    HASHING_PARSER.add_argument("--partition-dir", dest="partition_dir", type=str, default=None,
+                                help="A partition content_based_models dir: the agreement is measured on its test "
+                                     "users recommendations (default: nearest events of a generated corpus)")
+    HASHING_PARSER.add_argument("--partition-number", dest="partition_number", type=int, default=1,
+                                help="The partition number (used with --partition-dir)")
+    HASHING_PARSER.add_argument("--corpus", type=str, default=None,
+                                help="An event-name-desc_all.tsv file (default: a generated mix of event texts)")
+    HASHING_PARSER.add_argument("--num-events", dest="num_events", type=int, default=20000,
+                                help="Number of generated events (when no corpus is given)")
+    HASHING_PARSER.add_argument("--algorithm", type=str, default="TFIDF", choices=["TFIDF", "LSI", "LDA"],
+                                help="The model")
+    HASHING_PARSER.add_argument("--num-topics", dest="num_topics", type=int, default=250,
+                                help="Number of topics of the model (LSI and LDA)")
+    HASHING_PARSER.add_argument("--no-below-freq", dest="no_below_freq", type=int, default=2,
+                                help="Minimum word frequency (filter_extreme_words)")
+    HASHING_PARSER.add_argument("--hash-features", dest="hash_features", type=int, nargs="+",
+                                default=[2 ** 14, 2 ** 16, 2 ** 18],
+                                help="Sizes of the hash space to evaluate")
+    HASHING_PARSER.add_argument("--num-queries", dest="num_queries", type=int, default=1000,
+                                help="Number of sampled events (agreement on a generated corpus)")
+    HASHING_PARSER.set_defaults(benchmark=benchmark_hashing)
+
+    ARGS = PARSER.parse_args()
+    ARGS.benchmark(ARGS)
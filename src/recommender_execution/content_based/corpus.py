@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Corpus of BOWs Storage
+"""
+import os
+import logging
+
+import numpy as np
+from scipy import sparse
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('content_based.corpus')
+LOGGER.setLevel(logging.INFO)
+
+##############################################################################
+# Public CLASSES
+##############################################################################
+
+class CsrBowCorpus(object):
+    """
+    Corpus of BOWs stored as a CSR triple of numpy arrays:
+        indptr (int64, one entry per document + 1), indices (int32 term ids) and data (int32 term frequencies)
+    It behaves as the list of BOWs (len, index and iteration), so it can replace it everywhere.
+    The arrays are saved as .npy files and loaded memory-mapped, therefore many processes
+    reading the same corpus share a single copy in the page cache.
+    """
+
+    _ARRAY_NAMES = ('indptr', 'indices', 'data')
+
+    def __init__(self, indptr, indices, data):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @classmethod
+    def from_term_arrays(cls, corpus_term_arrays):
+        """ Create the corpus from a list of (term_ids, term_freqs) arrays (one per document) """
+        indptr = np.zeros(len(corpus_term_arrays) + 1, dtype=np.int64)
+        for doc_index, (term_ids, _) in enumerate(corpus_term_arrays):
+            indptr[doc_index + 1] = indptr[doc_index] + len(term_ids)
+
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        data = np.empty(indptr[-1], dtype=np.int32)
+        for doc_index, (term_ids, term_freqs) in enumerate(corpus_term_arrays):
+            indices[indptr[doc_index]:indptr[doc_index + 1]] = term_ids
+            data[indptr[doc_index]:indptr[doc_index + 1]] = term_freqs
+        return cls(indptr, indices, data)
+
+    @classmethod
+    def from_bows(cls, bows):
+        """ Create the corpus from a list of BOWs (list of (term_id, term_frequency)) """
+        return cls.from_term_arrays([(np.array([term_id for term_id, _ in bow], dtype=np.int32),
+                                      np.array([term_freq for _, term_freq in bow], dtype=np.int32))
+                                     for bow in bows])
+
+    @classmethod
+    def load(cls, corpus_dir, mmap='r'):
+        """ Load the corpus arrays from corpus_dir (memory-mapped with the given mmap mode) """
+        return cls(*[np.load(os.path.join(corpus_dir, "%s.npy" % name), mmap_mode=mmap)
+                     for name in cls._ARRAY_NAMES])
+
+    def save(self, corpus_dir):
+        """ Save the corpus arrays in corpus_dir (one .npy file per array) """
+        if not os.path.exists(corpus_dir):
+            os.makedirs(corpus_dir)
+        for name in self._ARRAY_NAMES:
+            np.save(os.path.join(corpus_dir, "%s.npy" % name), getattr(self, name))
+
+    def extend(self, bows):
+        """ Append the BOWs to the corpus (the arrays are copied to memory, i.e. no longer memory-mapped) """
+        new_corpus = CsrBowCorpus.from_bows(bows)
+        self.indptr = np.concatenate([self.indptr, self.indptr[-1] + new_corpus.indptr[1:]])
+        self.indices = np.concatenate([self.indices, new_corpus.indices])
+        self.data = np.concatenate([self.data, new_corpus.data])
+
+    def to_csr_matrix(self, num_terms):
+        """ The corpus as a (num_docs x num_terms) scipy.sparse CSR matrix (sharing the arrays) """
+        return sparse.csr_matrix((self.data, self.indices, self.indptr), shape=(len(self), num_terms))
+
+    def get_term_arrays(self, doc_index):
+        """ Return the (term_ids, term_freqs) arrays of a document """
+        begin, end = self.indptr[doc_index], self.indptr[doc_index + 1]
+        return self.indices[begin:end], self.data[begin:end]
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, doc_index):
+        term_ids, term_freqs = self.get_term_arrays(doc_index)
+        return zip(term_ids.tolist(), term_freqs.tolist())
+
+    def __iter__(self):
+        for doc_index in xrange(len(self)):
+            yield self[doc_index]
@@ -22,13 +22,18 @@
 """
 Train and Recommend Events to Users
 """
+import time
 import logging
-import csv
+import multiprocessing
 
-from os import path, makedirs
+from os import path, makedirs, remove
+from collections import OrderedDict
 
 from model import EventContentModel
-from user_profiles import UserProfileSum, UserProfileTimeWeighted, UserProfileInversePopularity
+from partition_data import load_partition_data, read_test_events
+from recommendation_sink import TsvRecommendationSink, SINK_BUFFER_USERS, open_sinks
+from user_profiles import UserProfileSum, UserProfileTimeWeighted, UserProfileInversePopularity, \
+                          build_multi_user_profiles
 
 ##############################################################################
 # GLOBAL VARIABLES
@@ -41,61 +46,9 @@ LOGGER.setLevel(logging.INFO)
 
 MAX_RECS_PER_USER = 100
 
-##############################################################################
-# PRIVATE FUNCTIONS
-##############################################################################
-def _get_set_test_users(partition_dir):
-    """ Read the Test Users TSV file """
-    test_users_tsv_path = path.join(partition_dir, "users_test.tsv")
-    with open(test_users_tsv_path, "r") as users_test_file:
-        users_test_reader = csv.reader(users_test_file, delimiter="\t")
-        return set([row[0] for row in users_test_reader])
-
-def _get_list_test_events(partition_dir):
-    """ Read the Test Events TSV file """
-    test_events_tsv_path = path.join(partition_dir, "event-candidates_test.tsv")
-    with open(test_events_tsv_path, "r") as event_test_file:
-        events_test_reader = csv.reader(event_test_file, delimiter="\t")
-        return [row[0] for row in events_test_reader]
-
-def _get_dict_user_events_train(partition_dir):
-    """ Read the Train User-Event TSV file """
-    train_user_events_tsv_path = path.join(partition_dir, "user-event-rsvptime_train.tsv")
-    with open(train_user_events_tsv_path, "r") as user_event_train_file:
-        user_event_train_reader = csv.reader(user_event_train_file, delimiter="\t")
-
-        dict_user_event = {}
-        for row in user_event_train_reader:
-            user_id = row[0]
-            event_id = row[1]
-            rsvp_time = int(row[2])
-            dict_user_event.setdefault(user_id, {'event_id_list': [], 'rsvp_time_list': []})
-            dict_user_event[user_id]['event_id_list'].append(event_id)
-            dict_user_event[user_id]['rsvp_time_list'].append(rsvp_time)
-        return dict_user_event
-
-def _get_dict_event_rsvp_count_train(partition_dir):
-    """ Read the count_users_per_train-event_train.csv  """
-    dict_event_count = {}
-    count_rsvps_filename = path.join(partition_dir, "..", "count_users_per_test-event_train.tsv")
-    with open(count_rsvps_filename, "r") as count_rsvps_file:
-        count_rsvps_reader = csv.reader(count_rsvps_file, delimiter="\t")
-        for row in count_rsvps_reader:
-            dict_event_count.setdefault(row[0], int(row[1]))
-    return dict_event_count
-
-def _get_partition_time(partition_dir, partition_number):
-    """ Read the Partition Times CSV File and extract the partition_time """
-    partition_times_path = path.join(partition_dir, "..", "..", "..", "partition_times.csv")
-    partition_time = None
-    with open(partition_times_path, "r") as partition_times_file:
-        partition_times_reader = csv.reader(partition_times_file)
-        partition_times_reader.next()
-        for row in partition_times_reader:
-            if int(row[0]) == partition_number:
-                partition_time = int(row[2])
-
-    return partition_time
+# The cb_recommend arguments shared by the shard workers (see cb_recommend_sharded),
+# set before the Pool is created so the workers get them (and the indexed model) by fork
+_SHARD_RECOMMEND_ARGS = None
 
 ##############################################################################
 # PUBLIC CLASSES
@@ -130,10 +83,15 @@ class UserProfileConf(object):
 # PUBLIC FUNCTIONS
 ##############################################################################
 
-def cb_train(cb_model_conf, post_process_conf, partition_dir):
+def cb_train(cb_model_conf, post_process_conf, partition_dir, single_pass=False, tokenize_workers=1,
+             corpus_dir=None, token_cache_dir=None, token_cache_bytes=None):
     """
     Function that trains and recommend events to all test users
     For that it uses an EventContentModel object
+    If single_pass is True the corpus is tokenized only once (no event content is kept in memory)
+    If tokenize_workers > 1 the corpus is tokenized by that number of processes (single pass)
+    If corpus_dir is given the corpus of bows is stored there and used memory-mapped
+    If token_cache_dir is given the pre-processed events are cached there (up to token_cache_bytes)
     """
 
     LOGGER.info("Creating Model [%s]", cb_model_conf.algorithm)
@@ -141,17 +99,22 @@ def cb_train(cb_model_conf, post_process_conf, partition_dir):
                                        cb_model_conf.algorithm,
                                        cb_model_conf.hyper_parameters,
                                        cb_model_conf.params_name)
+    if token_cache_dir:
+        event_cb_model.use_token_cache(token_cache_dir, token_cache_bytes)
 
     # Read the Corpus
     filename = path.join(partition_dir, "event-name-desc_all.tsv")
     LOGGER.info("Reading Corpus from [%s]", filename)
-    dict_event_content = event_cb_model.read_and_pre_process_corpus(filename, cb_model_conf.input_data)
+    dict_event_content = event_cb_model.read_and_pre_process_corpus(filename, cb_model_conf.input_data,
+                                                                    single_pass=single_pass,
+                                                                    num_workers=tokenize_workers)
 
     # Post Process Corpus
     event_cb_model.post_process_corpus(post_process_types=post_process_conf.types,
                                        params=post_process_conf.params,
                                        dict_event_content=dict_event_content,
-                                       content_columns=cb_model_conf.input_data)
+                                       content_columns=cb_model_conf.input_data,
+                                       corpus_dir=corpus_dir)
 
     # Train the model
     LOGGER.info("Training the Model")
@@ -159,95 +122,309 @@ def cb_train(cb_model_conf, post_process_conf, partition_dir):
 
     return event_cb_model, dict_event_content
 
+def cb_train_incremental(event_cb_model, cb_model_conf, post_process_conf, partition_dir, measure_drift=False,
+                         token_cache_dir=None, token_cache_bytes=None):
+    """
+    Incremental training: update a model trained on a previous partition with the events of this partition
+    Only the new events are pre-processed and fed to the model (LSI: add_documents, LDA: update),
+    the TF-IDF document frequencies are updated and the vocabulary is kept (the first partition's one)
+    If there is no previous model (event_cb_model is None) a full training is done (cb_train)
+    If measure_drift is True a full retrain is also done and its drift to the incremental model is logged
+    If token_cache_dir is given the pre-processed events are cached there (see cb_train)
+    """
+    if event_cb_model is None:
+        return cb_train(cb_model_conf, post_process_conf, partition_dir, single_pass=True,
+                        token_cache_dir=token_cache_dir, token_cache_bytes=token_cache_bytes)
+
+    filename = path.join(partition_dir, "event-name-desc_all.tsv")
+    LOGGER.info("Updating the Corpus and the Model [%s] from [%s]", cb_model_conf.algorithm, filename)
+    start_time = time.time()
+    new_bows = event_cb_model.read_and_update_corpus(filename, cb_model_conf.input_data)
+    event_cb_model.update_model(new_bows)
+    LOGGER.info("Incremental training: %d new events in %.1fs", len(new_bows), time.time() - start_time)
+
+    if measure_drift:
+        LOGGER.info("Measuring the drift against a full retrain")
+        start_time = time.time()
+        full_cb_model, _ = cb_train(cb_model_conf, post_process_conf, partition_dir, single_pass=True,
+                                    token_cache_dir=token_cache_dir, token_cache_bytes=token_cache_bytes)
+        LOGGER.info("Full training: %d events in %.1fs", len(full_cb_model.corpus_of_bows),
+                    time.time() - start_time)
+        drift = event_cb_model.measure_drift(full_cb_model, read_test_events(partition_dir))
+        LOGGER.info("Drift to the full retrain: neighbour overlap@10 = %.4f, vocabulary coverage = %.4f",
+                    drift['neighbour_overlap'], drift['vocabulary_coverage'])
+
+    return event_cb_model, {}
+
+def read_partition_data(partition_dir, partition_number):
+    """
+    Read the Partition data used by cb_recommend (test users, test events, train user-event pairs
+    and the extra data for User Profiles), so it can be read once and shared by many cb_recommend calls
+    It is a PartitionData, memoized per partition (see partition_data.load_partition_data)
+    """
+    return load_partition_data(partition_dir, partition_number)
+
+def _create_user_profile(user_profile_conf, user_events_train, partition_data, event_cb_model, dict_event_content):
+    """ Create the User Profile based on the User Profile Type (None if the type is unknown) """
+    if user_profile_conf.name == 'SUM':
+        return UserProfileSum(user_profile_conf.params, user_events_train, event_cb_model, dict_event_content)
+
+    elif user_profile_conf.name == 'TIME':
+        # Add the partition time to the user_event_train data
+        user_events_train['partition_time'] = partition_data['partition_time']
+        return UserProfileTimeWeighted(user_profile_conf.params, user_events_train,
+                                       event_cb_model, dict_event_content)
+
+    elif user_profile_conf.name == 'INV-POPULARITY':
+        # Add the rsvp_count_list to the train events
+        dict_count_rsvps_events_train = partition_data['dict_count_rsvps_events_train']
+        user_events_train['rsvp_count_list'] = [dict_count_rsvps_events_train.get(event_id, 0)
+                                                for event_id in user_events_train['event_id_list']]
+        return UserProfileInversePopularity(user_profile_conf.params, user_events_train,
+                                            event_cb_model, dict_event_content)
+    return None
+
 def cb_recommend(event_cb_model, user_profile_conf, dict_event_content,
-                 partition_dir, partition_number):
+                 partition_dir, partition_number, query_block_size=None, partition_data=None,
+                 vectorized_profiles=False, event_embeddings=False, inference_workers=1, sink=None):
     """
     Recommend events to users
     Given a trained Content Based Model are generated N recommendations to the same User
     One recommendation for each user profile type (i.e. for each personalization approach)
+    If user_profile_conf is a list of User Profiles all of them are recommended in a single pass over
+    the test users: the train events of each user are gathered once and the queries of all User Profiles
+    of a user are scored as one batch (one matrix multiplication) against the shared index.
+    Then a list of recommendations (one per User Profile, in the same order) is returned, and sink must be
+    a list of sinks (one per User Profile) if given
+    If query_block_size is given the user profiles are queried in blocks of that size
+    (one matrix multiplication per block, see EventContentModel.query_model_batch)
+    If partition_data is given (see read_partition_data) the partition files are not read again
+    If vectorized_profiles is True the User Profiles of all test users are created at once
+    (see user_profiles.build_multi_user_profiles) instead of one by one
+    If event_embeddings is True the (vectorized) LSI User Profiles are the weighted sums of the
+    precomputed event vectors (see EventContentModel.get_event_embeddings)
+    and the (vectorized) LDA User Profiles are inferred in batches by inference_workers processes
+    If a sink is given (e.g. TsvRecommendationSink) the recommendations are written to it while the users
+    are processed (in the test users order) and None is returned, so they are not kept in memory
     """
-
-    LOGGER.info("Reading the Partition data (test users, test events and train user-event pairs)")
-    test_users = _get_set_test_users(partition_dir)
-    test_events = _get_list_test_events(partition_dir)
-    dict_user_events_train = _get_dict_user_events_train(partition_dir)
-
-    LOGGER.info("Reading extra data for User Profiles")
-    dict_count_rsvps_events_train = _get_dict_event_rsvp_count_train(partition_dir)
-    partition_time = _get_partition_time(partition_dir, partition_number)
-
-    LOGGER.info("Creating the Index to submit the User Profile Queries")
-    event_cb_model.index_events(test_events)
-
-    LOGGER.info("Recommending the Test Events to Test Users")
-    dict_user_rec_events = {}
+    multi_profile = isinstance(user_profile_conf, (list, tuple))
+    user_profile_confs = list(user_profile_conf) if multi_profile else [user_profile_conf]
+    sinks = None
+    if sink is not None:
+        sinks = list(sink) if multi_profile else [sink]
+        if len(sinks) != len(user_profile_confs):
+            raise ValueError("There must be one sink per User Profile (%d sinks, %d User Profiles)" %
+                             (len(sinks), len(user_profile_confs)))
+
+    if partition_data is None:
+        partition_data = read_partition_data(partition_dir, partition_number)
+    test_users = partition_data['test_users']
+    test_events = partition_data['test_events']
+    dict_user_events_train = partition_data['dict_user_events_train']
+
+    if event_cb_model.corpus_query_index is None or event_cb_model.index_event_ids != test_events:
+        LOGGER.info("Creating the Index to submit the User Profile Queries")
+        event_cb_model.index_events(test_events)
+    else:
+        LOGGER.info("Using the existing Index of the Test Events")
+
+    # Ordered by the test users iteration order, so the persisted results are deterministic
+    list_dict_user_rec_events = [OrderedDict() for _ in user_profile_confs]
+
+    def query_block(block_queries):
+        """ Submit a block of queries (User Profile index, user, user profile representation, user train events) """
+        list_rec_events = event_cb_model.query_model_batch([representation
+                                                            for _, _, representation, _ in block_queries],
+                                                           test_events,
+                                                           [event_id_list for _, _, _, event_id_list in block_queries],
+                                                           MAX_RECS_PER_USER)
+        for (profile_index, user, _, _), rec_events in zip(block_queries, list_rec_events):
+            list_dict_user_rec_events[profile_index][user] = rec_events
+
+    list_dict_user_profiles = None
+    if vectorized_profiles or event_embeddings:
+        LOGGER.info("Creating the User Profiles of the Test Users (vectorized)")
+        list_dict_user_profiles = build_multi_user_profiles(user_profile_confs, test_users, partition_data,
+                                                            event_cb_model, event_embeddings=event_embeddings,
+                                                            inference_workers=inference_workers)
+
+    LOGGER.info("Recommending the Test Events to Test Users (%d User Profiles)", len(user_profile_confs))
+    start_time = time.time()
+    block_queries = []
+    block_users = 0
     user_count = 0
     for user in test_users:
+        # Stream the finished recommendations (there is none pending in a query block)
+        if sinks is not None and not block_queries:
+            for dict_user_rec_events, profile_sink in zip(list_dict_user_rec_events, sinks):
+                _drain_recommendations(dict_user_rec_events, profile_sink)
+
         # Log progress
         if user_count % 1000 == 0:
             LOGGER.info("PROGRESS: at user #%d", user_count)
         user_count += 1
 
         # Every user has at least an empty recommendation
-        dict_user_rec_events.setdefault(user, [])
+        for dict_user_rec_events in list_dict_user_rec_events:
+            dict_user_rec_events.setdefault(user, [])
 
         # The user receives no recommendation if it doesn't have at least one event in train
         if user not in dict_user_events_train:
             continue
 
         # -------------------------------------------------------------------------
-        # Call the Recommendation function based on the User Profile Type
-
-        if user_profile_conf.name == 'SUM':
-            # Create the User Profile
-            user_profile = UserProfileSum(user_profile_conf.params, dict_user_events_train[user],
-                                          event_cb_model, dict_event_content)
-            # Submit the query passing the User Profile Representation
-            dict_user_rec_events[user] = event_cb_model.query_model(user_profile.get(), test_events,
-                                                                    dict_user_events_train[user]['event_id_list'],
-                                                                    MAX_RECS_PER_USER)
-
-        elif user_profile_conf.name == 'TIME':
-            # Add the partition time to the user_event_train data
-            dict_user_events_train[user]['partition_time'] = partition_time
-            # Create the User Profile
-            user_profile = UserProfileTimeWeighted(user_profile_conf.params, dict_user_events_train[user],
-                                                   event_cb_model, dict_event_content)
-            # Submit the query passing the User Profile Representation
-            dict_user_rec_events[user] = event_cb_model.query_model(user_profile.get(), test_events,
-                                                                    dict_user_events_train[user]['event_id_list'],
-                                                                    MAX_RECS_PER_USER)
-
-        elif user_profile_conf.name == 'INV-POPULARITY':
-            # Add the rsvp_count_list to the train events
-            dict_user_events_train[user]['rsvp_count_list'] = [dict_count_rsvps_events_train.get(event_id, 0)
-                                                               for event_id in dict_user_events_train[user]['event_id_list']]
-            # Create the User Profile
-            user_profile = UserProfileInversePopularity(user_profile_conf.params, dict_user_events_train[user],
-                                                        event_cb_model, dict_event_content)
-            # Submit the query passing the User Profile Representation
-            dict_user_rec_events[user] = event_cb_model.query_model(user_profile.get(), test_events,
-                                                                    dict_user_events_train[user]['event_id_list'],
-                                                                    MAX_RECS_PER_USER)
-
-    return dict_user_rec_events
-
-def persist_recommendations(dict_user_rec_events, model_name, result_dir):
+        # Create the User Profiles based on the User Profile Types
+
+        user_events_train = dict_user_events_train[user]
+        user_queries = []
+        for profile_index, profile_conf in enumerate(user_profile_confs):
+            if list_dict_user_profiles is not None:
+                if user not in list_dict_user_profiles[profile_index]:
+                    continue
+                user_representation = list_dict_user_profiles[profile_index][user]
+            else:
+                user_profile = _create_user_profile(profile_conf, user_events_train, partition_data,
+                                                    event_cb_model, dict_event_content)
+                if user_profile is None:
+                    continue
+                user_representation = user_profile.get()
+            user_queries.append((profile_index, user, user_representation, user_events_train['event_id_list']))
+        if not user_queries:
+            continue
+
+        # -------------------------------------------------------------------------
+        # Submit the queries passing the User Profile Representations
+
+        if query_block_size:
+            block_queries.extend(user_queries)
+            block_users += 1
+            if block_users == query_block_size:
+                query_block(block_queries)
+                block_queries = []
+                block_users = 0
+        elif len(user_queries) > 1:
+            # All User Profiles of the user in a single matrix multiplication
+            query_block(user_queries)
+        else:
+            profile_index, _, user_representation, event_id_list = user_queries[0]
+            list_dict_user_rec_events[profile_index][user] = event_cb_model.query_model(user_representation,
+                                                                                        test_events, event_id_list,
+                                                                                        MAX_RECS_PER_USER)
+    if block_queries:
+        query_block(block_queries)
+    if sinks is not None:
+        for dict_user_rec_events, profile_sink in zip(list_dict_user_rec_events, sinks):
+            _drain_recommendations(dict_user_rec_events, profile_sink)
+        list_dict_user_rec_events = None
+
+    elapsed_time = time.time() - start_time
+    LOGGER.info("Recommended to %d users in %.1fs (%.1f users/sec)", user_count, elapsed_time,
+                user_count / max(elapsed_time, 1e-6))
+    if list_dict_user_rec_events is None or multi_profile:
+        return list_dict_user_rec_events
+    return list_dict_user_rec_events[0]
+
+def _drain_recommendations(dict_user_rec_events, sink):
+    """ Move the recommendations of the (ordered) dict to the sink """
+    while dict_user_rec_events:
+        user, rec_events = dict_user_rec_events.popitem(last=False)
+        sink.write(user, rec_events)
+
+def _recommend_user_shard((shard_number, shard_users, shard_filenames)):
+    """
+    Worker: recommend to a shard of the test users (with the cb_recommend arguments in _SHARD_RECOMMEND_ARGS)
+    and persist its recommendations in the shard files (one per User Profile)
+    """
+    event_cb_model, user_profile_conf, dict_event_content, partition_dir, partition_number, \
+        partition_data, sink_class, sink_buffer_users, recommend_params = _SHARD_RECOMMEND_ARGS
+    LOGGER.info("Shard #%d: recommending to %d users", shard_number, len(shard_users))
+    shard_partition_data = dict(partition_data, test_users=shard_users)
+    with open_sinks(sink_class, shard_filenames, buffer_users=sink_buffer_users) as sinks:
+        cb_recommend(event_cb_model, user_profile_conf, dict_event_content, partition_dir, partition_number,
+                     partition_data=shard_partition_data,
+                     sink=sinks if isinstance(user_profile_conf, (list, tuple)) else sinks[0], **recommend_params)
+    return len(shard_users)
+
+def persist_recommendations(dict_user_rec_events, model_name, result_dir, sink_class=TsvRecommendationSink):
     """
     Persist the recommendation results in the given 'result_dir' with the
     given TSV file named 'model_name'.tsv
     Each line has the following format:
     <user_id>\t<event_id1>:<similarity1>,<event_id2>:<similarity2>,...,<event_id100>:<similarity100>
+    Another format can be given by its sink_class (e.g. the binary ranked list writer, file 'model_name'.rlb)
     """
     LOGGER.info("Persisting the Recommendations")
     if not path.exists(result_dir):
         makedirs(result_dir)
 
-    with open(path.join(result_dir, "%s.tsv" % model_name), "w") as rec_out_file:
+    with sink_class(path.join(result_dir, model_name + sink_class.EXTENSION)) as sink:
         for user in dict_user_rec_events:
-            rec_out_file.write("%s\t%s\n" % (user,
-                                             ','.join(["%s:%.6f" % (rec['event_id'], rec['similarity'])
-                                                       for rec in dict_user_rec_events[user]])))
+            sink.write(user, dict_user_rec_events[user])
+
+def cb_recommend_sharded(event_cb_model, user_profile_conf, dict_event_content, partition_dir, partition_number,
+                         model_name, result_dir, num_shards, partition_data=None, sink_class=TsvRecommendationSink,
+                         sink_buffer_users=SINK_BUFFER_USERS, **recommend_params):
+    """
+    Recommend events to users (see cb_recommend) in parallel: the test users are split in num_shards
+    contiguous shards recommended by a Pool of processes that inherit (by fork) the indexed model and the
+    partition data. Each shard is streamed to its own file by a sink_class sink (e.g. TsvRecommendationSink),
+    then the shard files are concatenated (in the shards order, see sink_class.concatenate) in the
+    'model_name'<sink_class.EXTENSION> file, the same file of the serial cb_recommend + persist_recommendations.
+    If user_profile_conf is a list of User Profiles (see cb_recommend) model_name must be the list of their
+    model names, each User Profile is persisted in its own file
+    The recommend_params are passed to cb_recommend (query_block_size, vectorized_profiles, ...)
+    """
+    global _SHARD_RECOMMEND_ARGS
+
+    if partition_data is None:
+        partition_data = read_partition_data(partition_dir, partition_number)
+    # The index is built before the fork, so it is shared by all shards
+    if event_cb_model.corpus_query_index is None or event_cb_model.index_event_ids != partition_data['test_events']:
+        LOGGER.info("Creating the Index to submit the User Profile Queries")
+        event_cb_model.index_events(partition_data['test_events'])
+
+    if num_shards > 1 and multiprocessing.current_process().daemon:
+        LOGGER.warning("Daemonic processes are not allowed to have children, recommending in a single process")
+        num_shards = 1
+
+    if not path.exists(result_dir):
+        makedirs(result_dir)
+    model_names = list(model_name) if isinstance(user_profile_conf, (list, tuple)) else [model_name]
+    test_users = list(partition_data['test_users'])
+    shard_size = (len(test_users) + num_shards - 1) // num_shards if test_users else 1
+    shard_tasks = [(shard_number, test_users[begin:begin + shard_size],
+                    [path.join(result_dir, "%s.shard%d%s" % (profile_model_name, shard_number, sink_class.EXTENSION))
+                     for profile_model_name in model_names])
+                   for shard_number, begin in enumerate(xrange(0, len(test_users), shard_size))]
+
+    LOGGER.info("Recommending to %d users in %d shards", len(test_users), len(shard_tasks))
+    start_time = time.time()
+    _SHARD_RECOMMEND_ARGS = (event_cb_model, user_profile_conf, dict_event_content, partition_dir, partition_number,
+                             partition_data, sink_class, sink_buffer_users, recommend_params)
+    try:
+        if num_shards > 1 and len(shard_tasks) > 1:
+            pool = multiprocessing.Pool(min(num_shards, len(shard_tasks)))
+            try:
+                pool.map(_recommend_user_shard, shard_tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for shard_task in shard_tasks:
+                _recommend_user_shard(shard_task)
+    finally:
+        _SHARD_RECOMMEND_ARGS = None
+
+    LOGGER.info("Persisting the Recommendations")
+    for profile_index, profile_model_name in enumerate(model_names):
+        shard_filenames = [task_filenames[profile_index] for _, _, task_filenames in shard_tasks]
+        sink_class.concatenate(shard_filenames, path.join(result_dir, profile_model_name + sink_class.EXTENSION))
+        for shard_filename in shard_filenames:
+            remove(shard_filename)
+
+    elapsed_time = time.time() - start_time
+    LOGGER.info("Recommended to %d users in %.1fs (%.1f users/sec, %d shards)", len(test_users), elapsed_time,
+                len(test_users) / max(elapsed_time, 1e-6), len(shard_tasks))
 
 
 ##############################################################################
@@ -24,11 +24,20 @@ Content-Based MODEL
 """
 import re
 import os
+import json
+import zlib
+import time
+import shutil
 import logging
+import multiprocessing
 import unicodecsv
 import unicodedata
+import numpy as np
 
-from gensim import corpora, models, similarities
+from gensim import corpora, matutils, models, similarities
+from corpus import CsrBowCorpus
+from similarity import DenseSimilarityIndex, IvfSimilarityIndex
+from token_cache import TokenCache
 from nltk.corpus import stopwords
 from nltk.stem.porter import PorterStemmer
 from csv import QUOTE_NONNUMERIC
@@ -43,6 +52,21 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s
 LOGGER = logging.getLogger('content_based.model')
 LOGGER.setLevel(logging.INFO)
 
+# Number of events tokenized by each worker task (multi-process corpus reading)
+TOKENIZE_CHUNK_SIZE = 1000
+
+# Number of documents of each batched LDA inference (see EventContentModel.infer_topics)
+LDA_INFERENCE_CHUNK_SIZE = 2000
+
+# Maximum number of memoized stems (per pre-processment pipeline)
+STEM_CACHE_SIZE = 200000
+
+# Version of the model bundle format (see EventContentModel.save_bundle)
+MODEL_BUNDLE_VERSION = 1
+# Version of the pre-processment code, part of the token cache key:
+# it must be increased when a change in the pre-processment changes the words of a text
+PRE_PROCESS_VERSION = 1
+
 ##############################################################################
 # Private CLASSES and FUNCTIONS
 ##############################################################################
@@ -69,6 +93,230 @@ class _HTMLStripper(HTMLParser):
     def get_data(self):
         return u''.join(self.fed)
 
+    def strip(self, html):
+        """ Reset the parser and return the html without tags and with the entities converted """
+        self.reset()
+        self.fed = []
+        self.feed(html)
+        # HTML parser breaks if parsing ends/EOF on a single-letter broken entities
+        # such as 'at&t'. Adding an extra space fixes this.
+        self.feed(' ')
+        self.close()
+        return self.unescape(self.get_data())
+
+def _strip_html_and_convert_entities(html, parser=None):
+    """ Remove HTML tags and Convert Entities to Text """
+    # http://stackoverflow.com/questions/753052/strip-html-from-strings-in-python
+    # http://stackoverflow.com/questions/2087370/decode-html-entities-in-python-string
+    # Fast path: without '<' and '&' there is no markup to strip, the parser would only
+    # return the text plus the extra space fed at the end
+    if u'<' not in html and u'&' not in html:
+        return html + u' '
+    if parser is None:
+        parser = _HTMLStripper()
+    return parser.strip(html)
+
+def _normalize_diacritics(text):
+    """ Remove Accents and other Diacritics """
+    # References:
+    # http://stackoverflow.com/questions/517923/what-is-the-best-way-to-remove-accents-in-a-python-unicode-string
+    # http://stackoverflow.com/questions/9042515/normalizing-unicode-text-to-filenames-etc-in-python
+    nkfd_form = unicodedata.normalize('NFKD', unicode(text))
+    return u"".join([c for c in nkfd_form if not unicodedata.combining(c)])
+
+def _normalize_to_plain_ascii(text):
+    """ Normalize to Plain ASCII """
+    only_ascii = text.encode('ASCII', 'replace')  # unencodable chars become '?'
+    return unicode(only_ascii)
+
+class _PreProcessPipeline(object):
+    """
+    Pre-Processment config compiled (once) into the lists of text and word functions to apply
+    Stop words are looked up in a frozenset and the stems are memoized in a bounded cache
+    """
+
+    _ENGLISH_STOPWORDS = frozenset(stopwords.words('english'))
+    _STEMMER = PorterStemmer()
+    _REGEX_NO_DIGIT = re.compile('[%s]' % re.escape(digits))
+
+    def __init__(self, pre_processment, stem_cache_size=STEM_CACHE_SIZE, token_cache=None):
+        dict_text_process = {'replace_numbers_with_spaces': self._replace_number_space}
+        dict_word_process = {'get_stemmed_words': self._stem_word,
+                             'remove_stop_words': self._remove_stop_word,
+                             'strip_punctuations': self._strip_punctuations}
+        self._text_processes = [dict_text_process[name] for name in pre_processment.get('text', [])]
+        self._word_processes = [dict_word_process[name] for name in pre_processment.get('word', [])]
+
+        self._html_stripper = _HTMLStripper()
+        self._stem_cache = {}
+        self._stem_cache_size = stem_cache_size
+        self.token_cache = token_cache
+        self.stats = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Reset the pre-processment statistics """
+        self.stats = {'num_tokens': 0, 'stem_hits': 0, 'stem_misses': 0, 'seconds': 0.0,
+                      'cache_hits': 0, 'cache_misses': 0}
+
+    def add_stats(self, stats):
+        """ Accumulate the statistics of another pipeline (e.g. from a worker process) """
+        for key in self.stats:
+            self.stats[key] += stats[key]
+
+    def extract_event_words(self, event_id, texts):
+        """ Pre-process the texts of an event, looking them up (and storing them) in the token cache (if any) """
+        if self.token_cache is None:
+            return self.extract_words(texts)
+
+        words = self.token_cache.get(event_id, texts)
+        if words is not None:
+            self.stats['cache_hits'] += 1
+            return words
+        self.stats['cache_misses'] += 1
+        words = self.extract_words(texts)
+        self.token_cache.put(event_id, texts, words)
+        return words
+
+    def extract_words(self, texts):
+        """ Normalize and split the texts, then pre-process their words """
+        start_time = time.time()
+
+        word_list = []
+        for text in texts:
+            # Normalize the Text String (HTML + DIACRITICS + ASCII)
+            text = _strip_html_and_convert_entities(text, self._html_stripper)
+            text = _normalize_diacritics(text)
+            text = _normalize_to_plain_ascii(text)
+
+            for text_process in self._text_processes:
+                text = text_process(text)
+
+            word_list.extend(text.split())
+
+        final_words = []
+        word_processes = self._word_processes
+        for word in word_list:
+            # All words are lowered!
+            word = word.lower()
+            for word_process in word_processes:
+                word = word_process(word)
+            # We assume that words with less than 1 character have no meaning.
+            if len(word) > 1:
+                final_words.append(word)
+
+        self.stats['num_tokens'] += len(word_list)
+        self.stats['seconds'] += time.time() - start_time
+        return final_words
+
+    def _replace_number_space(self, text):
+        """ Replace numbers with spaces """
+        return self._REGEX_NO_DIGIT.sub(' ', text)
+
+    @staticmethod
+    def _strip_punctuations(word):
+        """ Strip leading and trailing punctuations """
+        return word.strip(punctuation)
+
+    def _remove_stop_word(self, word):
+        """ Filter the words in the English Stop Words List """
+        if word not in self._ENGLISH_STOPWORDS:
+            return word
+        else:
+            return ''
+
+    def _stem_word(self, word):
+        """ Return a word stemmed (memoized) """
+        stem = self._stem_cache.get(word)
+        if stem is None:
+            self.stats['stem_misses'] += 1
+            stem = self._STEMMER.stem(word)
+            if len(self._stem_cache) < self._stem_cache_size:
+                self._stem_cache[word] = stem
+        else:
+            self.stats['stem_hits'] += 1
+        return stem
+
+def _bow_to_arrays(bow):
+    """ Convert a BOW (list of (term_id, term_frequency)) to compact int32 arrays """
+    term_ids = np.fromiter((term_id for term_id, _ in bow), dtype=np.int32, count=len(bow))
+    term_freqs = np.fromiter((term_freq for _, term_freq in bow), dtype=np.int32, count=len(bow))
+    return term_ids, term_freqs
+
+def _arrays_to_bow(term_ids, term_freqs):
+    """ Convert the compact int32 arrays back to a BOW (list of (term_id, term_frequency)) """
+    return zip(term_ids.tolist(), term_freqs.tolist())
+
+def _read_event_rows(filename):
+    """ Read the Event Corpus TSV file, yielding (event_id, {'name': ..., 'description': ...}) """
+    with open(filename, "r") as csv_file:
+        csv_reader = unicodecsv.reader(csv_file, encoding="utf-8",
+                                       delimiter='\t', escapechar='\\',
+                                       quoting=QUOTE_NONNUMERIC)
+        for row in csv_reader:
+            yield str(int(row[0])), {'name': row[1], 'description': row[2]}
+
+def _chunks(iterable, chunk_size):
+    """ Group the iterable items in lists of (at most) chunk_size items """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Pre-processment pipeline of the tokenizer worker process (see _init_tokenize_worker)
+_WORKER_PIPELINE = None
+
+def _init_tokenize_worker(pre_processment, token_cache_dir=None):
+    """ Worker initializer: compile the pre-processment pipeline (and open the token cache) once per process """
+    global _WORKER_PIPELINE
+    token_cache = None
+    if token_cache_dir:
+        token_cache = TokenCache(token_cache_dir, _get_token_cache_config(pre_processment))
+    _WORKER_PIPELINE = _PreProcessPipeline(pre_processment, token_cache=token_cache)
+
+def _get_token_cache_config(pre_processment):
+    """ The config of the token cache entries: the pre-processment (and the version of its code) """
+    return {'pre_processment': pre_processment, 'version': PRE_PROCESS_VERSION}
+
+def _tokenize_corpus_chunk((content_columns, event_contents)):
+    """
+    Worker: tokenize a chunk of events building a partial dictionary
+    Return the partial dictionary, the (term_ids, term_freqs) arrays of each event in its ids
+    and the pre-processment statistics of the chunk
+    """
+    _WORKER_PIPELINE.reset_stats()
+    partial_dictionary = corpora.Dictionary()
+    chunk_term_arrays = []
+    for event_id, event_content in event_contents:
+        event_words = _WORKER_PIPELINE.extract_event_words(event_id, [event_content[col] for col in content_columns])
+        chunk_term_arrays.append(_bow_to_arrays(partial_dictionary.doc2bow(event_words, allow_update=True)))
+    return partial_dictionary, chunk_term_arrays, _WORKER_PIPELINE.stats
+
+# LDA model of the inference worker process (see _init_lda_inference_worker)
+_WORKER_LDA_MODEL = None
+
+def _init_lda_inference_worker(lda_model):
+    """ Worker initializer: keep the LDA model (inherited by the forked process, not pickled) """
+    global _WORKER_LDA_MODEL
+    _WORKER_LDA_MODEL = lda_model
+
+def _infer_lda_chunk((seed, bows)):
+    """
+    Worker: the normalized topic distributions (num_docs x num_topics) of a chunk of BOWs
+    The gamma initialization is drawn from the chunk seed, so it does not depend on the worker
+    """
+    _WORKER_LDA_MODEL.random_state = np.random.RandomState(seed)
+    return _infer_topic_distributions(_WORKER_LDA_MODEL, bows)
+
+def _infer_topic_distributions(lda_model, bows):
+    """ Variational inference of a whole chunk of BOWs, normalized as in LdaModel.get_document_topics """
+    gamma, _ = lda_model.inference(bows)
+    return gamma / gamma.sum(axis=1)[:, np.newaxis]
+
 ##############################################################################
 # Public CLASSES
 ##############################################################################
@@ -78,173 +326,352 @@ class EventContentModel(object):
     Event Content Model
     """
 
-    _ENGLISH_STOPWORDS = stopwords.words('english')
-    _STEMMER = PorterStemmer()
-    _REGEX_NO_DIGIT = re.compile('[%s]' % re.escape(digits))
-
     def __init__(self, pre_processment, algorithm, hyper_parameters, params_name):
         self.model_name = "%s_%s" % (algorithm, params_name)
+        self.params_name = params_name
         self.pre_processment = pre_processment
         self.algorithm = algorithm
         self.hyper_parameters = hyper_parameters
+        self._pre_process_pipeline = _PreProcessPipeline(pre_processment)
+        # On-disk cache of the pre-processed events (see use_token_cache)
+        self.token_cache = None
 
         self.dict_index_event_id = {} # Index in the Corpus of BOWs!
         self.dict_event_id_index = {}
-        self.dictionary = corpora.Dictionary()
+        # Hashing vocabulary (hyper parameter 'hash_features' = size of the hash space): the term ids
+        # are the word hashes, so the BOWs are built without a dictionary-building pass
+        self.hash_features = hyper_parameters.get('hash_features')
+        if self.hash_features:
+            self.dictionary = corpora.HashDictionary(id_range=self.hash_features, myhash=zlib.crc32, debug=False)
+        else:
+            self.dictionary = corpora.Dictionary()
         self.corpus_of_bows = []
+        # Compact (term_ids, term_freqs) arrays of every event (single-pass build only)
+        self._corpus_term_arrays = None
         self.model = None
         self.tfidf_model = None
         self.corpus_query_index = None
+        # The event ids indexed in the corpus_query_index (None means the whole corpus)
+        self.index_event_ids = None
+        # Held-out perplexity of every LDA training pass (early stopping only)
+        self.perplexity_curve = None
+        # Parameters of an approximate (IVF) query index, e.g. {'num_clusters': 100, 'nprobe': 8}
+        # (None means an exact index), only for the latent models (see IvfSimilarityIndex)
+        self.ann_params = None
+        # Dense latent vectors of all corpus events (LSI only, see get_event_embeddings)
+        self._event_embeddings = None
+        # Cache of the candidate events positions (see _get_candidate_positions)
+        self._candidate_event_ids = None
+        self._dict_candidate_positions = {}
+
+    def use_token_cache(self, cache_dir, max_bytes=None):
+        """
+        Look up (and store) the pre-processed events in the on-disk token cache in cache_dir
+        (see TokenCache), evicted down to max_bytes after reading a corpus
+        """
+        self.token_cache = TokenCache(cache_dir, _get_token_cache_config(self.pre_processment), max_bytes)
+        self._pre_process_pipeline.token_cache = self.token_cache
 
-    def extract_content(self, event_data, columns):
+    def extract_content(self, event_data, columns, event_id=None):
         """
         Extract the Content from event_data given the columns
         Text and Word pre-processment, basically.
+        If the event_id is given the words are looked up in the token cache (if any)
         """
-        def strip_html_and_convert_entities(html):
-            """ Remove HTML tags and Convert Entities to Text """
-            # http://stackoverflow.com/questions/753052/strip-html-from-strings-in-python
-            # http://stackoverflow.com/questions/2087370/decode-html-entities-in-python-string
-            parser = _HTMLStripper()
-            parser.feed(html)
-            # HTML parser breaks if parsing ends/EOF on a single-letter broken entities
-            # such as 'at&t'. Adding an extra space fixes this.
-            parser.feed(' ')
-            parser.close()
-            return parser.unescape(parser.get_data())
-
-        def normalize_diacritics(text):
-            """ Remove Accents and other Diacritics """
-            # References:
-            # http://stackoverflow.com/questions/517923/what-is-the-best-way-to-remove-accents-in-a-python-unicode-string
-            # http://stackoverflow.com/questions/9042515/normalizing-unicode-text-to-filenames-etc-in-python
-            nkfd_form = unicodedata.normalize('NFKD', unicode(text))
-            return u"".join([c for c in nkfd_form if not unicodedata.combining(c)])
-
-        def normalize_to_plain_ascii(text):
-            """ Normalize to Plain ASCII """
-            only_ascii = text.encode('ASCII', 'replace')  # unencodable chars become '?'
-            return unicode(only_ascii)
-
-        def replace_number_space(text):
-            """ Replace numbers with spaces """
-            return EventContentModel._REGEX_NO_DIGIT.sub(' ', text)
-
-        def strip_punctuations(word):
-            """ Strip leading and trailing punctuations """
-            return word.strip(punctuation)
-
-        def stem_word(word):
-            """ Return a word stemmed """
-            return EventContentModel._STEMMER.stem(word)
-
-        def remove_stop_word(word):
-            """ Filter the words in the English Stop Words List """
-            if word not in EventContentModel._ENGLISH_STOPWORDS:
-                return word
-            else:
-                return ''
+        texts = [event_data[col] for col in columns]
+        if event_id is not None:
+            return self._pre_process_pipeline.extract_event_words(event_id, texts)
+        return self._pre_process_pipeline.extract_words(texts)
 
-        dict_pre_process = {'text': {'replace_numbers_with_spaces': replace_number_space},
-                            'word': {'get_stemmed_words': stem_word,
-                                     'remove_stop_words': remove_stop_word,
-                                     'strip_punctuations': strip_punctuations}}
-        word_list = []
-        # Pre-Process Texts
-        for col in columns:
-            text = event_data[col]
+    def log_pre_process_stats(self):
+        """ Log the pre-processment throughput and the stem cache efficiency """
+        stats = self._pre_process_pipeline.stats
+        num_stems = stats['stem_hits'] + stats['stem_misses']
+        LOGGER.info("Pre-processed %d tokens in %.2fs (%.0f tokens/sec) - Stem cache: %d hits, %d misses (%.1f%%)",
+                    stats['num_tokens'], stats['seconds'], stats['num_tokens'] / max(stats['seconds'], 1e-9),
+                    stats['stem_hits'], stats['stem_misses'],
+                    100.0 * stats['stem_hits'] / max(num_stems, 1))
+        if self.token_cache:
+            num_lookups = stats['cache_hits'] + stats['cache_misses']
+            LOGGER.info("Token cache [%s]: %d hits, %d misses (%.1f%%)", self.token_cache.cache_dir,
+                        stats['cache_hits'], stats['cache_misses'], 100.0 * stats['cache_hits'] / max(num_lookups, 1))
 
-            # Normalize the Text String (HTML + DIACRITICS + ASCII)
-            text = strip_html_and_convert_entities(text)
-            text = normalize_diacritics(text)
-            text = normalize_to_plain_ascii(text)
+    def read_and_pre_process_corpus(self, filename, content_columns, single_pass=False, num_workers=1):
+        """
+        Read the corpus
+        If single_pass is True every event is tokenized only once: its BOW is kept as compact
+        token-id arrays (remapped later by post_process_corpus) and the raw text is discarded.
+        Otherwise the event content is returned to be tokenized again in post_process_corpus.
+        If num_workers > 1 the events are tokenized by a Pool of processes (always single_pass).
+        """
+        if num_workers > 1 and multiprocessing.current_process().daemon:
+            LOGGER.warning("Daemonic processes are not allowed to have children, tokenizing in a single process")
+            num_workers = 1
 
-            for text_process in self.pre_processment.get('text', []):
-                text = dict_pre_process['text'][text_process](text)
+        if num_workers > 1:
+            self._read_and_pre_process_corpus_parallel(filename, content_columns, num_workers)
+            self.log_pre_process_stats()
+            if self.token_cache:
+                self.token_cache.evict()
+            return {}
 
-            word_list.extend(text.split())
+        # The hashing vocabulary has no dictionary to build, so it is always single pass
+        single_pass = single_pass or bool(self.hash_features)
+        self._corpus_term_arrays = [] if single_pass else None
 
-        # Pre-Process Words
-        final_words = []
-        for word in word_list:
-            # All words are lowered!
-            word = word.lower()
-            for word_process in self.pre_processment.get('word', []):
-                word = dict_pre_process['word'][word_process](word)
-            # We assume that words with less than 1 character have no meaning.
-            if len(word) > 1:
-                final_words.append(word)
+        dict_event_content = {}
+        for doc_index, (event_id, event_content) in enumerate(_read_event_rows(filename)):
+            self.dict_index_event_id[doc_index] = event_id
+            self.dict_event_id_index[event_id] = doc_index
 
-        return final_words
+            # Extract the Words from the Event Description
+            event_words = self.extract_content(event_content, content_columns, event_id)
+
+            # Update the dictionary
+            event_bow = self.dictionary.doc2bow(event_words, allow_update=True)
+
+            if single_pass:
+                self._corpus_term_arrays.append(_bow_to_arrays(event_bow))
+            else:
+                dict_event_content[event_id] = event_content
+
+        if self.hash_features:
+            self._count_hashed_document_frequencies()
 
-    def read_and_pre_process_corpus(self, filename, content_columns, no_below_freq=0):
+        self.log_pre_process_stats()
+        if self.token_cache:
+            self.token_cache.evict()
+        return dict_event_content
+
+    def _read_and_pre_process_corpus_parallel(self, filename, content_columns, num_workers):
         """
-        Read the corpus
+        Read the corpus tokenizing chunks of events in num_workers processes
+        Each worker builds a partial dictionary, the partials are merged in the chunk order, so the
+        final dictionary is the same of the serial reading (whatever the number of workers)
         """
-        with open(filename, "r") as csv_file:
-            csv_reader = unicodecsv.reader(csv_file, encoding="utf-8",
-                                           delimiter='\t', escapechar='\\',
-                                           quoting=QUOTE_NONNUMERIC)
+        self._corpus_term_arrays = []
+
+        def chunk_tasks():
+            """ Register the event indexes and yield the worker tasks """
             doc_index = 0
-            dict_event_content = {}
-            for row in csv_reader:
-                event_id = str(int(row[0]))
-                self.dict_index_event_id[doc_index] = event_id
-                self.dict_event_id_index[event_id] = doc_index
+            for chunk in _chunks(_read_event_rows(filename), TOKENIZE_CHUNK_SIZE):
+                for event_id, _ in chunk:
+                    self.dict_index_event_id[doc_index] = event_id
+                    self.dict_event_id_index[event_id] = doc_index
+                    doc_index += 1
+                yield (content_columns, chunk)
 
-                dict_event_content[event_id] = {'name': row[1], 'description': row[2]}
+        LOGGER.info("Tokenizing the corpus with %d processes", num_workers)
+        token_cache_dir = self.token_cache.cache_dir if self.token_cache else None
+        tokenize_pool = multiprocessing.Pool(num_workers, _init_tokenize_worker,
+                                             (self.pre_processment, token_cache_dir))
+        try:
+            for partial_dictionary, chunk_term_arrays, chunk_stats in tokenize_pool.imap(_tokenize_corpus_chunk,
+                                                                                         chunk_tasks()):
+                self._merge_partial_dictionary(partial_dictionary, chunk_term_arrays)
+                self._pre_process_pipeline.add_stats(chunk_stats)
+        finally:
+            tokenize_pool.close()
+            tokenize_pool.join()
 
-                # Extract the Words from the Event Description
-                event_words = self.extract_content(dict_event_content[event_id], content_columns)
+        if self.hash_features:
+            self._count_hashed_document_frequencies()
+
+    def _merge_partial_dictionary(self, partial_dictionary, chunk_term_arrays):
+        """
+        Merge a partial dictionary (and its events term arrays) into self.dictionary
+        New tokens receive ids in the partial id order, which follows the same assignment
+        rule of Dictionary.doc2bow (i.e. the document order)
+        """
+        if self.hash_features:
+            self._merge_partial_dictionary_hashed(partial_dictionary, chunk_term_arrays)
+            return
 
-                # Update the dictionary
-                self.dictionary.doc2bow(event_words, allow_update=True)
+        token2id = self.dictionary.token2id
+        partial_to_global_id = np.empty(len(partial_dictionary.token2id), dtype=np.int32)
+        for partial_id, token in sorted((partial_id, token)
+                                        for token, partial_id in partial_dictionary.token2id.iteritems()):
+            global_id = token2id.get(token)
+            if global_id is None:
+                global_id = len(token2id)
+                token2id[token] = global_id
+            partial_to_global_id[partial_id] = global_id
 
-                doc_index += 1
+            self.dictionary.dfs[global_id] = self.dictionary.dfs.get(global_id, 0) + partial_dictionary.dfs[partial_id]
+            if hasattr(partial_dictionary, 'cfs'):
+                self.dictionary.cfs[global_id] = self.dictionary.cfs.get(global_id, 0) + partial_dictionary.cfs[partial_id]
 
-        return dict_event_content
+        self.dictionary.num_docs += partial_dictionary.num_docs
+        self.dictionary.num_pos += partial_dictionary.num_pos
+        self.dictionary.num_nnz += partial_dictionary.num_nnz
+        # Reset the reverse mapping (it is lazily rebuilt by gensim)
+        self.dictionary.id2token = {}
+
+        for term_ids, term_freqs in chunk_term_arrays:
+            global_term_ids = partial_to_global_id[term_ids]
+            order = np.argsort(global_term_ids, kind='mergesort')
+            self._corpus_term_arrays.append((global_term_ids[order], term_freqs[order]))
 
-    def post_process_corpus(self, post_process_types, params, dict_event_content, content_columns):
+    def _merge_partial_dictionary_hashed(self, partial_dictionary, chunk_term_arrays):
+        """
+        Hashing vocabulary version of _merge_partial_dictionary: the partial ids are replaced by the
+        word hashes (the frequencies of words with the same hash are summed)
+        """
+        partial_to_hash_id = np.empty(len(partial_dictionary.token2id), dtype=np.int32)
+        for token, partial_id in partial_dictionary.token2id.iteritems():
+            partial_to_hash_id[partial_id] = self.dictionary.restricted_hash(token)
+
+        self.dictionary.num_docs += partial_dictionary.num_docs
+        self.dictionary.num_pos += partial_dictionary.num_pos
+        for term_ids, term_freqs in chunk_term_arrays:
+            hash_ids, inverse = np.unique(partial_to_hash_id[term_ids], return_inverse=True)
+            hash_freqs = np.bincount(inverse, weights=term_freqs).astype(np.int32)
+            self.dictionary.num_nnz += len(hash_ids)
+            self._corpus_term_arrays.append((hash_ids.astype(np.int32), hash_freqs))
+
+    def _count_hashed_document_frequencies(self):
+        """ Count the document frequencies of the hashing vocabulary (HashDictionary only counts them in debug) """
+        hash_dfs = np.zeros(self.hash_features, dtype=np.int64)
+        for term_ids, _ in self._corpus_term_arrays:
+            hash_dfs[term_ids] += 1
+        self.dictionary.dfs = dict((hash_id, int(hash_dfs[hash_id])) for hash_id in np.flatnonzero(hash_dfs))
+
+    def post_process_corpus(self, post_process_types, params, dict_event_content, content_columns, corpus_dir=None):
         """
         Apply the Corpus Post Processments
         Why? This step requires the dictionary be already generated
+        If corpus_dir is given the corpus of bows is saved there and used memory-mapped (CsrBowCorpus)
         """
 
         # Filter extremes words from dictionary (based on the Corpus Document Frequecy)
         if "filter_extreme_words" in post_process_types:
             print params['no_below_freq']
+
+        if "filter_extreme_words" in post_process_types and self.hash_features:
+            self._filter_extreme_hashed_terms(no_below=params['no_below_freq'])
+
+        elif "filter_extreme_words" in post_process_types:
+            old_token2id = dict(self.dictionary.token2id)
             self.dictionary.filter_extremes(no_below=params['no_below_freq'])
 
+            if self._corpus_term_arrays is not None:
+                self._compactify_corpus_term_arrays(old_token2id)
+
         # Generate the corpus of bows
-        for doc_index in sorted(self.dict_index_event_id.keys()):
-            event_id = self.dict_index_event_id[doc_index]
+        if self._corpus_term_arrays is not None:
+            # Single-pass build: the term arrays are already in the dictionary ids
+            if corpus_dir:
+                self.corpus_of_bows = CsrBowCorpus.from_term_arrays(self._corpus_term_arrays)
+            else:
+                self.corpus_of_bows = [_arrays_to_bow(term_ids, term_freqs)
+                                       for term_ids, term_freqs in self._corpus_term_arrays]
+            self._corpus_term_arrays = None
+        else:
+            for doc_index in sorted(self.dict_index_event_id.keys()):
+                event_id = self.dict_index_event_id[doc_index]
 
-            # Extract the Words from the Event Description
-            event_words = self.extract_content(dict_event_content[event_id], content_columns)
+                # Extract the Words from the Event Description
+                event_words = self.extract_content(dict_event_content[event_id], content_columns, event_id)
 
-            # Create the Event Bows
-            event_bow = self.dictionary.doc2bow(event_words, allow_update=False)
+                # Create the Event Bows
+                event_bow = self.dictionary.doc2bow(event_words, allow_update=False)
 
-            # Store the BOW in memory
-            self.corpus_of_bows.append(event_bow)
+                # Store the BOW in memory
+                self.corpus_of_bows.append(event_bow)
 
+            self.log_pre_process_stats()
+            if self.token_cache:
+                self.token_cache.evict()
+
+        if corpus_dir:
+            self.mmap_corpus(corpus_dir)
 
         # Apply TFIDF Transformation (or NOT) in the corpus (LSI only)
         if self.algorithm == "LSI":
             LOGGER.info("Applying the TFIDF Transformation in the corpus (LSI only)")
             self.tfidf_model = models.TfidfModel(self.corpus_of_bows, normalize=True)
 
+    def mmap_corpus(self, corpus_dir):
+        """
+        Save the corpus of bows in corpus_dir and replace it by its memory-mapped version
+        """
+        LOGGER.info("Saving the corpus of bows (memory-mapped) in [%s]", corpus_dir)
+        if not isinstance(self.corpus_of_bows, CsrBowCorpus):
+            self.corpus_of_bows = CsrBowCorpus.from_bows(self.corpus_of_bows)
+        self.corpus_of_bows.save(corpus_dir)
+        self.corpus_of_bows = CsrBowCorpus.load(corpus_dir, mmap='r')
+
+    def _filter_extreme_hashed_terms(self, no_below=5, no_above=0.5, keep_n=100000):
+        """
+        Hashing vocabulary version of Dictionary.filter_extremes (same defaults): the filtered term ids
+        are dropped from the single-pass corpus, the others keep their (hash) ids
+        """
+        hash_dfs = np.zeros(self.hash_features, dtype=np.int64)
+        for hash_id, document_frequency in self.dictionary.dfs.iteritems():
+            hash_dfs[hash_id] = document_frequency
+        keep = (hash_dfs >= no_below) & (hash_dfs <= int(no_above * self.dictionary.num_docs))
+        if keep.sum() > keep_n:
+            kept_ids = np.flatnonzero(keep)
+            keep[:] = False
+            keep[kept_ids[np.argsort(-hash_dfs[kept_ids], kind='mergesort')[:keep_n]]] = True
+        LOGGER.info("Keeping %d of %d hashed terms (no_below=%d, no_above=%.2f)", keep.sum(),
+                    len(self.dictionary.dfs), no_below, no_above)
+
+        self.dictionary.num_nnz = 0
+        for doc_index, (term_ids, term_freqs) in enumerate(self._corpus_term_arrays):
+            kept_terms = keep[term_ids]
+            self._corpus_term_arrays[doc_index] = (term_ids[kept_terms], term_freqs[kept_terms])
+            self.dictionary.num_nnz += int(kept_terms.sum())
+        self.dictionary.dfs = dict((hash_id, int(hash_dfs[hash_id])) for hash_id in np.flatnonzero(keep))
+
+    def _compactify_corpus_term_arrays(self, old_token2id):
+        """
+        Remap (in place) the term ids of the single-pass corpus after the dictionary filtering
+        Removed terms are dropped, the remaining ones receive the new (compactified) ids
+        """
+        old_to_new_id = np.empty(max(old_token2id.values() or [-1]) + 1, dtype=np.int32)
+        old_to_new_id.fill(-1)
+        for token, new_id in self.dictionary.token2id.iteritems():
+            old_to_new_id[old_token2id[token]] = new_id
+
+        for doc_index, (term_ids, term_freqs) in enumerate(self._corpus_term_arrays):
+            new_term_ids = old_to_new_id[term_ids]
+            kept_terms = new_term_ids >= 0
+            new_term_ids = new_term_ids[kept_terms]
+            term_freqs = term_freqs[kept_terms]
+
+            # BOWs are sorted by term id (as in Dictionary.doc2bow)
+            order = np.argsort(new_term_ids, kind='mergesort')
+            self._corpus_term_arrays[doc_index] = (new_term_ids[order], term_freqs[order])
 
     def train_model(self):
         """
         Train the model and create the corpus query index
         """
+        self._event_embeddings = None
         # Applying the TFIDF Transformation (if necessary)
         if self.tfidf_model:
             transformed_corpus = self.tfidf_model[self.corpus_of_bows]
         else:
             transformed_corpus = self.corpus_of_bows
 
+        # Number of processes of the multicore LDA (hyper parameter 'workers', default: 1 = single process)
+        lda_workers = self.hyper_parameters.get('workers', 1) if self.algorithm == "LDA" else 1
+        if lda_workers > 1 and multiprocessing.current_process().daemon:
+            LOGGER.warning("Daemonic processes are not allowed to have children, training the LDA in a single process")
+            lda_workers = 1
+
+        # Early stopping of the LDA passes (hyper parameter 'perplexity_threshold', default: all passes)
+        # The model is trained pass by pass on the corpus minus a held-out sample, and the training
+        # stops when the held-out perplexity relative improvement falls below the threshold
+        lda_early_stopping = self.algorithm == "LDA" and 'perplexity_threshold' in self.hyper_parameters
+        if lda_early_stopping:
+            transformed_corpus, held_out_corpus = self._split_held_out_corpus(
+                transformed_corpus, self.hyper_parameters.get('held_out_fraction', 0.05))
+        lda_corpus = None if lda_early_stopping else transformed_corpus
+        # With early stopping each update is a single corpus pass (see _train_lda_until_convergence)
+        lda_passes = 1 if lda_early_stopping else self.hyper_parameters.get('num_corpus_passes')
+
         if self.algorithm == "TFIDF":
             LOGGER.info("Creating the TFIDF Transformation")
             self.model = models.TfidfModel(transformed_corpus, normalize=True)
@@ -264,16 +691,34 @@ class EventContentModel(object):
                                          power_iters=5,                                         # More Power Iterations to improve accuracy
                                          extra_samples=None)                                    # None, so it will be dinamically defined (i.e. 2 * num_topics)
 
+        elif self.algorithm == "LDA" and lda_workers > 1:
+            LOGGER.info("Creating the LDA Transformation (multicore: %d workers)", lda_workers)
+            # Same hyper parameters of the single process LDA below, but the E-step of each chunk
+            # of documents is parallelized among the workers processes
+            # https://github.com/piskvorky/gensim/blob/develop/gensim/models/ldamulticore.py
+            self.model = models.LdaMulticore(lda_corpus,
+                                             num_topics=self.hyper_parameters['num_topics'],
+                                             id2word=self.dictionary,
+                                             workers=lda_workers,
+                                             chunksize=2000,
+                                             passes=lda_passes,
+                                             alpha='symmetric',                                 # The multicore LDA does not support alpha='auto'
+                                             eta=None,
+                                             decay=0.5,
+                                             eval_every=10,
+                                             iterations=self.hyper_parameters['num_iterations'],
+                                             gamma_threshold=0.00001)
+
         elif self.algorithm == "LDA":
             LOGGER.info("Creating the LDA Transformation")
             # More information about the hyper parameter selection read the souce code below:
             # https://github.com/piskvorky/gensim/blob/develop/gensim/models/ldamodel.py
-            self.model = models.LdaModel(transformed_corpus,                                    # Chaining: LDA (TFIDF or NOT(BOW))
+            self.model = models.LdaModel(lda_corpus,                                            # Chaining: LDA (TFIDF or NOT(BOW)), None = trained below
                                          num_topics=self.hyper_parameters['num_topics'],
                                          id2word=self.dictionary,
                                          distributed=False,                                     # Single machine is enough (default: False)
                                          chunksize=2000,                                        # Number of documents per inference cicle (default: 2000)
-                                         passes=self.hyper_parameters['num_corpus_passes'],     # Passes over the Full Corpus, increased to improve accuracy (default: 1)
+                                         passes=lda_passes,                                     # Passes over the Full Corpus, increased to improve accuracy (default: 1)
                                          update_every=1,                                        # Update the model every 1 document chunk (default: 1)
                                          alpha='auto',                                          # Defines the gamma priors of the Dirichlet distributions
                                                                                                 #   Auto: learns asymmetric priors directly from the corpus data in every update
@@ -292,12 +737,53 @@ class EventContentModel(object):
                                          gamma_threshold=0.00001)                               # Convergence Threshold, diff between two subsequent gamma values.
                                                                                                 #   Decreased to force all iterations (default: 0.001)
 
+        if lda_early_stopping:
+            self._train_lda_until_convergence(transformed_corpus, held_out_corpus,
+                                              self.hyper_parameters['perplexity_threshold'])
 
-    def index_events(self, event_id_list=None):
+    @classmethod
+    def _split_held_out_corpus(cls, corpus, held_out_fraction):
+        """ Split the corpus in train and held-out (one of every 1/held_out_fraction documents) lists """
+        held_out_step = max(2, int(round(1.0 / held_out_fraction)))
+        train_corpus, held_out_corpus = [], []
+        for doc_index, document in enumerate(corpus):
+            if doc_index % held_out_step == 0:
+                held_out_corpus.append(document)
+            else:
+                train_corpus.append(document)
+        return train_corpus, held_out_corpus
+
+    def _train_lda_until_convergence(self, train_corpus, held_out_corpus, perplexity_threshold):
         """
-        Index the Events based on its indexes
+        Train the (untrained) LDA model one corpus pass at a time (up to num_corpus_passes), stopping
+        when the relative improvement of the held-out perplexity is below perplexity_threshold
+        The perplexity of every pass is kept in self.perplexity_curve and logged
         """
+        self.perplexity_curve = []
+        # The held-out bound is scaled to the whole corpus size (not to the held-out sample size)
+        total_docs = len(train_corpus) + len(held_out_corpus)
+        for corpus_pass in xrange(self.hyper_parameters['num_corpus_passes']):
+            start_time = time.time()
+            # The model passes is 1: one corpus pass per update (LdaMulticore.update has no passes argument)
+            self.model.update(train_corpus)
+            perplexity = 2 ** -self.model.log_perplexity(held_out_corpus, total_docs=total_docs)
+            self.perplexity_curve.append(perplexity)
+            LOGGER.info("LDA pass %d: held-out perplexity %.2f (%.1fs)", corpus_pass + 1, perplexity,
+                        time.time() - start_time)
+
+            if len(self.perplexity_curve) > 1:
+                previous_perplexity = self.perplexity_curve[-2]
+                if (previous_perplexity - perplexity) / previous_perplexity < perplexity_threshold:
+                    LOGGER.info("LDA converged after %d passes (improvement below %g)",
+                                corpus_pass + 1, perplexity_threshold)
+                    break
+        LOGGER.info("LDA held-out perplexity curve: %s", ", ".join("%.2f" % value for value in self.perplexity_curve))
+
 
+    def transform_events(self, event_id_list=None):
+        """
+        Return the events (all the corpus if no event_id_list is given) transformed by the model
+        """
         # Event selection by Id (if provided)
         if event_id_list:
             event_corpus = [self.corpus_of_bows[self.dict_event_id_index[event_id]]
@@ -307,45 +793,283 @@ class EventContentModel(object):
 
         # Applying the TFIDF Transformation (if necessary)
         if self.tfidf_model:
-            transformed_corpus = self.model[self.tfidf_model[event_corpus]]
+            return self.model[self.tfidf_model[event_corpus]]
         else:
-            transformed_corpus = self.model[event_corpus]
+            return self.model[event_corpus]
+
+    def get_event_embeddings(self):
+        """
+        Return the (num_events x num_topics) dense matrix of the LSI vectors of all corpus events
+        (in the corpus order), computed once: the LSI projection is linear, so a weighted sum of
+        event BOWs is projected as the same weighted sum of these rows (exactly, without the TFIDF chain)
+        """
+        if self.algorithm != "LSI":
+            raise ValueError("There are event embeddings only for the LSI model (not %s)" % self.algorithm)
+        if self._event_embeddings is None:
+            LOGGER.info("Computing the event embeddings of %d events", len(self.corpus_of_bows))
+            self._event_embeddings = matutils.corpus2dense(self.transform_events(),
+                                                           num_terms=self.model.num_topics,
+                                                           num_docs=len(self.corpus_of_bows), dtype=np.float64).T
+        return self._event_embeddings
+
+    def infer_topics(self, bows, num_workers=1, chunk_size=LDA_INFERENCE_CHUNK_SIZE):
+        """
+        Batched LDA inference: the topics of many (already weighted) BOWs in the gensim format, i.e. the same
+        as [model[bow] for bow in bows], but the variational inference runs over chunks of chunk_size BOWs
+        (LdaModel.inference) instead of one call per BOW.
+        If num_workers > 1 the chunks are inferred by a Pool of processes, each chunk with its own seed
+        (drawn from the model random state) for the random initialization of gamma: the topics do not depend on
+        the number of workers (but they differ from the single process ones, as any other random stream)
+        """
+        if self.algorithm != "LDA":
+            raise ValueError("There is batched inference only for the LDA model (not %s)" % self.algorithm)
+        if num_workers > 1 and multiprocessing.current_process().daemon:
+            LOGGER.warning("Daemonic processes are not allowed to have children, inferring in a single process")
+            num_workers = 1
+
+        chunks = list(_chunks(bows, chunk_size))
+        if num_workers > 1 and len(chunks) > 1:
+            pool = multiprocessing.Pool(min(num_workers, len(chunks)), initializer=_init_lda_inference_worker,
+                                        initargs=(self.model,))
+            try:
+                seeds = self.model.random_state.randint(np.iinfo(np.int32).max, size=len(chunks))
+                chunk_distributions = pool.map(_infer_lda_chunk, zip(seeds, chunks))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            chunk_distributions = [_infer_topic_distributions(self.model, chunk) for chunk in chunks]
+
+        # Sparse output as in LdaModel.__getitem__: only the topics with at least minimum_probability
+        minimum_probability = max(self.model.minimum_probability, 1e-8)
+        return [[(topic_id, topic_value) for topic_id, topic_value in enumerate(distribution)
+                 if topic_value >= minimum_probability]
+                for distributions in chunk_distributions for distribution in distributions]
+
+    def index_events(self, event_id_list=None):
+        """
+        Index the Events based on its indexes
+        """
+
+        self.index_event_ids = event_id_list
+        transformed_corpus = self.transform_events(event_id_list)
 
         # Create the index of the transformed_corpus to submit queries
-        # We use the SparseMatrixSimilarity that uses a sparse data structure instead of a dense one
-        # That's why we have to provide the num_features parameter
-        self.corpus_query_index = similarities.SparseMatrixSimilarity(transformed_corpus,
-                                                                      num_features=len(self.dictionary))
+        if self.algorithm in ("LSI", "LDA") and self.ann_params:
+            # Approximate index: each query is scored only against the events of its nearest clusters
+            self.corpus_query_index = IvfSimilarityIndex(transformed_corpus,
+                                                         num_features=self.hyper_parameters['num_topics'],
+                                                         **self.ann_params)
+        elif self.algorithm in ("LSI", "LDA"):
+            # The latent models vectors are dense with only num_topics dimensions
+            # So a dense index (BLAS matrix-vector products) is smaller and faster
+            self.corpus_query_index = DenseSimilarityIndex(transformed_corpus,
+                                                           num_features=self.hyper_parameters['num_topics'])
+        else:
+            if self.ann_params:
+                LOGGER.warning("There is no approximate index for the %s model, using the exact one", self.algorithm)
+            # We use the SparseMatrixSimilarity that uses a sparse data structure instead of a dense one
+            # That's why we have to provide the num_features parameter
+            self.corpus_query_index = similarities.SparseMatrixSimilarity(transformed_corpus,
+                                                                          num_features=len(self.dictionary))
+
+    def read_and_update_corpus(self, filename, content_columns):
+        """
+        Incremental training: read the corpus of a new partition over an already trained model
+        Only the events that are not in the model yet are tokenized and appended to the corpus.
+        The vocabulary is kept fixed (words out of the dictionary are dropped), but the
+        document frequencies are updated with the new events.
+        Return the BOWs of the new events
+        """
+        new_bows = []
+        for event_id, event_content in _read_event_rows(filename):
+            if event_id in self.dict_event_id_index:
+                continue
+            event_words = self.extract_content(event_content, content_columns, event_id)
+            event_bow = self.dictionary.doc2bow(event_words, allow_update=False)
+            if self.hash_features:
+                # The HashDictionary returns the hash of every word: the hash ids out of the vocabulary
+                # (without document frequency, e.g. filtered by _filter_extreme_hashed_terms) are dropped
+                event_bow = [(term_id, term_freq) for term_id, term_freq in event_bow
+                             if term_id in self.dictionary.dfs]
+
+            doc_index = len(self.dict_index_event_id)
+            self.dict_index_event_id[doc_index] = event_id
+            self.dict_event_id_index[event_id] = doc_index
+            new_bows.append(event_bow)
+
+            # Update the dictionary statistics (as Dictionary.doc2bow does with allow_update)
+            self.dictionary.num_docs += 1
+            self.dictionary.num_pos += len(event_words)
+            self.dictionary.num_nnz += len(event_bow)
+            for term_id, _ in event_bow:
+                self.dictionary.dfs[term_id] = self.dictionary.dfs.get(term_id, 0) + 1
+
+        self.log_pre_process_stats()
+        if self.token_cache:
+            self.token_cache.evict()
+
+        LOGGER.info("Corpus updated with %d new events (%d events in total)", len(new_bows),
+                    len(self.dict_index_event_id))
+        self.corpus_of_bows.extend(new_bows)
+
+        return new_bows
 
+    def update_model(self, new_bows):
+        """
+        Incremental training: update the trained model with the new events BOWs only
+            TF-IDF: the idfs are recomputed from the updated dictionary document frequencies
+            LSI: the new (TF-IDF) documents are merged with LsiModel.add_documents
+            LDA: the model is updated (online) with LdaModel.update
+        """
+        start_time = time.time()
+        if self.tfidf_model:
+            self.tfidf_model = self._create_dictionary_tfidf_model()
+
+        if self.algorithm == "TFIDF":
+            self.model = self._create_dictionary_tfidf_model()
+        elif new_bows and self.algorithm == "LSI":
+            self.model.add_documents(self.tfidf_model[new_bows])
+        elif new_bows and self.algorithm == "LDA":
+            self.model.update(new_bows)
+
+        # The query index and the event embeddings (if any) were created with the previous model
+        self.corpus_query_index = None
+        self.index_event_ids = None
+        self._event_embeddings = None
+
+        LOGGER.info("Model updated with %d new events in %.1fs", len(new_bows), time.time() - start_time)
+
+    def _create_dictionary_tfidf_model(self):
+        """
+        The TF-IDF model of the dictionary document frequencies
+        The HashDictionary has no collection frequencies (required by TfidfModel(dictionary=...)),
+        so with the hashing vocabulary the idfs are computed from the document frequencies directly
+        """
+        if not self.hash_features:
+            return models.TfidfModel(dictionary=self.dictionary, normalize=True)
+
+        tfidf_model = models.TfidfModel(normalize=True)
+        tfidf_model.num_docs, tfidf_model.num_nnz = self.dictionary.num_docs, self.dictionary.num_nnz
+        tfidf_model.dfs = dict(self.dictionary.dfs)
+        tfidf_model.idfs = models.tfidfmodel.precompute_idfs(tfidf_model.wglobal, tfidf_model.dfs,
+                                                             tfidf_model.num_docs)
+        return tfidf_model
+
+    def measure_drift(self, reference_model, event_id_list, num_neighbours=10):
+        """
+        Compare this model with a reference model (e.g. incremental VS full retrain) over the given events
+        Return a dict with:
+            neighbour_overlap: the mean overlap of the num_neighbours most similar events of each event
+            vocabulary_coverage: the fraction of the reference vocabulary present in this model
+        """
+        def neighbours(event_cb_model):
+            """ The num_neighbours most similar events (indexes) of every event """
+            event_cb_model.index_events(event_id_list)
+            neighbour_indexes = []
+            for event_index, event_vector in enumerate(event_cb_model.transform_events(event_id_list)):
+                event_similarities = np.array(event_cb_model.corpus_query_index[event_vector], dtype=np.float64)
+                event_similarities[event_index] = -np.inf
+                neighbour_indexes.append(set(np.argsort(-event_similarities, kind='mergesort')[:num_neighbours]))
+            return neighbour_indexes
+
+        overlaps = [len(own & reference) / float(max(len(reference), 1))
+                    for own, reference in zip(neighbours(self), neighbours(reference_model))]
+        reference_tokens = reference_model.dictionary.token2id
+        covered_tokens = sum(1 for token in reference_tokens if token in self.dictionary.token2id)
+
+        return {'neighbour_overlap': float(np.mean(overlaps)) if overlaps else 1.0,
+                'vocabulary_coverage': covered_tokens / float(max(len(reference_tokens), 1))}
 
     def query_model(self, query_model_format, candidate_event_ids, ignore_event_ids, query_limit=None):
         """
         Query the model given the query representation already in the model format
         """
         # Perform the query against the hole corpus using the index
-        query_similarities = self.corpus_query_index[query_model_format]
-
-        # enumerate(query_similarities) => 2-tuples: (document_number, document_similarity)
-        index_similarities = sorted(enumerate(query_similarities),
-                                    key=lambda item: -item[1])
-
-        if not query_limit:
-            query_limit = len(index_similarities)
-
-        query_result = []
-        ignore_event_ids = set(ignore_event_ids)
-        for index, similarity in index_similarities:
-            rec_event_id = candidate_event_ids[index]
-            # Exclude the events in the ignore set (i.e. events already consumed in the train)
-            if not rec_event_id in ignore_event_ids:
-                if query_limit > 0:
-                    query_result.append({'event_id': rec_event_id,
-                                         'similarity': similarity})
-                    query_limit -= 1
-                else:
-                    break
+        query_similarities = self._query_index(query_model_format, [ignore_event_ids], query_limit)
 
-        return query_result
+        return self._select_top_events(query_similarities, candidate_event_ids, ignore_event_ids, query_limit)
+
+    def query_model_batch(self, query_model_formats, candidate_event_ids, list_ignore_event_ids, query_limit=None):
+        """
+        Query the model given a block of query representations (e.g. one per user) already in the model format
+        All queries are scored against the index in a single matrix multiplication
+        Return the list of query results (one per query, as in query_model)
+        """
+        if not query_model_formats:
+            return []
+
+        # Perform all queries against the hole corpus using the index: (num_queries x num_events) similarities
+        block_similarities = self._query_index(list(query_model_formats), list_ignore_event_ids, query_limit)
+
+        return [self._select_top_events(query_similarities, candidate_event_ids, ignore_event_ids, query_limit)
+                for query_similarities, ignore_event_ids in zip(block_similarities, list_ignore_event_ids)]
+
+    def _query_index(self, query, list_ignore_event_ids, query_limit=None):
+        """
+        The similarities of the query (or queries) in the query index
+        An approximate index scores at least query_limit + |ignore set| events per query (all of them
+        without query_limit), so the selected top events are not fewer than query_limit
+        """
+        if isinstance(self.corpus_query_index, IvfSimilarityIndex):
+            num_ignored = max([len(set(ignore_event_ids)) for ignore_event_ids in list_ignore_event_ids] or [0])
+            min_results = query_limit + num_ignored if query_limit else len(self.corpus_query_index)
+            return self.corpus_query_index.query(query, min_results)
+        return self.corpus_query_index[query]
+
+    def _get_candidate_positions(self, candidate_event_ids):
+        """
+        Return the dict: event_id -> list of positions in candidate_event_ids
+        It is cached, because all queries of a recommendation run share the same candidate list
+        """
+        if self._candidate_event_ids is not candidate_event_ids:
+            self._candidate_event_ids = candidate_event_ids
+            self._dict_candidate_positions = {}
+            for position, event_id in enumerate(candidate_event_ids):
+                self._dict_candidate_positions.setdefault(event_id, []).append(position)
+        return self._dict_candidate_positions
+
+    def _select_top_events(self, query_similarities, candidate_event_ids, ignore_event_ids, query_limit=None):
+        """
+        Select the (query_limit) most similar candidate events that are not in the ignore set
+        The ties are kept in the candidate order
+        Instead of sorting all candidates it partitions the top (query_limit + |ignore set|) ones
+        (enough to cover the ignored events) and sorts only them
+        The candidates with a non-finite similarity (i.e. not scored by an approximate index) are excluded
+        """
+        query_similarities = np.asarray(query_similarities)
+        num_candidates = len(query_similarities)
+
+        # Exclude the events not scored and the events in the ignore set (i.e. events already consumed in the train)
+        ignore_mask = ~np.isfinite(query_similarities)
+        dict_candidate_positions = self._get_candidate_positions(candidate_event_ids)
+        for event_id in set(ignore_event_ids):
+            ignore_mask[dict_candidate_positions.get(event_id, [])] = True
+        num_ignored = int(ignore_mask.sum())
+
+        num_results = num_candidates - num_ignored
+        if query_limit:
+            num_results = min(query_limit, num_results)
+        if num_results <= 0:
+            return []
+
+        num_top = num_results + num_ignored
+        if num_top < num_candidates:
+            top_indexes = np.argpartition(-query_similarities, num_top - 1)[:num_top]
+            # Keep every candidate tied with the smallest selected similarity,
+            # the partition selects an arbitrary subset of them
+            min_similarity = query_similarities[top_indexes].min()
+            top_indexes = np.flatnonzero(query_similarities >= min_similarity)
+        else:
+            top_indexes = np.arange(num_candidates)
+        top_indexes = top_indexes[~ignore_mask[top_indexes]]
+
+        # Sort by decreasing similarity (ties by the candidate order)
+        sorted_indexes = top_indexes[np.lexsort((top_indexes, -query_similarities[top_indexes]))][:num_results]
+
+        return [{'event_id': candidate_event_ids[index],
+                 'similarity': query_similarities[index]}
+                for index in sorted_indexes]
 
     def save_model(self, output_dir):
         """
@@ -355,24 +1079,120 @@ class EventContentModel(object):
         model_filepath = os.path.join(output_dir, model_filename)
 
         if self.model:
-            self.model.save(model_filepath)
+            # Every numpy array is stored in a separated file, so it can be loaded memory-mapped
+            self.model.save(model_filepath, sep_limit=0)
 
-    def load_model(self, input_dir):
+    def load_model(self, input_dir, mmap=None):
         """
         Load the Model in the specified input_dir, with the format: <self.model_name>.model
+        If mmap is given (e.g. 'r') the large arrays are loaded memory-mapped
         """
         model_filename = "%s.model" % self.model_name
         model_filepath = os.path.join(input_dir, model_filename)
         if os.path.exists(model_filepath):
             if self.algorithm == "TFIDF":
-                self.model = models.TfidfModel.load(model_filepath)
+                self.model = models.TfidfModel.load(model_filepath, mmap=mmap)
             elif self.algorithm == "LSI":
-                self.model = models.LsiModel.load(model_filepath)
+                self.model = models.LsiModel.load(model_filepath, mmap=mmap)
             elif self.algorithm == "LDA":
-                self.model = models.LdaModel.load(model_filepath)
+                self.model = models.LdaModel.load(model_filepath, mmap=mmap)
             else:
                 return False
         else:
             return False
         return True
 
+    def save_bundle(self, bundle_dir):
+        """
+        Save a complete (and versioned) model bundle in bundle_dir, with everything needed to recommend:
+            the model, the dictionary, the tfidf_model, the corpus of bows, the event id indexes
+            and the query index (with its indexed event ids)
+        The bundle is written in a temporary directory and then renamed, so a bundle_dir that
+        exists is always complete
+        """
+        tmp_bundle_dir = "%s.tmp-%d" % (bundle_dir, os.getpid())
+        if os.path.exists(tmp_bundle_dir):
+            shutil.rmtree(tmp_bundle_dir)
+        os.makedirs(tmp_bundle_dir)
+
+        self.save_model(tmp_bundle_dir)
+        self.dictionary.save(os.path.join(tmp_bundle_dir, "dictionary"))
+        if self.tfidf_model:
+            self.tfidf_model.save(os.path.join(tmp_bundle_dir, "tfidf.model"), sep_limit=0)
+
+        corpus_of_bows = self.corpus_of_bows
+        if not isinstance(corpus_of_bows, CsrBowCorpus):
+            corpus_of_bows = CsrBowCorpus.from_bows(corpus_of_bows)
+        corpus_of_bows.save(os.path.join(tmp_bundle_dir, "corpus"))
+
+        index_type = None
+        if isinstance(self.corpus_query_index, IvfSimilarityIndex):
+            index_type = "ivf"
+            self.corpus_query_index.save(os.path.join(tmp_bundle_dir, "query_index_ivf"))
+        elif isinstance(self.corpus_query_index, DenseSimilarityIndex):
+            index_type = "dense"
+            self.corpus_query_index.save(os.path.join(tmp_bundle_dir, "query_index.npy"))
+        elif self.corpus_query_index is not None:
+            index_type = "sparse"
+            self.corpus_query_index.save(os.path.join(tmp_bundle_dir, "query_index"), sep_limit=0)
+
+        with open(os.path.join(tmp_bundle_dir, "bundle.json"), "w") as bundle_file:
+            json.dump({'version': MODEL_BUNDLE_VERSION,
+                       'algorithm': self.algorithm,
+                       'hyper_parameters': self.hyper_parameters,
+                       'params_name': self.params_name,
+                       'pre_processment': self.pre_processment,
+                       'event_ids': [self.dict_index_event_id[doc_index]
+                                     for doc_index in xrange(len(self.dict_index_event_id))],
+                       'index_type': index_type,
+                       'index_event_ids': self.index_event_ids,
+                       'ann_params': self.ann_params}, bundle_file)
+
+        if os.path.exists(bundle_dir):
+            shutil.rmtree(bundle_dir)
+        os.rename(tmp_bundle_dir, bundle_dir)
+
+    @classmethod
+    def load_bundle(cls, bundle_dir, mmap='r'):
+        """
+        Load a model bundle saved by save_bundle (the large arrays are memory-mapped with the given mmap mode)
+        Return None if there is no bundle in bundle_dir or if its version is not supported
+        """
+        bundle_filepath = os.path.join(bundle_dir, "bundle.json")
+        if not os.path.exists(bundle_filepath):
+            return None
+        with open(bundle_filepath, "r") as bundle_file:
+            bundle = json.load(bundle_file)
+        if bundle['version'] != MODEL_BUNDLE_VERSION:
+            LOGGER.warning("Model bundle [%s] has version %s (expected %d), ignoring it",
+                           bundle_dir, bundle['version'], MODEL_BUNDLE_VERSION)
+            return None
+
+        event_cb_model = cls(bundle['pre_processment'], bundle['algorithm'],
+                             bundle['hyper_parameters'], bundle['params_name'])
+        if not event_cb_model.load_model(bundle_dir, mmap=mmap):
+            return None
+        event_cb_model.dictionary = corpora.Dictionary.load(os.path.join(bundle_dir, "dictionary"))
+        if os.path.exists(os.path.join(bundle_dir, "tfidf.model")):
+            event_cb_model.tfidf_model = models.TfidfModel.load(os.path.join(bundle_dir, "tfidf.model"), mmap=mmap)
+        event_cb_model.corpus_of_bows = CsrBowCorpus.load(os.path.join(bundle_dir, "corpus"), mmap=mmap)
+
+        for doc_index, event_id in enumerate(bundle['event_ids']):
+            event_id = str(event_id)
+            event_cb_model.dict_index_event_id[doc_index] = event_id
+            event_cb_model.dict_event_id_index[event_id] = doc_index
+
+        event_cb_model.ann_params = bundle.get('ann_params')
+        if bundle['index_type'] == "ivf":
+            event_cb_model.corpus_query_index = IvfSimilarityIndex.load(os.path.join(bundle_dir, "query_index_ivf"),
+                                                                        mmap=mmap)
+        elif bundle['index_type'] == "dense":
+            event_cb_model.corpus_query_index = DenseSimilarityIndex.load(os.path.join(bundle_dir, "query_index.npy"),
+                                                                          mmap=mmap)
+        elif bundle['index_type'] == "sparse":
+            event_cb_model.corpus_query_index = similarities.SparseMatrixSimilarity.load(
+                os.path.join(bundle_dir, "query_index"), mmap=mmap)
+        if bundle['index_event_ids'] is not None:
+            event_cb_model.index_event_ids = [str(event_id) for event_id in bundle['index_event_ids']]
+
+        return event_cb_model
@@ -0,0 +1,262 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Partition Data of the Content-Based Recommendations (test users, test events and train RSVPs)
+"""
+import os
+import csv
+import logging
+
+from collections import Mapping, OrderedDict
+
+import numpy as np
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('content_based.partition_data')
+LOGGER.setLevel(logging.INFO)
+
+# Number of partitions whose data is kept by load_partition_data (the least recently used one is dropped):
+# the works are ordered by partition, so a process only needs the current partition (and the previous one
+# while the works of the next partition start)
+PARTITION_DATA_CACHE_SIZE = 2
+
+# (partition dir, partition number) -> (mtimes of the partition files, PartitionData), in LRU order
+_PARTITION_DATA_CACHE = OrderedDict()
+
+##############################################################################
+# PRIVATE FUNCTIONS
+##############################################################################
+def _get_partition_files(partition_dir):
+    """ The files read by PartitionData.read """
+    return [os.path.join(partition_dir, "users_test.tsv"),
+            os.path.join(partition_dir, "event-candidates_test.tsv"),
+            os.path.join(partition_dir, "user-event-rsvptime_train.tsv"),
+            os.path.join(partition_dir, "..", "count_users_per_test-event_train.tsv"),
+            os.path.join(partition_dir, "..", "..", "..", "partition_times.csv")]
+
+def _get_mtimes(filenames):
+    """ The modification times of the files (None if a file does not exist) """
+    mtimes = []
+    for filename in filenames:
+        try:
+            mtimes.append(os.stat(filename).st_mtime)
+        except OSError:
+            mtimes.append(None)
+    return tuple(mtimes)
+
+def _get_set_test_users(partition_dir):
+    """ Read the Test Users TSV file """
+    test_users_tsv_path = os.path.join(partition_dir, "users_test.tsv")
+    with open(test_users_tsv_path, "r") as users_test_file:
+        users_test_reader = csv.reader(users_test_file, delimiter="\t")
+        return set([row[0] for row in users_test_reader])
+
+def _get_dict_event_rsvp_count_train(partition_dir):
+    """ Read the count_users_per_train-event_train.csv  """
+    dict_event_count = {}
+    count_rsvps_filename = os.path.join(partition_dir, "..", "count_users_per_test-event_train.tsv")
+    with open(count_rsvps_filename, "r") as count_rsvps_file:
+        count_rsvps_reader = csv.reader(count_rsvps_file, delimiter="\t")
+        for row in count_rsvps_reader:
+            dict_event_count.setdefault(row[0], int(row[1]))
+    return dict_event_count
+
+def _get_partition_time(partition_dir, partition_number):
+    """ Read the Partition Times CSV File and extract the partition_time (None if there is no such partition) """
+    partition_times_path = os.path.join(partition_dir, "..", "..", "..", "partition_times.csv")
+    with open(partition_times_path, "r") as partition_times_file:
+        partition_times_reader = csv.reader(partition_times_file)
+        partition_times_reader.next()
+        for row in partition_times_reader:
+            if int(row[0]) == partition_number:
+                return int(row[2])
+    return None
+
+##############################################################################
+# PUBLIC CLASSES
+##############################################################################
+class UserEventsTrain(Mapping):
+    """
+    The train RSVPs of the users (user-event-rsvptime_train.tsv) stored as numpy arrays grouped by user:
+        users (sorted user ids), indptr (int64, one entry per user + 1),
+        event_codes (int32, index of each RSVP event in event_ids) and rsvp_times (int64)
+    The RSVPs of users[i] are the positions indptr[i]:indptr[i + 1] (in the file order).
+    It behaves as the dict user -> {'event_id_list': [...], 'rsvp_time_list': [...]} (a new dict at
+    each access), and get_rsvp_arrays gathers the RSVPs of many users at once.
+    """
+
+    def __init__(self, users, indptr, event_ids, event_codes, rsvp_times):
+        self.users = users
+        self.indptr = indptr
+        self.event_ids = event_ids
+        self.event_codes = event_codes
+        self.rsvp_times = rsvp_times
+
+    @classmethod
+    def read(cls, partition_dir):
+        """ Read the Train User-Event TSV file """
+        train_user_events_tsv_path = os.path.join(partition_dir, "user-event-rsvptime_train.tsv")
+        user_list, event_code_list, rsvp_time_list = [], [], []
+        dict_event_code = {}
+        with open(train_user_events_tsv_path, "r") as user_event_train_file:
+            user_event_train_reader = csv.reader(user_event_train_file, delimiter="\t")
+            for row in user_event_train_reader:
+                user_list.append(row[0])
+                event_code_list.append(dict_event_code.setdefault(row[1], len(dict_event_code)))
+                rsvp_time_list.append(int(row[2]))
+
+        event_ids = [None] * len(dict_event_code)
+        for event_id, event_code in dict_event_code.iteritems():
+            event_ids[event_code] = event_id
+
+        # Group the RSVPs by user (a stable sort keeps the file order of each user's RSVPs)
+        users, user_codes = np.unique(np.array(user_list, dtype=str), return_inverse=True)
+        order = np.argsort(user_codes, kind='mergesort')
+        indptr = np.zeros(len(users) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(user_codes, minlength=len(users)))
+        return cls(users, indptr, np.array(event_ids, dtype=str),
+                   np.array(event_code_list, dtype=np.int32)[order], np.array(rsvp_time_list, dtype=np.int64)[order])
+
+    def _get_position(self, user):
+        """ The position of the user in users (None if the user has no train RSVP) """
+        position = int(np.searchsorted(self.users, user))
+        if position < len(self.users) and self.users[position] == user:
+            return position
+        return None
+
+    def __getitem__(self, user):
+        position = self._get_position(user)
+        if position is None:
+            raise KeyError(user)
+        begin, end = self.indptr[position], self.indptr[position + 1]
+        return {'event_id_list': self.event_ids[self.event_codes[begin:end]].tolist(),
+                'rsvp_time_list': self.rsvp_times[begin:end].tolist()}
+
+    def __contains__(self, user):
+        return self._get_position(user) is not None
+
+    def __iter__(self):
+        for user in self.users:
+            yield str(user)
+
+    def __len__(self):
+        return len(self.users)
+
+    def get_rsvp_arrays(self, users):
+        """
+        Gather the train RSVPs of the users with train events (in the given order): return the list of these
+        users and the arrays (user row in that list, event code, rsvp time) of their RSVPs
+        """
+        profile_users, positions = [], []
+        for user in users:
+            position = self._get_position(user)
+            if position is not None:
+                profile_users.append(user)
+                positions.append(position)
+        positions = np.array(positions, dtype=np.int64)
+
+        begins = self.indptr[positions]
+        counts = self.indptr[positions + 1] - begins
+        rows = np.repeat(np.arange(len(positions)), counts)
+        # The position of each RSVP: its user begin + its offset in the user RSVPs
+        rsvp_positions = np.repeat(begins - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+        return profile_users, rows, self.event_codes[rsvp_positions], self.rsvp_times[rsvp_positions]
+
+
+class PartitionData(Mapping):
+    """
+    The Partition data used by cb_recommend, read once from the partition files:
+        test_users (set), test_events (list), dict_user_events_train (UserEventsTrain),
+        dict_count_rsvps_events_train (dict) and partition_time
+    It is a read-only mapping of these names (as the dict of the previous versions) and it is picklable,
+    so it can be shared with the Pool workers (by fork or pickling). See load_partition_data to reuse it.
+    """
+
+    _KEYS = ('test_users', 'test_events', 'dict_user_events_train', 'dict_count_rsvps_events_train',
+             'partition_time')
+
+    def __init__(self, test_users, test_events, dict_user_events_train, dict_count_rsvps_events_train,
+                 partition_time):
+        self.test_users = test_users
+        self.test_events = test_events
+        self.dict_user_events_train = dict_user_events_train
+        self.dict_count_rsvps_events_train = dict_count_rsvps_events_train
+        self.partition_time = partition_time
+
+    @classmethod
+    def read(cls, partition_dir, partition_number):
+        """ Read the Partition data files """
+        LOGGER.info("Reading the Partition data (test users, test events and train user-event pairs)")
+        test_users = _get_set_test_users(partition_dir)
+        test_events = read_test_events(partition_dir)
+        dict_user_events_train = UserEventsTrain.read(partition_dir)
+
+        LOGGER.info("Reading extra data for User Profiles")
+        return cls(test_users, test_events, dict_user_events_train,
+                   _get_dict_event_rsvp_count_train(partition_dir),
+                   _get_partition_time(partition_dir, partition_number))
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+##############################################################################
+# PUBLIC FUNCTIONS
+##############################################################################
+def read_test_events(partition_dir):
+    """ Read the Test Events TSV file """
+    test_events_tsv_path = os.path.join(partition_dir, "event-candidates_test.tsv")
+    with open(test_events_tsv_path, "r") as event_test_file:
+        events_test_reader = csv.reader(event_test_file, delimiter="\t")
+        return [row[0] for row in events_test_reader]
+
+def load_partition_data(partition_dir, partition_number):
+    """
+    The PartitionData of the partition, memoized per (partition dir, partition number) for the
+    PARTITION_DATA_CACHE_SIZE most recently used partitions of this process:
+    it is read again only if a partition file was modified (by its mtime)
+    """
+    key = (os.path.realpath(partition_dir), partition_number)
+    mtimes = _get_mtimes(_get_partition_files(partition_dir))
+    cached = _PARTITION_DATA_CACHE.pop(key, None)
+    if cached is not None and cached[0] == mtimes:
+        LOGGER.info("Using the Partition data already read from [%s]", partition_dir)
+        _PARTITION_DATA_CACHE[key] = cached
+        return cached[1]
+
+    # The least recently used partitions are dropped before reading the new one
+    while _PARTITION_DATA_CACHE and len(_PARTITION_DATA_CACHE) >= PARTITION_DATA_CACHE_SIZE:
+        _PARTITION_DATA_CACHE.popitem(last=False)
+    partition_data = PartitionData.read(partition_dir, partition_number)
+    _PARTITION_DATA_CACHE[key] = (mtimes, partition_data)
+    return partition_data
@@ -0,0 +1,375 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Local Recommendation Server of a trained Content-Based model (a model bundle, see EventContentModel.save_bundle)
+Usage (from src/recommender_execution): python -m content_based.recommendation_server --bundle-dir <dir> --partition-dir <dir> [options]
+    GET  /recommend?user=<user_id>&k=<k>   top-k events of a user (with the partition train RSVPs)
+    POST /recommend                        top-k events of an ad-hoc history, JSON body:
+                                           {"event_ids": [...], "rsvp_times": [...] (optional), "k": <k>}
+    GET  /stats                            requests, batches and latency (p50/p99) counters
+The concurrent requests are micro-batched: their User Profiles are built and scored against the query index
+together (one matrix product per batch)
+"""
+import time
+import json
+import Queue
+import logging
+import threading
+import urlparse
+
+from argparse import ArgumentParser
+from collections import deque
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+from model import EventContentModel
+from partition_data import load_partition_data
+from event_recommender import UserProfileConf, MAX_RECS_PER_USER
+from user_profiles import build_user_profiles
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('content_based.recommendation_server')
+LOGGER.setLevel(logging.INFO)
+
+# Maximum number of requests scored together and maximum wait for more requests after the first one
+MAX_BATCH_SIZE = 64
+MAX_BATCH_WAIT_SECS = 0.002
+
+# The latency percentiles are computed over the last LATENCY_WINDOW_SIZE requests
+LATENCY_WINDOW_SIZE = 10000
+
+##############################################################################
+# PRIVATE CLASSES
+##############################################################################
+class _QueryRequest(object):
+    """ A query waiting in the batcher: the user train events and the number of results """
+
+    def __init__(self, user_events_train, k):
+        self.user_events_train = user_events_train
+        self.k = k
+        self.rec_events = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _RecommendationRequestHandler(BaseHTTPRequestHandler):
+    """ HTTP handler of the RecommendationServer (JSON responses) """
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = urlparse.parse_qs(url.query)
+        if url.path == "/recommend":
+            if 'user' not in params:
+                self._send_json(400, {'error': "Missing the 'user' parameter"})
+                return
+            self._recommend(lambda k: self.server.recommender.recommend_user(params['user'][0], k),
+                            params.get('k', [MAX_RECS_PER_USER])[0])
+        elif url.path == "/stats":
+            self._send_json(200, self.server.recommender.get_stats())
+        else:
+            self._send_json(404, {'error': "Unknown path [%s]" % url.path})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/recommend":
+            self._send_json(404, {'error': "Unknown path [%s]" % url.path})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            event_ids = [str(event_id) for event_id in body['event_ids']]
+        except (ValueError, KeyError, TypeError):
+            self._send_json(400, {'error': "The body must be a JSON object with the 'event_ids' list"})
+            return
+        self._recommend(lambda k: self.server.recommender.recommend_history(event_ids, body.get('rsvp_times'), k),
+                        body.get('k', MAX_RECS_PER_USER))
+
+    def _recommend(self, recommend, k):
+        """ Answer a recommendation request (the latency and the errors are counted) """
+        start_time = time.time()
+        try:
+            try:
+                k = int(k)
+            except (TypeError, ValueError):
+                raise ValueError("k must be a positive integer (got %r)" % (k,))
+            if k <= 0:
+                raise ValueError("k must be a positive integer (got %r)" % (k,))
+            rec_events = recommend(k)
+        except ValueError as error:
+            self.server.recommender.latency_stats.add(time.time() - start_time, error=True)
+            self._send_json(400, {'error': str(error)})
+            return
+        except Exception as error:
+            LOGGER.exception("Error answering [%s]", self.path)
+            self.server.recommender.latency_stats.add(time.time() - start_time, error=True)
+            self._send_json(500, {'error': str(error)})
+            return
+        self.server.recommender.latency_stats.add(time.time() - start_time)
+        self._send_json(200, {'recommendations': [{'event_id': rec['event_id'],
+                                                   'similarity': float(rec['similarity'])}
+                                                  for rec in rec_events]})
+
+    def _send_json(self, status, data):
+        """ Send the data as a JSON response """
+        response = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        LOGGER.debug("%s - %s", self.client_address[0], format % args)
+
+##############################################################################
+# PUBLIC CLASSES
+##############################################################################
+class LatencyStats(object):
+    """ Thread-safe request counters and latencies (percentiles over the last window_size requests) """
+
+    def __init__(self, window_size=LATENCY_WINDOW_SIZE):
+        self.num_requests = 0
+        self.num_errors = 0
+        self._latencies = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def add(self, latency, error=False):
+        """ Count a request and its latency (in seconds) """
+        with self._lock:
+            self.num_requests += 1
+            if error:
+                self.num_errors += 1
+            else:
+                self._latencies.append(latency)
+
+    def get_stats(self):
+        """ The counters and the latency percentiles (in milliseconds) """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            stats = {'requests': self.num_requests, 'errors': self.num_errors}
+        stats['latency_ms'] = {'p50': None, 'p99': None, 'window': len(latencies)}
+        if len(latencies):
+            stats['latency_ms']['p50'] = float(np.percentile(latencies, 50) * 1000)
+            stats['latency_ms']['p99'] = float(np.percentile(latencies, 99) * 1000)
+        return stats
+
+
+class QueryBatcher(object):
+    """
+    Micro-batching of the concurrent queries: a thread takes the waiting queries (up to max_batch_size,
+    waiting at most max_batch_wait_secs for more after the first one), builds their User Profiles at once
+    (see user_profiles.build_user_profiles) and scores them in a single matrix product
+    (see EventContentModel.query_model_batch). submit blocks the caller until its query is answered.
+    """
+
+    def __init__(self, event_cb_model, user_profile_conf, candidate_event_ids, partition_data,
+                 max_batch_size=MAX_BATCH_SIZE, max_batch_wait_secs=MAX_BATCH_WAIT_SECS):
+        self.event_cb_model = event_cb_model
+        self.user_profile_conf = user_profile_conf
+        self.candidate_event_ids = candidate_event_ids
+        self.partition_data = partition_data
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_wait_secs = max_batch_wait_secs
+        self.num_batches = 0
+        self.num_queries = 0
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="query-batcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, user_events_train, k):
+        """ The top-k recommendations (list of {'event_id', 'similarity'}) of the user train events """
+        request = _QueryRequest(user_events_train, k)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.rec_events
+
+    def close(self):
+        """ Stop the batcher thread (after the waiting queries) """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        """ Batcher thread: answer the waiting queries in batches until close """
+        running = True
+        while running:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.time() + self.max_batch_wait_secs
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                batch.append(request)
+            self._answer(batch)
+
+    def _answer(self, batch):
+        """ Build the User Profiles of the batch and score them together """
+        try:
+            batch_partition_data = dict(self.partition_data,
+                                        dict_user_events_train=dict((index, request.user_events_train)
+                                                                    for index, request in enumerate(batch)
+                                                                    if request.user_events_train['event_id_list']))
+            dict_user_profiles = build_user_profiles(self.user_profile_conf, range(len(batch)), batch_partition_data,
+                                                     self.event_cb_model)
+            query_indexes = [index for index in xrange(len(batch)) if index in dict_user_profiles]
+            list_rec_events = self.event_cb_model.query_model_batch(
+                [dict_user_profiles[index] for index in query_indexes], self.candidate_event_ids,
+                [batch[index].user_events_train['event_id_list'] for index in query_indexes],
+                max(request.k for request in batch))
+
+            for request in batch:
+                request.rec_events = []
+            for index, rec_events in zip(query_indexes, list_rec_events):
+                batch[index].rec_events = rec_events[:batch[index].k]
+        except Exception as error:
+            LOGGER.exception("Error answering a batch of %d queries", len(batch))
+            for request in batch:
+                request.error = error
+        self.num_batches += 1
+        self.num_queries += len(batch)
+        for request in batch:
+            request.done.set()
+
+
+class LocalRecommender(object):
+    """
+    Recommender of a trained model: the top-k candidate events of the users of the partition
+    (by their train RSVPs) or of ad-hoc histories, answered by a QueryBatcher
+    """
+
+    def __init__(self, event_cb_model, partition_data, user_profile_conf,
+                 max_batch_size=MAX_BATCH_SIZE, max_batch_wait_secs=MAX_BATCH_WAIT_SECS):
+        self.event_cb_model = event_cb_model
+        self.partition_data = partition_data
+        self.latency_stats = LatencyStats()
+
+        candidate_event_ids = partition_data['test_events']
+        if event_cb_model.corpus_query_index is None or event_cb_model.index_event_ids != candidate_event_ids:
+            LOGGER.info("Creating the Index to submit the User Profile Queries")
+            event_cb_model.index_events(candidate_event_ids)
+        self.batcher = QueryBatcher(event_cb_model, user_profile_conf, candidate_event_ids, partition_data,
+                                    max_batch_size=max_batch_size, max_batch_wait_secs=max_batch_wait_secs)
+
+    def recommend_user(self, user, k=MAX_RECS_PER_USER):
+        """ The top-k events of a user of the partition (no recommendation without train RSVPs) """
+        dict_user_events_train = self.partition_data['dict_user_events_train']
+        if user not in dict_user_events_train:
+            return []
+        return self.batcher.submit(dict_user_events_train[user], k)
+
+    def recommend_history(self, event_ids, rsvp_times=None, k=MAX_RECS_PER_USER):
+        """
+        The top-k events of an ad-hoc history: the event ids (of the model corpus) and their RSVP times
+        (the partition time by default). The history events are not recommended.
+        """
+        unknown_event_ids = [event_id for event_id in event_ids
+                             if event_id not in self.event_cb_model.dict_event_id_index]
+        if unknown_event_ids:
+            raise ValueError("Unknown events: %s" % ", ".join(unknown_event_ids[:10]))
+        if rsvp_times is None:
+            rsvp_times = [self.partition_data['partition_time']] * len(event_ids)
+        if len(rsvp_times) != len(event_ids):
+            raise ValueError("There must be one RSVP time per event")
+        return self.batcher.submit({'event_id_list': list(event_ids),
+                                    'rsvp_time_list': [int(rsvp_time) for rsvp_time in rsvp_times]}, k)
+
+    def get_stats(self):
+        """ The request counters, the latency percentiles and the batching counters """
+        stats = self.latency_stats.get_stats()
+        stats['batches'] = self.batcher.num_batches
+        stats['mean_batch_size'] = self.batcher.num_queries / float(max(1, self.batcher.num_batches))
+        return stats
+
+    def close(self):
+        """ Stop the batcher """
+        self.batcher.close()
+
+
+class RecommendationServer(ThreadingMixIn, HTTPServer):
+    """ Threaded HTTP server of a LocalRecommender (one thread per connection) """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, recommender):
+        HTTPServer.__init__(self, server_address, _RecommendationRequestHandler)
+        self.recommender = recommender
+
+
+if __name__ == "__main__":
+
+    PARSER = ArgumentParser(description="Local recommendation server of a trained Content-Based model bundle")
+    PARSER.add_argument("--bundle-dir", dest="bundle_dir", type=str, required=True,
+                        help="The model bundle directory (see run_rec_content_based.py --models-dir)")
+    PARSER.add_argument("--partition-dir", dest="partition_dir", type=str, required=True,
+                        help="The content_based_models partition dir (test events, train RSVPs)")
+    PARSER.add_argument("--partition-number", dest="partition_number", type=int, default=1,
+                        help="The partition number (partition time)")
+    PARSER.add_argument("--user-profile", dest="user_profile", type=str, default="SUM",
+                        choices=["SUM", "TIME", "INV-POPULARITY"],
+                        help="The User Profile of the queries")
+    PARSER.add_argument("--daily-decay", dest="daily_decay", type=float, default=0.01,
+                        help="The daily decay of the TIME User Profile")
+    PARSER.add_argument("--host", type=str, default="127.0.0.1",
+                        help="The address to listen on")
+    PARSER.add_argument("--port", type=int, default=8080,
+                        help="The port to listen on (0: any free port)")
+    PARSER.add_argument("--max-batch-size", dest="max_batch_size", type=int, default=MAX_BATCH_SIZE,
+                        help="Maximum number of concurrent queries scored together")
+    PARSER.add_argument("--max-batch-wait-ms", dest="max_batch_wait_ms", type=float,
+                        default=MAX_BATCH_WAIT_SECS * 1000,
+                        help="Maximum wait for more queries after the first one of a batch (milliseconds)")
+    ARGS = PARSER.parse_args()
+
+    EVENT_CB_MODEL = EventContentModel.load_bundle(ARGS.bundle_dir, mmap='r')
+    if EVENT_CB_MODEL is None:
+        PARSER.error("There is no (supported) model bundle in [%s]" % ARGS.bundle_dir)
+
+    USER_PROFILE_PARAMS = {'daily_decay': ARGS.daily_decay} if ARGS.user_profile == "TIME" else {}
+    RECOMMENDER = LocalRecommender(EVENT_CB_MODEL, load_partition_data(ARGS.partition_dir, ARGS.partition_number),
+                                   UserProfileConf(ARGS.user_profile, USER_PROFILE_PARAMS, ""),
+                                   max_batch_size=ARGS.max_batch_size,
+                                   max_batch_wait_secs=ARGS.max_batch_wait_ms / 1000.0)
+    SERVER = RecommendationServer((ARGS.host, ARGS.port), RECOMMENDER)
+    LOGGER.info("Serving the model [%s] on http://%s:%d", ARGS.bundle_dir, SERVER.server_address[0],
+                SERVER.server_address[1])
+    try:
+        SERVER.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        SERVER.server_close()
+        RECOMMENDER.close()
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Similarity Indexes of the Event Representations
+"""
+import os
+import json
+import logging
+
+import numpy as np
+
+from gensim import matutils
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('content_based.similarity')
+LOGGER.setLevel(logging.INFO)
+
+##############################################################################
+# Private FUNCTIONS
+##############################################################################
+def _unit_rows(matrix):
+    """ Normalize (in place) the matrix rows to unit length (zero rows are kept zero) """
+    norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix, dtype=np.float64))
+    norms[norms == 0] = 1.0
+    matrix /= norms[:, np.newaxis].astype(matrix.dtype)
+    return matrix
+
+##############################################################################
+# Public CLASSES
+##############################################################################
+
+class DenseSimilarityIndex(object):
+    """
+    Cosine Similarity Index of dense (low dimensional) vectors, e.g. the LSI and LDA topics
+    The documents are kept in a (num_docs x num_features) float32 matrix of unit rows,
+    so a query is a single BLAS matrix-vector product (or matrix-matrix for a block of queries).
+    It has the same interface of the gensim similarity indexes: index[query] returns the
+    similarities of the query to all documents (index[list of queries] returns a matrix)
+    """
+
+    def __init__(self, corpus, num_features, dtype=np.float32):
+        self.num_features = num_features
+        if isinstance(corpus, np.ndarray):
+            self.index = _unit_rows(np.array(corpus, dtype=dtype))
+        else:
+            vectors = [matutils.sparse2full(vector, num_features) for vector in corpus]
+            self.index = _unit_rows(np.array(vectors, dtype=dtype).reshape(len(vectors), num_features))
+
+    @classmethod
+    def load(cls, filename, mmap='r'):
+        """ Load the index matrix from a .npy file (memory-mapped with the given mmap mode) """
+        dense_index = cls.__new__(cls)
+        dense_index.index = np.load(filename, mmap_mode=mmap)
+        dense_index.num_features = dense_index.index.shape[1]
+        return dense_index
+
+    def save(self, filename):
+        """ Save the index matrix in a .npy file """
+        np.save(filename, self.index)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def to_dense_queries(self, queries):
+        """ Convert the queries (a vector or a list of vectors in the gensim format) to unit rows """
+        if isinstance(queries, np.ndarray):
+            return _unit_rows(np.array(queries, dtype=self.index.dtype, ndmin=2))
+        return _unit_rows(np.array([matutils.sparse2full(query, self.num_features) for query in queries],
+                                   dtype=self.index.dtype).reshape(len(queries), self.num_features))
+
+    def __getitem__(self, query):
+        # A single query: list of (feature_id, value) tuples
+        is_single_query = not isinstance(query, np.ndarray) and \
+                          (len(query) == 0 or isinstance(query[0], tuple))
+        if is_single_query:
+            dense_query = self.to_dense_queries([query])[0]
+            return np.dot(self.index, dense_query)
+        dense_queries = self.to_dense_queries(query)
+        similarities = np.dot(dense_queries, self.index.T)
+        if isinstance(query, np.ndarray) and query.ndim == 1:
+            return similarities[0]
+        return similarities
+
+    def nbytes(self):
+        """ Memory used by the index (in bytes) """
+        return self.index.nbytes
+
+
+class IvfSimilarityIndex(DenseSimilarityIndex):
+    """
+    Approximate Cosine Similarity Index (inverted file): the documents are clustered by a spherical
+    k-means (the coarse quantizer) and a query is scored only against the documents of its nprobe
+    most similar clusters, the other documents get the similarity -inf.
+    The nprobe attribute is the recall/latency trade-off: with nprobe = num_clusters it is exact.
+    A query may ask for a minimum number of scored documents (see query): the next most similar
+    clusters are probed until their documents cover it, so a top-k selection is never short.
+    """
+
+    _ARRAY_NAMES = ('index', 'centroids', 'cluster_members', 'cluster_indptr')
+
+    def __init__(self, corpus, num_features, num_clusters=None, nprobe=8, num_iterations=10, seed=0,
+                 dtype=np.float32):
+        if num_iterations < 1:
+            raise ValueError("The number of k-means iterations must be at least 1 (got %s)" % num_iterations)
+        super(IvfSimilarityIndex, self).__init__(corpus, num_features, dtype=dtype)
+        num_docs = len(self)
+        if num_clusters is None:
+            num_clusters = int(np.sqrt(num_docs))
+        num_clusters = max(1, min(num_clusters, num_docs))
+        self.nprobe = nprobe
+
+        # Spherical k-means: the centroids are unit vectors and the documents are assigned by cosine
+        random_state = np.random.RandomState(seed)
+        self.centroids = np.array(self.index[random_state.choice(num_docs, num_clusters, replace=False)])
+        assignments = None
+        for iteration in xrange(num_iterations):
+            new_assignments = self._assign(self.index)
+            if assignments is not None and np.array_equal(assignments, new_assignments):
+                break
+            assignments = new_assignments
+            sums = np.zeros_like(self.centroids, dtype=np.float64)
+            np.add.at(sums, assignments, self.index)
+            non_empty = np.bincount(assignments, minlength=num_clusters) > 0
+            # The empty clusters keep their previous centroid
+            self.centroids[non_empty] = _unit_rows(sums[non_empty]).astype(self.centroids.dtype)
+        LOGGER.info("IVF index: %d documents in %d clusters (%d k-means iterations)", num_docs, num_clusters,
+                    iteration + 1)
+
+        # Inverted lists: the documents ordered by cluster (and the cluster boundaries)
+        self.cluster_members = np.argsort(assignments, kind='mergesort').astype(np.int32)
+        self.cluster_indptr = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=num_clusters))])
+
+    def _assign(self, vectors):
+        """ The most similar centroid of each (unit) vector """
+        return np.argmax(np.dot(vectors, self.centroids.T), axis=1)
+
+    @classmethod
+    def load(cls, filename, mmap='r'):
+        """ Load the index arrays from the directory filename (memory-mapped with the given mmap mode) """
+        ivf_index = cls.__new__(cls)
+        for name in cls._ARRAY_NAMES:
+            setattr(ivf_index, name, np.load(os.path.join(filename, "%s.npy" % name), mmap_mode=mmap))
+        ivf_index.num_features = ivf_index.index.shape[1]
+        with open(os.path.join(filename, "params.json"), "r") as params_file:
+            ivf_index.nprobe = json.load(params_file)['nprobe']
+        return ivf_index
+
+    def save(self, filename):
+        """ Save the index arrays in the directory filename (one .npy file per array) """
+        if not os.path.exists(filename):
+            os.makedirs(filename)
+        for name in self._ARRAY_NAMES:
+            np.save(os.path.join(filename, "%s.npy" % name), getattr(self, name))
+        with open(os.path.join(filename, "params.json"), "w") as params_file:
+            json.dump({'nprobe': self.nprobe}, params_file)
+
+    @property
+    def num_clusters(self):
+        """ Number of clusters of the coarse quantizer """
+        return len(self.centroids)
+
+    def _probe(self, dense_query, min_results=0):
+        """
+        Similarities of the documents in the nprobe most similar clusters of the query (-inf for the others),
+        more clusters are probed (in similarity order) until at least min_results documents are scored
+        """
+        similarities = np.empty(len(self), dtype=self.index.dtype)
+        similarities.fill(-np.inf)
+
+        centroid_similarities = np.dot(self.centroids, dense_query)
+        cluster_order = np.argsort(-centroid_similarities, kind='mergesort')
+        cluster_sizes = np.cumsum(np.diff(self.cluster_indptr)[cluster_order])
+        num_probed = max(self.nprobe, int(np.searchsorted(cluster_sizes, min(min_results, len(self)))) + 1)
+        probed_clusters = cluster_order[:num_probed]
+        members = np.concatenate([self.cluster_members[self.cluster_indptr[cluster]:self.cluster_indptr[cluster + 1]]
+                                  for cluster in probed_clusters])
+        similarities[members] = np.dot(self.index[members], dense_query)
+        return similarities
+
+    def __getitem__(self, query):
+        return self.query(query)
+
+    def query(self, query, min_results=0):
+        """
+        The similarities of the query (or the queries) as in __getitem__, each query scoring at least
+        min_results documents (e.g. the top-k size plus the events to be ignored)
+        """
+        # A single query: list of (feature_id, value) tuples
+        is_single_query = not isinstance(query, np.ndarray) and \
+                          (len(query) == 0 or isinstance(query[0], tuple))
+        if is_single_query:
+            return self._probe(self.to_dense_queries([query])[0], min_results)
+        similarities = np.array([self._probe(dense_query, min_results)
+                                 for dense_query in self.to_dense_queries(query)])
+        if isinstance(query, np.ndarray) and query.ndim == 1:
+            return similarities[0]
+        return similarities
+
+    def nbytes(self):
+        """ Memory used by the index (in bytes) """
+        return sum(getattr(self, name).nbytes for name in self._ARRAY_NAMES)
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Persistent Token Cache of the Pre-Processed Events
+"""
+import os
+import json
+import errno
+import hashlib
+import logging
+import tempfile
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('content_based.token_cache')
+LOGGER.setLevel(logging.INFO)
+
+# Prefix of the entries being written (by this or other processes), never evicted
+TMP_ENTRY_PREFIX = ".tmp-"
+
+# After an eviction the cache is reduced to this fraction of its budget (so it is not evicted at every run)
+EVICTION_TARGET_RATIO = 0.9
+
+##############################################################################
+# Private FUNCTIONS
+##############################################################################
+def _get_disk_usage(entry_stat):
+    """ The disk space used by a file (its allocated blocks, at least one file system block per entry) """
+    if hasattr(entry_stat, 'st_blocks'):
+        return entry_stat.st_blocks * 512
+    return entry_stat.st_size
+
+##############################################################################
+# Public CLASSES
+##############################################################################
+
+class TokenCache(object):
+    """
+    On-disk cache of the pre-processed words of the events, content-addressed by
+    (event id, hash of the event texts, hash of the pre-processment config): the same event text
+    pre-processed with the same config is read from the cache by every partition, algorithm and grid point.
+    Each entry is a file written in a temporary file and renamed (atomic), so it is safe for concurrent
+    processes. The least recently used entries (by file mtime) are evicted to keep the cache disk usage
+    (allocated blocks, not file sizes) under max_bytes.
+    The cache is best-effort: an entry that cannot be written (e.g. a full disk) is just not cached.
+    """
+
+    def __init__(self, cache_dir, config, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.config_hash = hashlib.sha1(json.dumps(config, sort_keys=True)).hexdigest()
+        self.num_put_errors = 0
+
+    def _entry_path(self, event_id, texts):
+        """ The file of the (event_id, texts) entry: <cache_dir>/<key[:2]>/<key> """
+        text_hash = hashlib.sha1(u"\x00".join(texts).encode("utf-8")).hexdigest()
+        key = hashlib.sha1("%s:%s:%s" % (self.config_hash, event_id, text_hash)).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, event_id, texts):
+        """ The cached words of the event texts (None if they are not cached) """
+        entry_path = self._entry_path(event_id, texts)
+        try:
+            with open(entry_path, "rb") as entry_file:
+                data = entry_file.read()
+            # Touch the entry: its mtime is the LRU order of the eviction
+            os.utime(entry_path, None)
+        except (IOError, OSError):
+            return None
+        return data.decode("utf-8").split(u"\n") if data else []
+
+    def put(self, event_id, texts, words):
+        """ Cache the words of the event texts (the write errors are logged and the event is not cached) """
+        entry_path = self._entry_path(event_id, texts)
+        entry_dir = os.path.dirname(entry_path)
+        tmp_entry_path = None
+        try:
+            try:
+                os.makedirs(entry_dir)
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+            entry_file, tmp_entry_path = tempfile.mkstemp(dir=entry_dir, prefix=TMP_ENTRY_PREFIX)
+            with os.fdopen(entry_file, "wb") as entry_out:
+                entry_out.write(u"\n".join(words).encode("utf-8"))
+            os.rename(tmp_entry_path, entry_path)
+        except (IOError, OSError) as error:
+            # Only the first error is logged as a warning (e.g. a full disk fails every entry)
+            self.num_put_errors += 1
+            log = LOGGER.warning if self.num_put_errors == 1 else LOGGER.debug
+            log("Token cache [%s]: could not cache the event %s (%s)", self.cache_dir, event_id, error)
+            if tmp_entry_path and os.path.exists(tmp_entry_path):
+                try:
+                    os.remove(tmp_entry_path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """
+        Evict the least recently used entries if the cache disk usage is bigger than max_bytes
+        (down to EVICTION_TARGET_RATIO of max_bytes). Entries removed concurrently are ignored and
+        the entries being written (temporary files) are neither counted nor evicted.
+        """
+        if not self.max_bytes or not os.path.exists(self.cache_dir):
+            return
+
+        entries = []
+        cache_bytes = 0
+        for entry_dir, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.startswith(TMP_ENTRY_PREFIX):
+                    continue
+                entry_path = os.path.join(entry_dir, filename)
+                try:
+                    entry_stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entry_bytes = _get_disk_usage(entry_stat)
+                entries.append((entry_stat.st_mtime, entry_bytes, entry_path))
+                cache_bytes += entry_bytes
+        if cache_bytes <= self.max_bytes:
+            return
+
+        num_evicted = 0
+        target_bytes = self.max_bytes * EVICTION_TARGET_RATIO
+        for _, entry_size, entry_path in sorted(entries):
+            if cache_bytes <= target_bytes:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            cache_bytes -= entry_size
+            num_evicted += 1
+        LOGGER.info("Token cache [%s]: evicted %d entries (%d bytes left)", self.cache_dir, num_evicted, cache_bytes)
@@ -27,6 +27,14 @@ import logging
 
 from abc import ABCMeta, abstractmethod
 
+import numpy as np
+from scipy import sparse
+
+from gensim import matutils, models
+
+from corpus import CsrBowCorpus
+from partition_data import UserEventsTrain
+
 ##############################################################################
 # GLOBAL VARIABLES
 ##############################################################################
@@ -36,6 +44,12 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s
 LOGGER = logging.getLogger('content_based.user_profiles')
 LOGGER.setLevel(logging.INFO)
 
+# Same threshold of the gensim TfidfModel to drop the (near) zero idfs and weights
+TFIDF_EPS = 1e-12
+
+# Number of users sampled to measure the error of the event embeddings profiles (TFIDF chain)
+EMBEDDINGS_ERROR_SAMPLE_SIZE = 200
+
 ##############################################################################
 # CLASSES
 ##############################################################################
@@ -169,3 +183,208 @@ class UserProfileInversePopularity(BaseUserProfile):
         self._representation = self._transform_and_sum_event_bows(event_bows=train_event_bows,
                                                                   event_weights=event_weights,
                                                                   event_cb_model=event_cb_model)
+
+
+##############################################################################
+# Private FUNCTIONS
+##############################################################################
+def _get_event_weights(user_profile_conf, rsvp_times, rsvp_counts, partition_time):
+    """
+    Vectorized event weights of the User Profile (the same weights of the UserProfile classes)
+    Return None if the User Profile is unknown
+    """
+    if user_profile_conf.name == 'SUM':
+        return np.ones(len(rsvp_times))
+    elif user_profile_conf.name == 'TIME':
+        days_from_rsvp = np.floor((partition_time - rsvp_times)/float(60 * 60 * 24)) # Day in Sec
+        return 1 / (1 + float(user_profile_conf.params['daily_decay']))**days_from_rsvp
+    elif user_profile_conf.name == 'INV-POPULARITY':
+        return 1 / (np.log(rsvp_counts + 2) / math.log(2))
+    return None
+
+def _tfidf_matrix(tfidf_model, bow_matrix):
+    """
+    Apply a gensim TfidfModel (with the default unit length normalization) over all rows of a CSR matrix:
+    the columns are multiplied by the idfs, then the rows are normalized
+    """
+    idfs = np.zeros(bow_matrix.shape[1])
+    for term_id, idf in tfidf_model.idfs.iteritems():
+        if term_id < len(idfs) and abs(idf) > TFIDF_EPS:
+            idfs[term_id] = idf
+    tfidf_matrix = (bow_matrix * sparse.diags(idfs)).tocsr()
+    tfidf_matrix.eliminate_zeros()
+
+    norms = np.sqrt(np.asarray(tfidf_matrix.multiply(tfidf_matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    tfidf_matrix = (sparse.diags(1 / norms) * tfidf_matrix).tocsr()
+    tfidf_matrix.data[np.abs(tfidf_matrix.data) <= TFIDF_EPS] = 0
+    tfidf_matrix.eliminate_zeros()
+    return tfidf_matrix
+
+def _csr_row_to_bow(matrix, row):
+    """ Row of a CSR matrix (with sorted indices) in the gensim format """
+    begin, end = matrix.indptr[row], matrix.indptr[row + 1]
+    return zip(matrix.indices[begin:end].tolist(), matrix.data[begin:end].tolist())
+
+def _transform_weighted_bows(weight_matrix, event_cb_model):
+    """
+    The (users x events) weight matrix times the CSR matrix of the corpus BOWs, transformed by the
+    TFIDF (if chained) and the model: a dense (users x topics) matrix for LSI, a CSR matrix with sorted
+    indices for TFIDF or the weighted BOWs for the other models
+    """
+    corpus_of_bows = event_cb_model.corpus_of_bows
+    if not isinstance(corpus_of_bows, CsrBowCorpus):
+        corpus_of_bows = CsrBowCorpus.from_bows(corpus_of_bows)
+    num_terms = len(event_cb_model.dictionary)
+    if len(corpus_of_bows.indices):
+        num_terms = max(num_terms, int(corpus_of_bows.indices.max()) + 1)
+    if isinstance(event_cb_model.model, models.LsiModel):
+        num_terms = max(num_terms, event_cb_model.model.projection.u.shape[0])
+
+    profile_matrix = (weight_matrix * corpus_of_bows.to_csr_matrix(num_terms)).tocsr()
+    profile_matrix.eliminate_zeros()
+
+    if event_cb_model.tfidf_model:
+        profile_matrix = _tfidf_matrix(event_cb_model.tfidf_model, profile_matrix)
+
+    model = event_cb_model.model
+    if isinstance(model, models.TfidfModel):
+        profile_matrix = _tfidf_matrix(model, profile_matrix)
+    elif isinstance(model, models.LsiModel):
+        # Same as LsiModel.__getitem__: project the (users x terms) matrix over the left singular vectors
+        projection = model.projection.u[:, :model.num_topics]
+        return profile_matrix[:, :projection.shape[0]].astype(projection.dtype) * projection
+
+    profile_matrix.sort_indices()
+    return profile_matrix
+
+def _get_train_rsvps(users, partition_data, event_cb_model):
+    """
+    The users with train events and the (user row, corpus event column, rsvp time, rsvp count) of their RSVPs
+    The RSVPs of a partition_data.UserEventsTrain are gathered with array operations (each distinct event is
+    mapped to its corpus column once)
+    """
+    dict_user_events_train = partition_data['dict_user_events_train']
+    dict_count_rsvps_events_train = partition_data['dict_count_rsvps_events_train']
+
+    if isinstance(dict_user_events_train, UserEventsTrain):
+        profile_users, rows, event_codes, rsvp_times = dict_user_events_train.get_rsvp_arrays(users)
+        unique_codes, code_indexes = np.unique(event_codes, return_inverse=True)
+        unique_event_ids = dict_user_events_train.event_ids[unique_codes].tolist()
+        columns = np.array([event_cb_model.dict_event_id_index[event_id] for event_id in unique_event_ids],
+                           dtype=np.int64)[code_indexes]
+        rsvp_counts = np.array([dict_count_rsvps_events_train.get(event_id, 0) for event_id in unique_event_ids],
+                               dtype=np.float64)[code_indexes]
+        return profile_users, rows, columns, rsvp_times.astype(np.float64), rsvp_counts
+
+    # The (user row, corpus event column) pairs of the train RSVPs
+    profile_users = [user for user in users if user in dict_user_events_train]
+    row_list, column_list, rsvp_time_list, rsvp_count_list = [], [], [], []
+    for row, user in enumerate(profile_users):
+        user_events_train = dict_user_events_train[user]
+        for event_id, rsvp_time in zip(user_events_train['event_id_list'], user_events_train['rsvp_time_list']):
+            row_list.append(row)
+            column_list.append(event_cb_model.dict_event_id_index[event_id])
+            rsvp_time_list.append(rsvp_time)
+            rsvp_count_list.append(dict_count_rsvps_events_train.get(event_id, 0))
+    return profile_users, row_list, column_list, np.array(rsvp_time_list, dtype=np.float64), \
+        np.array(rsvp_count_list, dtype=np.float64)
+
+def _log_event_embeddings_error(weight_matrix, topic_matrix, event_cb_model):
+    """
+    The TFIDF normalization of each event breaks the linearity of the event embeddings profiles:
+    log their cosine distance to the exact profiles over a sample of the users
+    """
+    sample_size = min(EMBEDDINGS_ERROR_SAMPLE_SIZE, weight_matrix.shape[0])
+    if sample_size == 0:
+        return
+    sample_rows = np.random.RandomState(0).choice(weight_matrix.shape[0], sample_size, replace=False)
+    exact_matrix = _transform_weighted_bows(weight_matrix[sample_rows], event_cb_model)
+    approx_matrix = topic_matrix[sample_rows]
+
+    norms = np.linalg.norm(exact_matrix, axis=1) * np.linalg.norm(approx_matrix, axis=1)
+    norms[norms == 0] = 1.0
+    cosine_distances = 1 - np.einsum('ij,ij->i', exact_matrix, approx_matrix) / norms
+    LOGGER.info("Event embeddings profiles VS exact profiles (TFIDF chain, %d users): "
+                "cosine distance mean = %.4f, max = %.4f", sample_size, cosine_distances.mean(),
+                cosine_distances.max())
+
+##############################################################################
+# Public FUNCTIONS
+##############################################################################
+def build_user_profiles(user_profile_conf, users, partition_data, event_cb_model, event_embeddings=False,
+                        inference_workers=1):
+    """
+    Vectorized construction of the User Profiles of many users at once (the same profiles of the
+    UserProfile classes, up to the float rounding): a sparse (users x corpus events) weight matrix
+    is multiplied by the CSR matrix of the corpus BOWs, so all weighted BOWs come from one sparse product,
+    and the TFIDF (and LSI) transformations are applied to the whole (users x terms) matrix.
+    Return a dict {user: User Profile Representation} with the users that have events in train
+    (an empty dict if the User Profile is unknown)
+    If event_embeddings is True the LSI profiles are the weighted sums of the event embeddings
+    (see EventContentModel.get_event_embeddings): exact without the TFIDF chain, an approximation
+    with it (its error is measured over a sample of the users and logged)
+    The LDA profiles are inferred in batches (see EventContentModel.infer_topics) by inference_workers processes
+    """
+    return build_multi_user_profiles([user_profile_conf], users, partition_data, event_cb_model,
+                                     event_embeddings=event_embeddings, inference_workers=inference_workers)[0]
+
+def build_multi_user_profiles(user_profile_confs, users, partition_data, event_cb_model, event_embeddings=False,
+                              inference_workers=1):
+    """
+    Vectorized construction of the User Profiles of many users for many User Profile types at once
+    (see build_user_profiles): the train RSVPs of the users are gathered once, the weights of every
+    User Profile are stacked in a single (profiles * users x corpus events) matrix, transformed as a whole
+    Return a list with the dict {user: User Profile Representation} of each User Profile (in the given order)
+    """
+    profile_users, row_list, column_list, rsvp_times, rsvp_counts = _get_train_rsvps(users, partition_data,
+                                                                                    event_cb_model)
+
+    # (users x events) weights of each known User Profile:
+    # the duplicated (user, event) pairs are summed by the COO matrix
+    profile_indexes, weight_matrices = [], []
+    for profile_index, user_profile_conf in enumerate(user_profile_confs):
+        event_weights = _get_event_weights(user_profile_conf, rsvp_times, rsvp_counts,
+                                           partition_data['partition_time'])
+        if event_weights is not None:
+            profile_indexes.append(profile_index)
+            weight_matrices.append(sparse.coo_matrix((event_weights, (row_list, column_list)),
+                                                     shape=(len(profile_users),
+                                                            len(event_cb_model.corpus_of_bows))).tocsr())
+
+    list_dict_user_profiles = [{} for _ in user_profile_confs]
+    if not weight_matrices:
+        return list_dict_user_profiles
+    weight_matrix = sparse.vstack(weight_matrices, format='csr')
+
+    # The representations of all (profile, user) rows
+    if event_embeddings and event_cb_model.algorithm == "LSI":
+        # Linear fast path: (users x events) x (events x topics) dense product
+        topic_matrix = weight_matrix * event_cb_model.get_event_embeddings()
+        if event_cb_model.tfidf_model:
+            _log_event_embeddings_error(weight_matrix, topic_matrix, event_cb_model)
+        representations = [matutils.full2sparse(topic_row) for topic_row in topic_matrix]
+    else:
+        if event_embeddings:
+            LOGGER.warning("There are no event embeddings for the %s model, using the exact profiles",
+                           event_cb_model.algorithm)
+        profile_matrix = _transform_weighted_bows(weight_matrix, event_cb_model)
+        if isinstance(event_cb_model.model, models.LsiModel):
+            representations = [matutils.full2sparse(profile_row) for profile_row in profile_matrix]
+        elif isinstance(event_cb_model.model, models.TfidfModel):
+            representations = [_csr_row_to_bow(profile_matrix, row) for row in xrange(profile_matrix.shape[0])]
+        elif event_cb_model.algorithm == "LDA":
+            # Batched inference of all users' weighted BOWs
+            representations = event_cb_model.infer_topics([_csr_row_to_bow(profile_matrix, row)
+                                                           for row in xrange(profile_matrix.shape[0])],
+                                                          num_workers=inference_workers)
+        else:
+            # Other models transform the weighted BOW of each user
+            representations = [event_cb_model.model[_csr_row_to_bow(profile_matrix, row)]
+                               for row in xrange(profile_matrix.shape[0])]
+
+    for block, profile_index in enumerate(profile_indexes):
+        begin = block * len(profile_users)
+        list_dict_user_profiles[profile_index] = dict(zip(profile_users,
+                                                          representations[begin:begin + len(profile_users)]))
+    return list_dict_user_profiles
@@ -28,6 +28,8 @@ import shutil
 import subprocess, shlex
 from collections import defaultdict
 
+from ranked_list_format import open_ranked_list_writer, get_ranked_list_filename
+
 ##############################################################################
 # GLOBAL VARIABLES
 ##############################################################################
@@ -64,7 +66,10 @@ def _get_test_users(partition_dir):
 
 def _parse_and_persist_user_ranked_list(scores_filepath, test_features_file,
                                         user_recs_filepath, partition_dir):
-    """ Read the event indexes, read the user-event scores, sort and persist the recommendations """
+    """
+    Read the event indexes, read the user-event scores, sort and persist the recommendations
+    (in the ranked list format of the user_recs_filepath extension)
+    """
 
     # Read the event indexes
     dict_userid_index_eventid = {}
@@ -98,14 +103,13 @@ def _parse_and_persist_user_ranked_list(scores_filepath, test_features_file,
     test_users = _get_test_users(partition_dir)
 
     # Persist the recommendations
-    with open(user_recs_filepath, "w") as rec_out_file:
+    with open_ranked_list_writer(user_recs_filepath) as writer:
         for user in test_users:
             top_recs = []
             if user in dict_user_eventheap:
                 top_recs = heapq.nlargest(MAX_RECS_PER_USER, dict_user_eventheap[user])
-            rec_out_file.write("%d\t%s\n" % (user,
-                                             ','.join(["%d:%.6f" % (event_id, score)
-                                                       for score, event_id in top_recs])))
+            writer.write_ranked_list(user, [event_id for _, event_id in top_recs],
+                                     [score for score, _ in top_recs])
 
 ##############################################################################
 # PUBLIC FUNCTIONS
@@ -147,8 +151,8 @@ def _get_extra_train_model_params(model_conf):
 
 
 def train_and_predict(model_conf, full_ensemble_list, train_features_file, test_features_file,
-                      hybrids_dir, partition_dir):
-    """ TRAIN and PREDICT with Learning to Rank Algorithms """
+                      hybrids_dir, partition_dir, ranked_list_format="tsv"):
+    """ TRAIN and PREDICT with Learning to Rank Algorithms (ranked lists in the ranked_list_format) """
 
     ranklib_jar_filepath = os.path.join("src", "recommender_execution", "hybrids", "learning_to_rank", "RankLib.jar")
     hybrids_tmp_dir = os.path.join(hybrids_dir, "tmp")
@@ -197,7 +201,7 @@ def train_and_predict(model_conf, full_ensemble_list, train_features_file, test_
     # -------------------------------------------------------------------------
     LOGGER.info("Parse the score file and generate the recomendations")
 
-    user_rank_filepath = os.path.join(hybrids_dir, "%s.tsv" % model_conf.model_name)
+    user_rank_filepath = get_ranked_list_filename(hybrids_dir, model_conf.model_name, ranked_list_format)
     _parse_and_persist_user_ranked_list(scores_filepath, test_features_file, user_rank_filepath,
                                         partition_dir)
 
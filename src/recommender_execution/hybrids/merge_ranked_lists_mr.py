@@ -31,6 +31,8 @@ from os import path, makedirs
 from mrjob.job import MRJob
 from mrjob import protocol
 
+from ranked_list_format import find_ranked_list_file, is_binary_ranked_list, read_ranked_lists
+
 class MissingDataError(Exception):
     """ Missing Data Error """
     def __init__(self, rank_file):
@@ -74,9 +76,19 @@ class MRMergeRankedLists(MRJob):
 
         yield None, user + "," + event + ',' + ','.join(scores)
 
+def _write_binary_ranked_list_as_tsv(model_rank_file, new_model_rank_file, model_name):
+    """ Write the binary ranked list as the mapper TSV input (with the model name as the last value) """
+    with open(new_model_rank_file, 'w') as new_rank_file:
+        for user_id, event_ids, scores in read_ranked_lists(model_rank_file):
+            new_rank_file.write("%d\t%s\t%s\n" % (user_id,
+                                                 ','.join(["%d:%.6f" % (event_id, score)
+                                                           for event_id, score in zip(event_ids, scores)]),
+                                                 model_name))
+
 def merge_ranked_lists(dict_model_rank_files, rec_partition_dir, parsed_result_dir):
     """
     Merge the Ranked Lists of all models in a unique file
+    The model ranked lists can be in any ranked list format (e.g. 'model.rlb' is read for 'model.tsv')
     """
     # Copy the model ranked lists to the temporary directory and add the model name to it
     data_names = sorted([name for name in dict_model_rank_files.keys() if dict_model_rank_files[name]])
@@ -94,13 +106,16 @@ def merge_ranked_lists(dict_model_rank_files, rec_partition_dir, parsed_result_d
 
 
     for model_name in data_names:
-        model_rank_file = path.join(rec_partition_dir, dict_model_rank_files[model_name])
-        if not path.exists(model_rank_file):
-            raise MissingDataError(model_rank_file)
+        model_rank_file = find_ranked_list_file(path.join(rec_partition_dir, dict_model_rank_files[model_name]))
+        if model_rank_file is None:
+            raise MissingDataError(path.join(rec_partition_dir, dict_model_rank_files[model_name]))
 
         new_model_rank_file = path.join(tmp_parse_dir, model_name + '.tsv')
-        shutil.copy(model_rank_file, new_model_rank_file)
-        subprocess.call(shlex.split("sed -i -E 's/$/\t%s/g' %s" % (model_name, new_model_rank_file)))
+        if is_binary_ranked_list(model_rank_file):
+            _write_binary_ranked_list_as_tsv(model_rank_file, new_model_rank_file, model_name)
+        else:
+            shutil.copy(model_rank_file, new_model_rank_file)
+            subprocess.call(shlex.split("sed -i -E 's/$/\t%s/g' %s" % (model_name, new_model_rank_file)))
 
     # Add the MODEL_NAME as the last value of the ranked list to all RANKED_LIST_FILE in every line with 'sed ...'
     input_args = [path.join(tmp_parse_dir, model + '.tsv')
@@ -23,7 +23,7 @@
 MRBPR Recommender
 """
 
-from os import makedirs, path
+from os import makedirs, path, remove
 from collections import namedtuple
 import csv
 import shlex
@@ -31,6 +31,8 @@ import subprocess
 import time
 import logging
 
+from ranked_list_format import convert_ranked_list, find_ranked_list_file, get_ranked_list_filename
+
 ##############################################################################
 # GLOBAL VARIABLES
 ##############################################################################
@@ -51,6 +53,22 @@ RELATION = namedtuple("relation", ["relation_id",
 MRBPR_MODEL_CONF = namedtuple("mrbpr_model_conf", ["hyper_parameters",
                                                    "params_name"])
 
+##############################################################################
+# PRIVATE FUNCTIONS
+##############################################################################
+def _convert_ranked_lists(finished_processes, dict_proc_ranked_list):
+    """
+    Convert the TSV ranked lists written by the finished processes (mrbpr.bin writes only TSV)
+    to their final files (e.g. the binary ranked list format), removing the TSV files
+    """
+    for proc in finished_processes:
+        if proc not in dict_proc_ranked_list:
+            continue
+        tsv_filename, ranked_list_filename = dict_proc_ranked_list.pop(proc)
+        if proc.returncode == 0 and path.exists(tsv_filename):
+            convert_ranked_list(tsv_filename, ranked_list_filename)
+            remove(tsv_filename)
+
 ##############################################################################
 # PUBLIC FUNCTIONS
 ##############################################################################
@@ -140,11 +158,14 @@ def create_meta_file(relation_names, meta_file_path, partitioned_data_dir):
 
 def run(partitioned_region_data_dir, exp_region_data_dir, region, algorithm, rank_size, save_model, meta_file, regularization_per_entity,
         regularization_per_relation, relation_weights_file, train_relation_files, partitions,
-        num_iterations, num_factors, learning_rates, mrbpr_bin_path, parallel_runs, algorithm_name):
-    """ MRBPR Runner """
+        num_iterations, num_factors, learning_rates, mrbpr_bin_path, parallel_runs, algorithm_name,
+        ranked_list_format="tsv"):
+    """ MRBPR Runner (the ranked lists are persisted in the ranked_list_format: 'tsv' or 'binary') """
 
     # Create the process list
     running_processes = []
+    # Process -> (TSV ranked list, final ranked list) to be converted when it finishes
+    dict_proc_ranked_list = {}
 
     # -------------------------------
     # LOOP: PARTITIONS
@@ -192,7 +213,8 @@ def run(partitioned_region_data_dir, exp_region_data_dir, region, algorithm, ran
                             train_files = ','.join(train_files)
 
                             # Check and Waits for the first process to finish...
-                            running_processes, _ = process_scheduler(running_processes, parallel_runs)
+                            running_processes, finished_processes = process_scheduler(running_processes, parallel_runs)
+                            _convert_ranked_lists(finished_processes, dict_proc_ranked_list)
 
                             if not path.exists(output_dir):
                                 makedirs(output_dir)
@@ -202,7 +224,9 @@ def run(partitioned_region_data_dir, exp_region_data_dir, region, algorithm, ran
                             LOGGER.info("%s - partition %d - %s", region, part, model_name)
 
                             # Check ig the model was already trained/ranked (reuse previous executions)
-                            if path.exists(path.join(output_dir, model_name + ".tsv")):
+                            tsv_filename = get_ranked_list_filename(output_dir, model_name)
+                            ranked_list_filename = get_ranked_list_filename(output_dir, model_name, ranked_list_format)
+                            if find_ranked_list_file(ranked_list_filename):
                                 LOGGER.info("Model already experimented (DONE!)")
                             else:
                                 # Start the new process
@@ -215,13 +239,16 @@ def run(partitioned_region_data_dir, exp_region_data_dir, region, algorithm, ran
 
                                 # Append to the process list
                                 running_processes.append(proc)
+                                if ranked_list_filename != tsv_filename:
+                                    dict_proc_ranked_list[proc] = (tsv_filename, ranked_list_filename)
 
     LOGGER.info("DONE! All processes have already been started!")
 
     if len(running_processes) > 0:
         LOGGER.info("Waiting for the last processes to finish")
         while len(running_processes) > 0:
-            running_processes, _ = process_scheduler(running_processes, parallel_runs)
+            running_processes, finished_processes = process_scheduler(running_processes, parallel_runs)
+            _convert_ranked_lists(finished_processes, dict_proc_ranked_list)
 
             # Check every 5 secs
             time.sleep(5)
@@ -0,0 +1,284 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Ranked List Formats (the recommendations of every recommender)
+    TSV (legacy, '.tsv'): one line per user
+        <user_id>\t<event_id1>:<score1>,<event_id2>:<score2>,...
+    Binary ('.rlb'): fixed-width records, memory-mappable with numpy
+        header:  magic (8 bytes), num_users (int64), num_records (int64)
+        records: num_records x (event_id int32, score float64), the ranked lists of all users
+                 (zero padded to a multiple of 8 bytes)
+        users:   num_users x int32 user ids (zero padded to a multiple of 8 bytes)
+        offsets: (num_users + 1) x int64, the ranked list of users[i] is records[offsets[i]:offsets[i + 1]]
+The binary format requires integer user and event ids (as the mapped ids of the partitioned data)
+The scores are float64, so a TSV file (6 decimal places) converted to binary and back is the same
+
+Usage: python ranked_list_format.py <to-binary|to-tsv> <input_file> <output_file>
+"""
+import os
+import sys
+import logging
+
+import numpy as np
+
+from recommendation_sink import TsvRecommendationSink, SINK_BUFFER_USERS, open_temp_file, \
+                                             commit_temp_file
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('ranked_list_format')
+LOGGER.setLevel(logging.INFO)
+
+MAGIC = "MCLRERL2"
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('num_users', '<i8'), ('num_records', '<i8')])
+RECORD_DTYPE = np.dtype([('event_id', '<i4'), ('score', '<f8')])
+USER_DTYPE = np.dtype('<i4')
+OFFSET_DTYPE = np.dtype('<i8')
+
+TSV_EXTENSION = TsvRecommendationSink.EXTENSION
+BINARY_EXTENSION = ".rlb"
+
+##############################################################################
+# Private FUNCTIONS
+##############################################################################
+def _get_padded_nbytes(dtype, count):
+    """ Size of an array of the file (zero padded to a multiple of 8 bytes) """
+    nbytes = count * dtype.itemsize
+    return nbytes + (-nbytes % 8)
+
+def _parse_tsv_ranked_list(ranked_list):
+    """ Parse the '<event_id1>:<score1>,...' ranked list in the (event_ids, scores) lists """
+    event_ids, scores = [], []
+    for event_score in ranked_list.split(','):
+        if event_score:
+            event_id, score = event_score.split(':')[:2]
+            event_ids.append(int(event_id))
+            scores.append(float(score))
+    return event_ids, scores
+
+##############################################################################
+# Public CLASSES
+##############################################################################
+class BinaryRankedListWriter(object):
+    """
+    Streaming writer of a binary ranked list file, with the interface of the TsvRecommendationSink:
+    write(user, rec_events) (the cb_recommend recommendations) or write_ranked_list(user, event_ids, scores).
+    The records of at most buffer_users users are buffered and written to a temporary file, renamed to
+    filename on close (removed by abort): use it in a with block
+    """
+
+    # Extension of the files of this format
+    EXTENSION = BINARY_EXTENSION
+
+    def __init__(self, filename, buffer_users=SINK_BUFFER_USERS):
+        self.filename = filename
+        self.buffer_users = max(1, buffer_users)
+        self.num_users = 0
+        self._users = []
+        self._offsets = [0]
+        self._buffer = []
+        self._out_file, self._tmp_filename = open_temp_file(filename, "wb")
+        # The header is rewritten on close (with the counts)
+        self._out_file.write(np.zeros(1, dtype=HEADER_DTYPE).tobytes())
+
+    def write_ranked_list(self, user, event_ids, scores):
+        """ Write the ranked list (event ids and scores in rank order) of a user """
+        records = np.empty(len(event_ids), dtype=RECORD_DTYPE)
+        records['event_id'] = event_ids
+        records['score'] = scores
+        self._buffer.append(records)
+        self._users.append(int(user))
+        self._offsets.append(self._offsets[-1] + len(records))
+        self.num_users += 1
+        if len(self._buffer) >= self.buffer_users:
+            self.flush()
+
+    def write(self, user, rec_events):
+        """ Write the recommendations (list of {'event_id', 'similarity'}) of a user """
+        self.write_ranked_list(user, [int(rec['event_id']) for rec in rec_events],
+                               [rec['similarity'] for rec in rec_events])
+
+    def flush(self):
+        """ Write the buffered records in the (temporary) file """
+        if self._buffer:
+            self._out_file.write(np.concatenate(self._buffer).tobytes())
+        self._buffer = []
+
+    def close(self):
+        """ Write the users, the offsets and the header, then rename the temporary file to filename """
+        self.flush()
+        records_nbytes = self._offsets[-1] * RECORD_DTYPE.itemsize
+        self._out_file.write("\0" * (_get_padded_nbytes(RECORD_DTYPE, self._offsets[-1]) - records_nbytes))
+        users = np.zeros(_get_padded_nbytes(USER_DTYPE, self.num_users) // USER_DTYPE.itemsize, dtype=USER_DTYPE)
+        users[:self.num_users] = self._users
+        self._out_file.write(users.tobytes())
+        self._out_file.write(np.array(self._offsets, dtype=OFFSET_DTYPE).tobytes())
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['num_users'] = self.num_users
+        header['num_records'] = self._offsets[-1]
+        self._out_file.seek(0)
+        self._out_file.write(header.tobytes())
+        self._out_file.close()
+        commit_temp_file(self._tmp_filename, self.filename)
+
+    def abort(self):
+        """ Discard the ranked lists written so far (the temporary file is removed) """
+        self._buffer = []
+        self._out_file.close()
+        if os.path.exists(self._tmp_filename):
+            os.remove(self._tmp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @classmethod
+    def concatenate(cls, filenames, filename):
+        """ Concatenate the ranked lists of the binary files (in the given order) in filename """
+        with cls(filename) as writer:
+            for partial_filename in filenames:
+                ranked_lists = BinaryRankedLists(partial_filename)
+                for index in xrange(len(ranked_lists)):
+                    records = ranked_lists.get_records(index)
+                    writer.write_ranked_list(ranked_lists.users[index], records['event_id'], records['score'])
+
+
+class BinaryRankedLists(object):
+    """
+    Reader of a binary ranked list file: the arrays are memory-mapped (read-only)
+        users: the user ids, in the file order
+        offsets: the ranked list of users[i] is records[offsets[i]:offsets[i + 1]]
+        records: the (event_id, score) records of all users
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        header = np.fromfile(filename, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header['magic'][0] != MAGIC:
+            raise ValueError("[%s] is not a binary ranked list file" % filename)
+        num_users, num_records = int(header['num_users'][0]), int(header['num_records'][0])
+
+        offset = HEADER_DTYPE.itemsize
+        self.records = self._memmap(RECORD_DTYPE, num_records, offset)
+        offset += _get_padded_nbytes(RECORD_DTYPE, num_records)
+        self.users = self._memmap(USER_DTYPE, num_users, offset)
+        offset += _get_padded_nbytes(USER_DTYPE, num_users)
+        self.offsets = self._memmap(OFFSET_DTYPE, num_users + 1, offset)
+
+    def _memmap(self, dtype, count, offset):
+        """ Memory-map an array of the file (np.memmap does not map empty arrays) """
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def __len__(self):
+        return len(self.users)
+
+    def get_records(self, index):
+        """ The (event_id, score) records of the index-th user """
+        return self.records[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        """ Iterate over the (user_id, event_ids, scores) of every user """
+        for index in xrange(len(self)):
+            records = self.get_records(index)
+            yield int(self.users[index]), records['event_id'], records['score']
+
+# Ranked list format name -> writer class
+RANKED_LIST_WRITER_CLASSES = {'tsv': TsvRecommendationSink, 'binary': BinaryRankedListWriter}
+
+##############################################################################
+# Public FUNCTIONS
+##############################################################################
+def is_binary_ranked_list(filename):
+    """ Check if the file is a binary ranked list (by its magic) """
+    with open(filename, "rb") as ranked_list_file:
+        return ranked_list_file.read(len(MAGIC)) == MAGIC
+
+def get_ranked_list_writer_class(ranked_list_format="tsv"):
+    """ The ranked list writer class of the format ('tsv' or 'binary') """
+    return RANKED_LIST_WRITER_CLASSES[ranked_list_format]
+
+def get_ranked_list_filename(result_dir, model_name, ranked_list_format="tsv"):
+    """ The ranked list file of the model in the format ('tsv' or 'binary') """
+    return os.path.join(result_dir, model_name + get_ranked_list_writer_class(ranked_list_format).EXTENSION)
+
+def find_ranked_list_file(filename):
+    """
+    The existing ranked list file of the given file in any format (e.g. 'model.rlb' for 'model.tsv'),
+    None if there is none
+    """
+    base_filename = os.path.splitext(filename)[0]
+    for candidate in [filename] + [base_filename + writer_class.EXTENSION
+                                   for _, writer_class in sorted(RANKED_LIST_WRITER_CLASSES.items())]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def open_ranked_list_writer(filename, buffer_users=SINK_BUFFER_USERS):
+    """ The ranked list writer of the file (format given by its extension), to be used in a with block """
+    if filename.endswith(BINARY_EXTENSION):
+        return BinaryRankedListWriter(filename, buffer_users=buffer_users)
+    return TsvRecommendationSink(filename, buffer_users=buffer_users)
+
+def read_ranked_lists(filename):
+    """ Iterate over the (user_id, event_ids, scores) of a ranked list file in any format """
+    if is_binary_ranked_list(filename):
+        for user_id, event_ids, scores in BinaryRankedLists(filename):
+            yield user_id, event_ids, scores
+    else:
+        with open(filename, "r") as ranked_list_file:
+            for line in ranked_list_file:
+                row = line.rstrip("\r\n").split("\t")
+                event_ids, scores = _parse_tsv_ranked_list(row[1]) if len(row) > 1 else ([], [])
+                yield int(row[0]), event_ids, scores
+
+def convert_ranked_list(input_filename, output_filename):
+    """ Convert a ranked list file to the format of the output_filename extension (TSV <-> binary) """
+    num_users = 0
+    with open_ranked_list_writer(output_filename) as writer:
+        for user_id, event_ids, scores in read_ranked_lists(input_filename):
+            writer.write_ranked_list(user_id, event_ids, scores)
+            num_users += 1
+    LOGGER.info("Converted [%s] to [%s] (%d users)", input_filename, output_filename, num_users)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] not in ("to-binary", "to-tsv"):
+        print "usage: python ranked_list_format.py <to-binary|to-tsv> <input_file> <output_file>"
+        exit(1)
+
+    OUTPUT_EXTENSION = BINARY_EXTENSION if sys.argv[1] == "to-binary" else TSV_EXTENSION
+    if not sys.argv[3].endswith(OUTPUT_EXTENSION):
+        print "The output file must have the '%s' extension" % OUTPUT_EXTENSION
+        exit(1)
+    convert_ranked_list(sys.argv[2], sys.argv[3])
@@ -27,7 +27,10 @@ import csv
 import glob
 import sys
 
+import numpy as np
+
 from run_rec_functions import read_experiment_atts
+from ranked_list_format import read_ranked_lists, TSV_EXTENSION, BINARY_EXTENSION
 
 def read_map_event_ids(partition_dir):
     map_event_ids = {}
@@ -69,30 +72,28 @@ def read_map_user_events_test(partition_dir):
 
     return user_events
 
-def select_relevant_ranks(rank_tsv_file, relevant_rank_tsv,
+def select_relevant_ranks(ranked_lists, relevant_rank_tsv,
                           map_user_ids, map_event_ids, map_user_events_test):
+    """
+    Write the ranks of the relevant (test) events of each user ranked list (user_id, event_ids, scores),
+    see ranked_list_format.read_ranked_lists
+    """
 
-    for row in rank_tsv_file:
-        new_user_id = int(row[0])
+    for new_user_id, event_ids, scores in ranked_lists:
 
         # Get the relevant events per user
         new_event_ids_test = map_user_events_test[new_user_id]
-        ranked_events = []
+        ranked_events = set()
 
         # Check if the model was capable of predicting a ranked list or not
-        #   There is a predicted value different from ''
-        if len(row) > 1 and row[1]:
-            ranked_event_list = row[1].split(',')
+        if len(event_ids) > 0:
+            event_ids, scores = np.asarray(event_ids), np.asarray(scores)
 
             # Find the relevant events (from new_event_ids_test) in the ranked recommended list and get its ranks
-            for i in range(len(ranked_event_list)):
-                if ranked_event_list[i]:
-                    # Separate the new_event_id from the predicted score (use only the 1st one)
-                    new_event_id = int(ranked_event_list[i].split(':')[0])
-                    event_score = float(ranked_event_list[i].split(':')[1])
-                    if new_event_id in new_event_ids_test and event_score > 0:
-                        relevant_rank_tsv.writerow([map_user_ids[new_user_id], map_event_ids[new_event_id], i+1])
-                        ranked_events.append(new_event_id)
+            for i in np.flatnonzero(np.in1d(event_ids, new_event_ids_test) & (scores > 0)):
+                new_event_id = int(event_ids[i])
+                relevant_rank_tsv.writerow([map_user_ids[new_user_id], map_event_ids[new_event_id], i+1])
+                ranked_events.add(new_event_id)
 
         # IDEA: If the Model was not capable of recommeding this event to the user we consider a NA rank
         #   * Therefore, we consider ranking larger that limit (e.g. 100) the same as didn't ranking any event to the user
@@ -149,12 +150,16 @@ if __name__ == '__main__':
             if data_format == "ranks":
                 continue
 
-            # Iterate over the model result files
-            for model_rank_file_path in glob.iglob(result_partition_dir + path.sep + data_format + path.sep + "*.tsv"):
+            # Iterate over the model result files (in any ranked list format)
+            model_rank_file_paths = []
+            for extension in [TSV_EXTENSION, BINARY_EXTENSION]:
+                model_rank_file_paths += glob.glob(result_partition_dir + path.sep + data_format + path.sep + "*" + extension)
+
+            for model_rank_file_path in sorted(model_rank_file_paths):
                 if path.isdir(model_rank_file_path):
                     continue
 
-                model_rank_file = model_rank_file_path.replace(result_partition_dir + path.sep + data_format + path.sep, "").replace(".tsv", "")
+                model_rank_file = path.splitext(path.basename(model_rank_file_path))[0]
                 print '\t%s - %s' % (data_format, model_rank_file)
 
                 if path.exists(path.join(partition_rank_dir, model_rank_file + ".csv")):
@@ -164,15 +169,11 @@ if __name__ == '__main__':
                 if not path.exists(partition_rank_dir):
                     makedirs(partition_rank_dir)
 
-                with open(model_rank_file_path, 'r') as all_rank_file:
-
-                    rank_tsv_file = csv.reader(all_rank_file, delimiter='\t', quotechar='"')
-
-                    # Create the model rank file with the relevant ranks only
-                    with open(path.join(partition_rank_dir, model_rank_file + ".csv"), 'w') as relevant_rank_file:
-                        relevant_rank_tsv = csv.writer(relevant_rank_file, delimiter=',', quotechar='"')
+                # Create the model rank file with the relevant ranks only
+                with open(path.join(partition_rank_dir, model_rank_file + ".csv"), 'w') as relevant_rank_file:
+                    relevant_rank_tsv = csv.writer(relevant_rank_file, delimiter=',', quotechar='"')
 
-                        select_relevant_ranks(rank_tsv_file, relevant_rank_tsv,
-                                              map_user_ids, map_event_ids, map_user_events_test)
+                    select_relevant_ranks(read_ranked_lists(model_rank_file_path), relevant_rank_tsv,
+                                          map_user_ids, map_event_ids, map_user_events_test)
 
     print 'DONE!'
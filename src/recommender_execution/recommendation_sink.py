@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# =======================================================================
+# This file is part of MCLRE.
+#
+# MCLRE is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# MCLRE is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with MCLRE.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Copyright (C) 2015 Augusto Queiroz de Macedo <augustoqmacedo@gmail.com>
+# =======================================================================
+
+"""
+Streaming Sinks of the Recommendations
+"""
+import os
+import shutil
+import logging
+import tempfile
+
+from contextlib import contextmanager
+
+##############################################################################
+# GLOBAL VARIABLES
+##############################################################################
+logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
+                    level=logging.INFO)
+LOGGER = logging.getLogger('recommendation_sink')
+LOGGER.setLevel(logging.INFO)
+
+# Default number of users kept (formatted) in memory before a write
+SINK_BUFFER_USERS = 1000
+
+##############################################################################
+# Private FUNCTIONS
+##############################################################################
+def _get_file_mode():
+    """ The mode of a new file created by open() (0666 without the umask bits) """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0666 & ~umask
+
+##############################################################################
+# Public FUNCTIONS
+##############################################################################
+def open_temp_file(filename, mode):
+    """ Open a temporary file in the directory of filename, return the file and its path """
+    out_dir = os.path.dirname(os.path.abspath(filename))
+    out_fd, tmp_filename = tempfile.mkstemp(dir=out_dir, prefix=".%s." % os.path.basename(filename), suffix=".tmp")
+    return os.fdopen(out_fd, mode), tmp_filename
+
+def commit_temp_file(tmp_filename, filename):
+    """ Rename the (closed) temporary file to filename, with the mode of a file created by open() """
+    os.chmod(tmp_filename, _get_file_mode())
+    os.rename(tmp_filename, filename)
+
+@contextmanager
+def atomic_output_file(filename, mode="wb"):
+    """
+    Open a temporary file in the directory of filename, renamed to filename only when the
+    with block finishes without errors (removed otherwise): the file is never seen half-written
+    """
+    out_file, tmp_filename = open_temp_file(filename, mode)
+    try:
+        with out_file:
+            yield out_file
+        commit_temp_file(tmp_filename, filename)
+    except:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+@contextmanager
+def open_sinks(sink_class, filenames, buffer_users=SINK_BUFFER_USERS):
+    """
+    Open a sink_class sink per file (e.g. one per User Profile): all of them are closed when the with block
+    finishes without errors, aborted otherwise
+    """
+    sinks = []
+    try:
+        for filename in filenames:
+            sinks.append(sink_class(filename, buffer_users=buffer_users))
+        yield sinks
+    except:
+        for sink in sinks:
+            sink.abort()
+        raise
+    for sink in sinks:
+        sink.close()
+
+##############################################################################
+# Public CLASSES
+##############################################################################
+class TsvRecommendationSink(object):
+    """
+    Streaming writer of the recommendations in the TSV format of persist_recommendations:
+        <user_id>\t<event_id1>:<similarity1>,<event_id2>:<similarity2>,...
+    The lines are formatted when the user is written (one string formatting per user) and kept in a buffer
+    of at most buffer_users users, so the memory does not grow with the number of users.
+    The file is written atomically (see atomic_output_file): use it in a with block, or call close()
+    (abort() discards it)
+    """
+
+    # Extension of the files of this format
+    EXTENSION = ".tsv"
+
+    def __init__(self, filename, buffer_users=SINK_BUFFER_USERS):
+        self.filename = filename
+        self.buffer_users = max(1, buffer_users)
+        self.num_users = 0
+        self._buffer = []
+        self._record_formats = {}
+        self._out_file, self._tmp_filename = open_temp_file(filename, "wb")
+
+    def _get_record_format(self, num_recs):
+        """ The format of a line with num_recs recommendations (memoized by size) """
+        if num_recs not in self._record_formats:
+            self._record_formats[num_recs] = "%s\t" + ",".join(["%s:%.6f"] * num_recs) + "\n"
+        return self._record_formats[num_recs]
+
+    def write(self, user, rec_events):
+        """ Write the recommendations (list of {'event_id', 'similarity'}) of a user """
+        values = [user]
+        for rec in rec_events:
+            values.append(rec['event_id'])
+            values.append(rec['similarity'])
+        self._write_line(self._get_record_format(len(rec_events)) % tuple(values))
+
+    def write_ranked_list(self, user, event_ids, scores):
+        """ Write the ranked list (event ids and scores in rank order) of a user """
+        values = [user]
+        for event_id, score in zip(event_ids, scores):
+            values.append(event_id)
+            values.append(score)
+        self._write_line(self._get_record_format(len(event_ids)) % tuple(values))
+
+    def _write_line(self, line):
+        """ Buffer the formatted line of a user """
+        self._buffer.append(line)
+        self.num_users += 1
+        if len(self._buffer) >= self.buffer_users:
+            self.flush()
+
+    def flush(self):
+        """ Write the buffered lines in the (temporary) file """
+        self._out_file.write("".join(self._buffer))
+        self._buffer = []
+
+    def close(self):
+        """ Write the buffered lines and rename the temporary file to filename """
+        self.flush()
+        self._out_file.close()
+        commit_temp_file(self._tmp_filename, self.filename)
+
+    def abort(self):
+        """ Discard the recommendations written so far (the temporary file is removed) """
+        self._buffer = []
+        self._out_file.close()
+        if os.path.exists(self._tmp_filename):
+            os.remove(self._tmp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @classmethod
+    def concatenate(cls, filenames, filename):
+        """ Concatenate the files (in the given order) in filename (written atomically) """
+        with atomic_output_file(filename) as out_file:
+            for partial_filename in filenames:
+                with open(partial_filename, "rb") as partial_file:
+                    shutil.copyfileobj(partial_file, out_file)
@@ -23,14 +23,22 @@
 Run Content-Based Models
 """
 
+import shutil
 import logging
+import tempfile
 import multiprocessing
-from os import path
+import multiprocessing.pool
+from os import path, makedirs
 from argparse import ArgumentParser
 
 from run_rec_functions import read_experiment_atts
 from content_based.event_recommender import ContentBasedModelConf, UserProfileConf, PostProcessConf, \
-                                            cb_train, cb_recommend, persist_recommendations
+                                            cb_train, cb_train_incremental, cb_recommend, cb_recommend_sharded, \
+                                            read_partition_data
+from content_based.partition_data import read_test_events
+from content_based.model import EventContentModel
+from recommendation_sink import open_sinks
+from ranked_list_format import get_ranked_list_filename, get_ranked_list_writer_class, find_ranked_list_file
 
 # Define the Logging
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(name)s : %(message)s',
@@ -55,8 +63,19 @@ MODEL_NAME_PREFIX = "CB"
 POST_PROCESS_PREFIX = "PP"
 USER_PROFILE_PREFIX = "UP"
 
+# The last model bundle loaded by a User Profile worker: (bundle dir, model), see load_model_bundle
+LOADED_MODEL_BUNDLE = (None, None)
+
 # -------------------------------------------------------------------------
 # Auxiliar Functions
+def add_hash_features(cb_model_conf):
+    """ Use the hashing vocabulary of HASH_FEATURES hashes in the model (results named with the '-hash<N>' suffix) """
+    if HASH_FEATURES:
+        cb_model_conf.hyper_parameters["hash_features"] = HASH_FEATURES
+        cb_model_conf.params_name += "-hash%d" % HASH_FEATURES
+    return cb_model_conf
+
+
 def get_cb_model_confs(algorithm):
     """
     Function Generator that yields the model names to experiment
@@ -81,7 +100,7 @@ def get_cb_model_confs(algorithm):
                                                                          pre_process_name),
                                                   pre_processment=pre_process,
                                                   input_data=input_data)
-            yield cb_model_conf
+            yield add_hash_features(cb_model_conf)
 
         if algorithm == "LSI":
             pre_process = {"text":[],
@@ -96,7 +115,7 @@ def get_cb_model_confs(algorithm):
                                                                                 pre_process_name),
                                                       pre_processment=pre_process,
                                                       input_data=input_data)
-                yield cb_model_conf
+                yield add_hash_features(cb_model_conf)
 
         if algorithm == "LDA":
             pre_process = {"text":[],
@@ -106,18 +125,29 @@ def get_cb_model_confs(algorithm):
             for n_topics in num_topics:
                 for n_iterations in num_iterations:
                     for n_corpus_passes in num_corpus_passes:
+                        hyper_parameters = {"num_topics": n_topics,
+                                            "num_corpus_passes": n_corpus_passes,
+                                            "num_iterations": n_iterations}
+                        params_name = "%d-%d-%d-%s-%s" % (n_topics,
+                                                          n_corpus_passes,
+                                                          n_iterations,
+                                                          input_type_name,
+                                                          pre_process_name)
+                        if LDA_WORKERS > 1:
+                            # The multicore LDA (symmetric alpha prior) results are named apart
+                            hyper_parameters["workers"] = LDA_WORKERS
+                            params_name += "-mc%d" % LDA_WORKERS
+                        if LDA_PERPLEXITY_THRESHOLD:
+                            # Early stopping: the passes stop when the held-out perplexity converges
+                            hyper_parameters["perplexity_threshold"] = LDA_PERPLEXITY_THRESHOLD
+                            params_name += "-es%g" % LDA_PERPLEXITY_THRESHOLD
+
                         cb_model_conf = ContentBasedModelConf(algorithm=algorithm,
-                                                              hyper_parameters={"num_topics": n_topics,
-                                                                                "num_corpus_passes": n_corpus_passes,
-                                                                                "num_iterations": n_iterations},
-                                                              params_name="%d-%d-%d-%s-%s" % (n_topics,
-                                                                                              n_corpus_passes,
-                                                                                              n_iterations,
-                                                                                              input_type_name,
-                                                                                              pre_process_name),
+                                                              hyper_parameters=hyper_parameters,
+                                                              params_name=params_name,
                                                               pre_processment=pre_process,
                                                               input_data=input_data)
-                        yield cb_model_conf
+                        yield add_hash_features(cb_model_conf)
 
 
 def get_post_process_confs():
@@ -177,18 +207,116 @@ def get_user_profile_confs():
     # yield user_profile_conf
 
 
+def get_model_profile_name(cb_model_conf, post_process_conf, user_profile_conf):
+    """ The name of the recommendation results of a model + post-processment + user profile """
+    return "%s-%s:%s-%s:%s-%s_%s:%s:%s" % (MODEL_NAME_PREFIX,
+                                           cb_model_conf.algorithm,
+                                           POST_PROCESS_PREFIX,
+                                           post_process_conf.name,
+                                           USER_PROFILE_PREFIX,
+                                           user_profile_conf.name,
+                                           cb_model_conf.params_name,
+                                           post_process_conf.params_name,
+                                           user_profile_conf.params_name)
+
+
+def set_ann_params(cb_model):
+    """ Set the approximate query index parameters (ANN_PARAMS), the index is rebuilt if they changed """
+    if cb_model.ann_params != ANN_PARAMS:
+        cb_model.ann_params = ANN_PARAMS
+        cb_model.corpus_query_index = None
+
+
+def get_rec_result_filename(rec_result_dir, model_profile_name):
+    """ The recommendations file of the model + user profile (in the RANKED_LIST_FORMAT) """
+    return get_ranked_list_filename(rec_result_dir, model_profile_name, RANKED_LIST_FORMAT)
+
+
+def is_experimented(rec_result_dir, model_profile_name):
+    """ Check if the model + user profile has recommendation results (in any ranked list format) """
+    return find_ranked_list_file(get_rec_result_filename(rec_result_dir, model_profile_name)) is not None
+
+
+def recommend_and_persist(cb_model, user_profile_conf, dict_event_content, db_partition_dir, partition,
+                          model_profile_name, rec_result_dir, partition_data=None):
+    """
+    Recommend to the test users (in RECOMMEND_SHARDS shards, if > 1) and persist the recommendations
+    (in the RANKED_LIST_FORMAT)
+    If user_profile_conf and model_profile_name are lists all the User Profiles are recommended in a single pass
+    (see cb_recommend), each one persisted in its own file
+    """
+    sink_class = get_ranked_list_writer_class(RANKED_LIST_FORMAT)
+    recommend_params = {'query_block_size': QUERY_BLOCK_SIZE,
+                        'vectorized_profiles': VECTORIZED_PROFILES,
+                        'event_embeddings': EVENT_EMBEDDINGS,
+                        'inference_workers': LDA_INFERENCE_WORKERS}
+    if RECOMMEND_SHARDS > 1:
+        cb_recommend_sharded(cb_model, user_profile_conf, dict_event_content, db_partition_dir, partition,
+                             model_profile_name, rec_result_dir, RECOMMEND_SHARDS, partition_data=partition_data,
+                             sink_class=sink_class, sink_buffer_users=SINK_BUFFER_USERS, **recommend_params)
+    else:
+        # The recommendations are streamed to the file (written atomically, see TsvRecommendationSink)
+        if not path.exists(rec_result_dir):
+            makedirs(rec_result_dir)
+        multi_profile = isinstance(user_profile_conf, list)
+        model_profile_names = model_profile_name if multi_profile else [model_profile_name]
+        with open_sinks(sink_class, [get_rec_result_filename(rec_result_dir, profile_name)
+                                     for profile_name in model_profile_names],
+                        buffer_users=SINK_BUFFER_USERS) as sinks:
+            cb_recommend(cb_model, user_profile_conf, dict_event_content, db_partition_dir, partition,
+                         partition_data=partition_data, sink=sinks if multi_profile else sinks[0],
+                         **recommend_params)
+
+
 #
 # Parallelism Functions
 #
+class NoDaemonProcess(multiprocessing.Process):
+    """ Process that is never daemonic, so it can have children processes (e.g. the multicore LDA workers) """
+
+    def _get_daemon(self):
+        return False
+
+    def _set_daemon(self, value):
+        pass
+
+    daemon = property(_get_daemon, _set_daemon)
+
+
+class NoDaemonPool(multiprocessing.pool.Pool):
+    """ Pool of NoDaemonProcess """
+    Process = NoDaemonProcess
+
+
+def create_experiment_pool(num_processes, work_processes=None):
+    """
+    The Pool of the experiment works: with the multicore LDA (or the multi-process LDA inference or recommendation)
+    its processes must be non-daemonic and the pool is shrunk, so it uses num_processes cores in total
+    (each work uses up to work_processes cores, default: max(LDA_WORKERS, LDA_INFERENCE_WORKERS, RECOMMEND_SHARDS))
+    """
+    if work_processes is None:
+        work_processes = max(LDA_WORKERS, LDA_INFERENCE_WORKERS, RECOMMEND_SHARDS)
+    if work_processes > 1:
+        return NoDaemonPool(max(1, num_processes // work_processes))
+    return multiprocessing.Pool(num_processes)
+
+
+def get_partition_dirs(partition, partitioned_region_data_dir, experiment_region_data_dir):
+    """ The partition data dir and the recommendation results dir """
+    part_name = "partition_%d" % partition
+
+    db_partition_dir = path.join(partitioned_region_data_dir, part_name,
+                                 "content_based_models")
+    rec_result_dir = path.join(experiment_region_data_dir, "recommendations",
+                               part_name, "content_based_models")
+    return db_partition_dir, rec_result_dir
+
+
 def get_models_to_experiment(partitions, algorithms, partitioned_region_data_dir, experiment_region_data_dir):
     """ Work Creator """
     for partition in partitions:
-        part_name = "partition_%d" % partition
-
-        db_partition_dir = path.join(partitioned_region_data_dir, part_name,
-                                     "content_based_models")
-        rec_result_dir = path.join(experiment_region_data_dir, "recommendations",
-                                   part_name, "content_based_models")
+        db_partition_dir, rec_result_dir = get_partition_dirs(partition, partitioned_region_data_dir,
+                                                              experiment_region_data_dir)
 
         for algorithm in algorithms:
             for cb_model_conf in get_cb_model_confs(algorithm):
@@ -196,34 +324,241 @@ def get_models_to_experiment(partitions, algorithms, partitioned_region_data_dir
                     yield (partition, db_partition_dir, rec_result_dir, cb_model_conf, post_process_conf)
 
 
+def get_incremental_models_to_experiment(partitions, algorithms, partitioned_region_data_dir,
+                                         experiment_region_data_dir):
+    """ Work Creator (incremental training): one work per model, over all the (ascending) partitions """
+    partition_dirs = [(partition,) + get_partition_dirs(partition, partitioned_region_data_dir,
+                                                        experiment_region_data_dir)
+                      for partition in sorted(partitions)]
+    for algorithm in algorithms:
+        for cb_model_conf in get_cb_model_confs(algorithm):
+            for post_process_conf in get_post_process_confs():
+                yield (partition_dirs, cb_model_conf, post_process_conf)
+
+
+def recommend_and_persist_profiles(cb_model, user_profile_confs, model_profile_names, dict_event_content,
+                                   db_partition_dir, partition, rec_result_dir, partition_data=None):
+    """
+    Recommend with the User Profiles: in a single pass over the test users if MULTI_PROFILE,
+    one recommendation per User Profile otherwise
+    """
+    if MULTI_PROFILE and len(user_profile_confs) > 1:
+        recommend_and_persist(cb_model, user_profile_confs, dict_event_content, db_partition_dir, partition,
+                              model_profile_names, rec_result_dir, partition_data=partition_data)
+    else:
+        for user_profile_conf, model_profile_name in zip(user_profile_confs, model_profile_names):
+            recommend_and_persist(cb_model, user_profile_conf, dict_event_content, db_partition_dir, partition,
+                                  model_profile_name, rec_result_dir, partition_data=partition_data)
+
+
 def create_models_and_recommend((partition, db_partition_dir, rec_result_dir, cb_model_conf, post_process_conf)):
     """ Worker Executor (as parameter it expects a single tuple with all the arguments inside of it """
     cb_model = None
     dict_event_content = None
+    model_bundle_dir = None
+    if MODELS_DIR:
+        model_bundle_dir = get_model_bundle_dir(MODELS_DIR, partition, cb_model_conf, post_process_conf)
+    user_profile_confs, model_profile_names = [], []
     for user_profile_conf in get_user_profile_confs():
-        model_profile_name = "%s-%s:%s-%s:%s-%s_%s:%s:%s" % (MODEL_NAME_PREFIX,
-                                                             cb_model_conf.algorithm,
-                                                             POST_PROCESS_PREFIX,
-                                                             post_process_conf.name,
-                                                             USER_PROFILE_PREFIX,
-                                                             user_profile_conf.name,
-                                                             cb_model_conf.params_name,
-                                                             post_process_conf.params_name,
-                                                             user_profile_conf.params_name)
-
+        model_profile_name = get_model_profile_name(cb_model_conf, post_process_conf, user_profile_conf)
 
         LOGGER.info("%s - partition %d - %s", REGION, partition, model_profile_name)
 
-        if path.exists(path.join(rec_result_dir, model_profile_name + ".tsv")):
+        if is_experimented(rec_result_dir, model_profile_name):
             LOGGER.info("Model already experimented (DONE!)")
         else:
-            if not cb_model:
-                cb_model, dict_event_content = cb_train(cb_model_conf, post_process_conf, db_partition_dir)
+            user_profile_confs.append(user_profile_conf)
+            model_profile_names.append(model_profile_name)
+    if not user_profile_confs:
+        return
+
+    if model_bundle_dir:
+        cb_model = EventContentModel.load_bundle(model_bundle_dir, mmap='r')
+        if cb_model:
+            LOGGER.info("Model loaded from the bundle [%s]", model_bundle_dir)
+            dict_event_content = {}
+    if not cb_model:
+        corpus_dir = None
+        if CORPUS_DIR:
+            corpus_dir = path.join(CORPUS_DIR, "partition_%d" % partition,
+                                   "%s_%s_%s" % (cb_model_conf.algorithm, cb_model_conf.params_name,
+                                                 post_process_conf.params_name))
+        cb_model, dict_event_content = cb_train(cb_model_conf, post_process_conf, db_partition_dir,
+                                                single_pass=SINGLE_PASS,
+                                                tokenize_workers=TOKENIZE_WORKERS,
+                                                corpus_dir=corpus_dir,
+                                                token_cache_dir=TOKEN_CACHE_DIR,
+                                                token_cache_bytes=TOKEN_CACHE_BYTES)
+
+    set_ann_params(cb_model)
+    recommend_and_persist_profiles(cb_model, user_profile_confs, model_profile_names, dict_event_content,
+                                   db_partition_dir, partition, rec_result_dir)
+
+    # Save the trained (and indexed) model to be reused by the next runs
+    if model_bundle_dir and not path.exists(model_bundle_dir):
+        LOGGER.info("Saving the model bundle [%s]", model_bundle_dir)
+        cb_model.save_bundle(model_bundle_dir)
+
+
+def create_models_and_recommend_incremental((partition_dirs, cb_model_conf, post_process_conf)):
+    """
+    Worker Executor (incremental training): the model of a partition is the model of the previous
+    partition updated with the new events only, so the results are named with the '-inc' params suffix
+    """
+    inc_model_conf = ContentBasedModelConf(algorithm=cb_model_conf.algorithm,
+                                           hyper_parameters=cb_model_conf.hyper_parameters,
+                                           params_name="%s-inc" % cb_model_conf.params_name,
+                                           pre_processment=cb_model_conf.pre_processment,
+                                           input_data=cb_model_conf.input_data)
+    cb_model = None
+    for partition, db_partition_dir, rec_result_dir in partition_dirs:
+        LOGGER.info("%s - partition %d - incremental training", REGION, partition)
+        cb_model, dict_event_content = cb_train_incremental(cb_model, inc_model_conf, post_process_conf,
+                                                            db_partition_dir, measure_drift=MEASURE_DRIFT,
+                                                            token_cache_dir=TOKEN_CACHE_DIR,
+                                                            token_cache_bytes=TOKEN_CACHE_BYTES)
+        set_ann_params(cb_model)
+
+        user_profile_confs, model_profile_names = [], []
+        for user_profile_conf in get_user_profile_confs():
+            model_profile_name = get_model_profile_name(inc_model_conf, post_process_conf, user_profile_conf)
+            LOGGER.info("%s - partition %d - %s", REGION, partition, model_profile_name)
+
+            if is_experimented(rec_result_dir, model_profile_name):
+                LOGGER.info("Model already experimented (DONE!)")
+                continue
+            user_profile_confs.append(user_profile_conf)
+            model_profile_names.append(model_profile_name)
 
-            dict_user_rec_events = cb_recommend(cb_model, user_profile_conf,
-                                                dict_event_content, db_partition_dir, partition)
+        recommend_and_persist_profiles(cb_model, user_profile_confs, model_profile_names, dict_event_content,
+                                       db_partition_dir, partition, rec_result_dir)
 
-            persist_recommendations(dict_user_rec_events, model_profile_name, rec_result_dir)
+
+#
+# Train once and fan out the User Profiles
+#
+def get_model_bundle_dir(models_dir, partition, cb_model_conf, post_process_conf):
+    """ The directory of the model bundle of a partition + model + post-processment """
+    return path.join(models_dir, "partition_%d" % partition,
+                     "%s-%s:%s-%s_%s:%s" % (MODEL_NAME_PREFIX, cb_model_conf.algorithm,
+                                            POST_PROCESS_PREFIX, post_process_conf.name,
+                                            cb_model_conf.params_name, post_process_conf.params_name))
+
+
+def get_pending_user_profile_confs(rec_result_dir, cb_model_conf, post_process_conf):
+    """ The User Profiles not experimented yet (i.e. without recommendation results) """
+    return [user_profile_conf for user_profile_conf in get_user_profile_confs()
+            if not is_experimented(rec_result_dir,
+                                   get_model_profile_name(cb_model_conf, post_process_conf, user_profile_conf))]
+
+
+def train_and_save_model((partition, db_partition_dir, rec_result_dir, cb_model_conf, post_process_conf, models_dir)):
+    """
+    Worker Executor (phase 1): train the model, index the test events and save its bundle
+    (if it isn't saved yet)
+    """
+    model_bundle_dir = get_model_bundle_dir(models_dir, partition, cb_model_conf, post_process_conf)
+    if not get_pending_user_profile_confs(rec_result_dir, cb_model_conf, post_process_conf) or \
+       path.exists(model_bundle_dir):
+        return
+
+    LOGGER.info("%s - partition %d - training %s %s", REGION, partition, cb_model_conf.algorithm,
+                cb_model_conf.params_name)
+    cb_model, _ = cb_train(cb_model_conf, post_process_conf, db_partition_dir,
+                           single_pass=True, tokenize_workers=TOKENIZE_WORKERS,
+                           token_cache_dir=TOKEN_CACHE_DIR, token_cache_bytes=TOKEN_CACHE_BYTES)
+    set_ann_params(cb_model)
+    # The query index is saved in the bundle, so the User Profile workers do not build it again
+    LOGGER.info("Creating the Index to submit the User Profile Queries")
+    cb_model.index_events(read_test_events(db_partition_dir))
+    LOGGER.info("Saving the model bundle [%s]", model_bundle_dir)
+    cb_model.save_bundle(model_bundle_dir)
+
+
+def load_model_bundle(model_bundle_dir, db_partition_dir, partition):
+    """
+    The model of the bundle (memory-mapped, so its pages are shared by all workers through the page cache)
+    and the partition data, both kept for the next tasks of the same model in this process
+    (only the last model is kept, the partition data is memoized by read_partition_data)
+    """
+    global LOADED_MODEL_BUNDLE
+
+    if LOADED_MODEL_BUNDLE[0] != model_bundle_dir:
+        # The previous model is released before the next one is loaded
+        LOADED_MODEL_BUNDLE = (None, None)
+        cb_model = EventContentModel.load_bundle(model_bundle_dir, mmap='r')
+        set_ann_params(cb_model)
+        LOADED_MODEL_BUNDLE = (model_bundle_dir, cb_model)
+    cb_model = LOADED_MODEL_BUNDLE[1]
+
+    partition_data = read_partition_data(db_partition_dir, partition)
+    if cb_model.corpus_query_index is None or cb_model.index_event_ids != partition_data['test_events']:
+        LOGGER.info("Creating the Index to submit the User Profile Queries")
+        cb_model.index_events(partition_data['test_events'])
+    return cb_model, partition_data
+
+
+def recommend_model_profiles((partition, db_partition_dir, rec_result_dir, cb_model_conf, post_process_conf,
+                              model_bundle_dir, user_profile_confs)):
+    """
+    Worker Executor (phase 2): recommend with the saved model and the User Profiles of the task
+    (one User Profile, or all the pending ones in a single pass if MULTI_PROFILE)
+    """
+    cb_model, partition_data = load_model_bundle(model_bundle_dir, db_partition_dir, partition)
+    model_profile_names = [get_model_profile_name(cb_model_conf, post_process_conf, user_profile_conf)
+                           for user_profile_conf in user_profile_confs]
+    for model_profile_name in model_profile_names:
+        LOGGER.info("%s - partition %d - %s", REGION, partition, model_profile_name)
+
+    recommend_and_persist_profiles(cb_model, user_profile_confs, model_profile_names, {}, db_partition_dir,
+                                   partition, rec_result_dir, partition_data=partition_data)
+
+
+def train_once_and_fan_out_profiles(experiment_work, models_dir, num_processes):
+    """
+    Scheduler that trains each model exactly once and recommends with all User Profiles concurrently:
+        1) The models are trained (in parallel), indexed and saved as bundles in models_dir
+        2) The (model, User Profile) pairs of all models are recommended by a single Pool, so it is kept full
+           while there are pairs left: each worker loads the bundle (memory-mapped) and the partition data
+           once per model and reuses them for the next pairs of the same model
+           (with MULTI_PROFILE the task is the model, with all its User Profiles in a single pass)
+    """
+    experiment_work = [work + (models_dir,) for work in experiment_work]
+    if num_processes > 1:
+        training_pool = create_experiment_pool(num_processes)
+        training_pool.map(train_and_save_model, experiment_work)
+        training_pool.close()
+        training_pool.join()
+    else:
+        for work in experiment_work:
+            train_and_save_model(work)
+
+    # The tasks of a model are consecutive, so a worker tends to get the pairs of the model it has loaded
+    profile_tasks = []
+    for partition, db_partition_dir, rec_result_dir, cb_model_conf, post_process_conf, _ in experiment_work:
+        user_profile_confs = get_pending_user_profile_confs(rec_result_dir, cb_model_conf, post_process_conf)
+        if not user_profile_confs:
+            LOGGER.info("%s - partition %d - %s %s already experimented (DONE!)", REGION, partition,
+                        cb_model_conf.algorithm, cb_model_conf.params_name)
+            continue
+
+        model_bundle_dir = get_model_bundle_dir(models_dir, partition, cb_model_conf, post_process_conf)
+        task_profile_confs = [user_profile_confs] if MULTI_PROFILE else [[user_profile_conf]
+                                                                         for user_profile_conf in user_profile_confs]
+        for profile_confs in task_profile_confs:
+            profile_tasks.append((partition, db_partition_dir, rec_result_dir, cb_model_conf, post_process_conf,
+                                  model_bundle_dir, profile_confs))
+
+    if num_processes > 1 and len(profile_tasks) > 1:
+        # Only the LDA inference and the recommendation shards use more processes in this phase
+        profile_pool = create_experiment_pool(min(num_processes, len(profile_tasks)),
+                                              max(LDA_INFERENCE_WORKERS, RECOMMEND_SHARDS))
+        profile_pool.map(recommend_model_profiles, profile_tasks, chunksize=1)
+        profile_pool.close()
+        profile_pool.join()
+    else:
+        for profile_task in profile_tasks:
+            recommend_model_profiles(profile_task)
 
 
 if __name__ == "__main__":
@@ -240,12 +575,95 @@ if __name__ == "__main__":
                         help="The algorithm to experiment (i.e. TFIDF, LDA or LSI)")
     PARSER.add_argument("--not-parallel", dest="not_parallel", action="store_true",
                         help="Not-Parallel!")
+    PARSER.add_argument("--single-pass", dest="single_pass", action="store_true",
+                        help="Tokenize each event only once while building the corpus (lower memory and time)")
+    PARSER.add_argument("--tokenize-workers", dest="tokenize_workers", type=int, default=1,
+                        help="Number of processes that tokenize the event corpus (used with --not-parallel)")
+    PARSER.add_argument("--corpus-dir", dest="corpus_dir", type=str, default=None,
+                        help="Directory where the corpora of bows are stored and memory-mapped (default: in RAM)")
+    PARSER.add_argument("--token-cache-dir", dest="token_cache_dir", type=str, default=None,
+                        help="Directory of the on-disk cache of pre-processed events, shared by all partitions, "
+                             "algorithms and processes (default: no cache)")
+    PARSER.add_argument("--token-cache-mb", dest="token_cache_mb", type=int, default=None,
+                        help="Disk budget of the token cache in MB (allocated disk blocks, at least one block per event), "
+                             "the least recently used events are evicted (default: unlimited)")
+    PARSER.add_argument("--query-block-size", dest="query_block_size", type=int, default=None,
+                        help="Query the user profiles in blocks of this size (default: one user at a time)")
+    PARSER.add_argument("--vectorized-profiles", dest="vectorized_profiles", action="store_true",
+                        help="Create the User Profiles of all test users at once (sparse matrix products) "
+                             "instead of one user at a time")
+    PARSER.add_argument("--event-embeddings", dest="event_embeddings", action="store_true",
+                        help="Create the LSI User Profiles as weighted sums of the precomputed event vectors "
+                             "(vectorized, approximate with the TFIDF chain: the error is logged)")
+    PARSER.add_argument("--lda-inference-workers", dest="lda_inference_workers", type=int, default=1,
+                        help="Number of processes of the batched LDA inference of the vectorized User Profiles "
+                             "(see --vectorized-profiles), the experiment Pool is shrunk accordingly")
+    PARSER.add_argument("--recommend-shards", dest="recommend_shards", type=int, default=1,
+                        help="Split the test users of each recommendation in this number of shards recommended "
+                             "in parallel (same results), the experiment Pool is shrunk accordingly")
+    PARSER.add_argument("--sink-buffer-users", dest="sink_buffer_users", type=int, default=1000,
+                        help="Number of users whose recommendations are kept in memory before being written")
+    PARSER.add_argument("--ranked-list-format", dest="ranked_list_format", type=str, default="tsv",
+                        choices=["tsv", "binary"],
+                        help="Format of the recommendation files: 'tsv' (legacy) or 'binary' (compact, see "
+                             "ranked_list_format.py)")
+    PARSER.add_argument("--multi-profile", dest="multi_profile", action="store_true",
+                        help="Recommend with all User Profiles of a model in a single pass over the test users "
+                             "(the user histories gathered once, the queries of a user scored as one batch)")
+    PARSER.add_argument("--models-dir", dest="models_dir", type=str, default=None,
+                        help="Directory of the trained model bundles: they are loaded (memory-mapped) instead of "
+                             "retrained, and saved after training")
+    PARSER.add_argument("--fan-out-profiles", dest="fan_out_profiles", action="store_true",
+                        help="Train each model once (saved in --models-dir or in a temporary dir) and recommend "
+                             "with all the User Profiles concurrently, sharing the model read-only")
+    PARSER.add_argument("--lda-workers", dest="lda_workers", type=int, default=1,
+                        help="Number of processes of each LDA training (multicore LDA, results named with the "
+                             "'-mc<workers>' suffix), the experiment Pool is shrunk accordingly")
+    PARSER.add_argument("--lda-perplexity-threshold", dest="lda_perplexity_threshold", type=float, default=None,
+                        help="Stop the LDA passes when the held-out perplexity relative improvement is below this "
+                             "threshold, e.g. 0.01 (results named with the '-es<threshold>' suffix)")
+    PARSER.add_argument("--hash-features", dest="hash_features", type=int, default=None,
+                        help="Use a hashing vocabulary of this number of hashes, e.g. 262144 (no dictionary pass)")
+    PARSER.add_argument("--ann-clusters", dest="ann_clusters", type=int, default=None,
+                        help="Query the LSI/LDA models with an approximate (IVF) index of this number of "
+                             "clusters (default: exact index)")
+    PARSER.add_argument("--ann-nprobe", dest="ann_nprobe", type=int, default=8,
+                        help="Number of clusters probed by each query of the approximate index "
+                             "(higher = better recall and slower)")
+    PARSER.add_argument("--incremental", action="store_true",
+                        help="Train the model of each partition by updating the previous partition's model "
+                             "with the new events only (results named with the '-inc' suffix)")
+    PARSER.add_argument("--measure-drift", dest="measure_drift", action="store_true",
+                        help="In incremental mode, also retrain each partition from scratch and log the drift")
     ARGS = PARSER.parse_args()
 
     EXPERIMENT_NAME = ARGS.experiment_name
     REGION = ARGS.region
     ALGORITHMS = ARGS.algorithms
     PARALLEL_EXECUTION = not ARGS.not_parallel
+    SINGLE_PASS = ARGS.single_pass
+    TOKENIZE_WORKERS = ARGS.tokenize_workers
+    CORPUS_DIR = ARGS.corpus_dir
+    TOKEN_CACHE_DIR = ARGS.token_cache_dir
+    TOKEN_CACHE_BYTES = ARGS.token_cache_mb * 1024 * 1024 if ARGS.token_cache_mb else None
+    QUERY_BLOCK_SIZE = ARGS.query_block_size
+    VECTORIZED_PROFILES = ARGS.vectorized_profiles
+    EVENT_EMBEDDINGS = ARGS.event_embeddings
+    RECOMMEND_SHARDS = ARGS.recommend_shards
+    SINK_BUFFER_USERS = ARGS.sink_buffer_users
+    RANKED_LIST_FORMAT = ARGS.ranked_list_format
+    MULTI_PROFILE = ARGS.multi_profile
+    MODELS_DIR = ARGS.models_dir
+    FAN_OUT_PROFILES = ARGS.fan_out_profiles
+    INCREMENTAL = ARGS.incremental
+    LDA_WORKERS = ARGS.lda_workers if "LDA" in ARGS.algorithms else 1
+    LDA_INFERENCE_WORKERS = ARGS.lda_inference_workers if "LDA" in ARGS.algorithms else 1
+    LDA_PERPLEXITY_THRESHOLD = ARGS.lda_perplexity_threshold
+    HASH_FEATURES = ARGS.hash_features
+    ANN_PARAMS = None
+    if ARGS.ann_clusters:
+        ANN_PARAMS = {'num_clusters': ARGS.ann_clusters, 'nprobe': ARGS.ann_nprobe}
+    MEASURE_DRIFT = ARGS.measure_drift
 
     DATA_DIR = "data"
     PARTITIONED_REGION_DATA_DIR = path.join(DATA_DIR, "partitioned_data", REGION)
@@ -258,16 +676,30 @@ if __name__ == "__main__":
     # Read the experiment attributes
     PARTITIONS = read_experiment_atts(EXPERIMENT_DIR)["partitions"]
 
-    if PARALLEL_EXECUTION:
-        # Define the Multiprocessing Pool (with size equals to CPU_COUNT -1)
-        EXPERIMENT_POOL = multiprocessing.Pool(multiprocessing.cpu_count() - 1)
+    if INCREMENTAL:
+        # The partitions of a model are chained, so the work unit is the model (over all partitions)
+        WORKER = create_models_and_recommend_incremental
+        EXPERIMENT_WORK = get_incremental_models_to_experiment(PARTITIONS, ALGORITHMS,
+                                                               PARTITIONED_REGION_DATA_DIR,
+                                                               EXPERIMENT_REGION_DATA_DIR)
+    else:
+        WORKER = create_models_and_recommend
+        EXPERIMENT_WORK = get_models_to_experiment(PARTITIONS, ALGORITHMS,
+                                                   PARTITIONED_REGION_DATA_DIR, EXPERIMENT_REGION_DATA_DIR)
+
+    if FAN_OUT_PROFILES and not INCREMENTAL:
+        SHARED_MODELS_DIR = MODELS_DIR or tempfile.mkdtemp(prefix="cb_models_")
+        train_once_and_fan_out_profiles(EXPERIMENT_WORK, SHARED_MODELS_DIR,
+                                        multiprocessing.cpu_count() - 1 if PARALLEL_EXECUTION else 1)
+        if not MODELS_DIR:
+            shutil.rmtree(SHARED_MODELS_DIR)
+    elif PARALLEL_EXECUTION:
+        # Define the Multiprocessing Pool (with size equals to (CPU_COUNT -1) / LDA_WORKERS)
+        EXPERIMENT_POOL = create_experiment_pool(multiprocessing.cpu_count() - 1)
         # Starts the multiple processes
-        EXPERIMENT_POOL.map(create_models_and_recommend,
-                            get_models_to_experiment(PARTITIONS, ALGORITHMS,
-                                                     PARTITIONED_REGION_DATA_DIR, EXPERIMENT_REGION_DATA_DIR))
+        EXPERIMENT_POOL.map(WORKER, EXPERIMENT_WORK)
     else:
-        for experiment_data in get_models_to_experiment(PARTITIONS, ALGORITHMS,
-                                                        PARTITIONED_REGION_DATA_DIR, EXPERIMENT_REGION_DATA_DIR):
-            create_models_and_recommend(experiment_data)
+        for experiment_data in EXPERIMENT_WORK:
+            WORKER(experiment_data)
 
     LOGGER.info("DONE!")
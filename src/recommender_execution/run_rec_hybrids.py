@@ -31,6 +31,7 @@ from argparse import ArgumentParser
 from run_rec_functions import read_experiment_atts
 from hybrids.merge_ranked_lists_mr import merge_ranked_lists, MissingDataError
 import hybrids.learning_to_rank.ranklib_recommender as ranklib
+from ranked_list_format import find_ranked_list_file, get_ranked_list_filename
 
 ##############################################################################
 # GLOBAL VARIABLES
@@ -248,8 +249,9 @@ def create_models_and_recommend((model_conf, partitioned_region_data_dir, rec_re
 
     LOGGER.info("%s", model_conf.model_name)
 
-    if os.path.exists(os.path.join(rec_region_data_dir, test_partition_name,
-                                   rec_result_dir, model_conf.model_name + ".tsv")):
+    if find_ranked_list_file(get_ranked_list_filename(os.path.join(rec_region_data_dir, test_partition_name,
+                                                                   rec_result_dir),
+                                                      model_conf.model_name, RANKED_LIST_FORMAT)):
         LOGGER.info("Model already experimented (DONE!)")
     else:
         LOGGER.info(">> TEST %s", test_partition_name)
@@ -259,7 +261,8 @@ def create_models_and_recommend((model_conf, partitioned_region_data_dir, rec_re
         partition_dir = os.path.join(partitioned_region_data_dir, test_partition_name)
 
         ranklib.train_and_predict(model_conf, ENSEMBLE_LIST,
-                                  train_features_file, test_features_file, hybrids_dir, partition_dir)
+                                  train_features_file, test_features_file, hybrids_dir, partition_dir,
+                                  ranked_list_format=RANKED_LIST_FORMAT)
 
 
 
@@ -278,12 +281,17 @@ if __name__ == '__main__':
                         help="The algorithms to execute (e.g. COORDINATE-ASCENT)")
     PARSER.add_argument("-p", "--max-parallel", type=int, default=multiprocessing.cpu_count() - 1,
                         help="Parallelism!")
+    PARSER.add_argument("--ranked-list-format", dest="ranked_list_format", type=str, default="tsv",
+                        choices=["tsv", "binary"],
+                        help="Format of the recommendation files: 'tsv' (legacy) or 'binary' (compact, see "
+                             "ranked_list_format.py)")
     ARGS = PARSER.parse_args()
 
     EXPERIMENT_NAME = ARGS.experiment_name
     REGION = ARGS.region
     ALGORITHMS = ARGS.algorithms
     MAX_PARALLEL = ARGS.max_parallel
+    RANKED_LIST_FORMAT = ARGS.ranked_list_format
 
 
     DATA_DIR = "data"
@@ -66,11 +66,16 @@ if __name__ == '__main__':
                         help="The data Region (e.g. san_jose)")
     PARSER.add_argument("-a", "--algorithm", type=str, required=True,
                         help="The algorithm name (used only to differenciate our proposed MRBPR to the others")
+    PARSER.add_argument("--ranked-list-format", dest="ranked_list_format", type=str, default="tsv",
+                        choices=["tsv", "binary"],
+                        help="Format of the recommendation files: 'tsv' (legacy) or 'binary' (compact, see "
+                             "ranked_list_format.py)")
     ARGS = PARSER.parse_args()
 
     EXPERIMENT_NAME = ARGS.experiment_name
     REGION = ARGS.region
     ALGORITHM_NAME = ARGS.algorithm
+    RANKED_LIST_FORMAT = ARGS.ranked_list_format
 
     LOGGER.info(ALGORITHM_NAME)
 
@@ -141,6 +146,6 @@ if __name__ == '__main__':
         REGULARIZATION_PER_ENTITY, REGULARIZATION_PER_RELATION,
         RELATION_WEIGHTS_FILE, TRAIN_RELATION_FILES,
         PARTITIONS, NUM_ITERATIONS, NUM_FACTORS, LEARN_RATES,
-        MRBPR_BIN_PATH, PARALLEL_RUNS, ALGORITHM_NAME)
+        MRBPR_BIN_PATH, PARALLEL_RUNS, ALGORITHM_NAME, RANKED_LIST_FORMAT)
 
     LOGGER.info("DONE!")